@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pyMail 性能基准测试
+
+在本机启动模拟的 IMAP / SMTP 服务器，写入合成邮件语料（大量小邮件、深层嵌套
+multipart、大附件、CJK 编码邮件头），测量 getMailInfo、search*、setMailInfo 和
+sendMail 的 消息数/秒、字节数/秒、网络往返次数和峰值内存（RSS）。
+
+每个场景在独立的子进程中运行，峰值 RSS 只包含客户端，不包含模拟服务器和语料。
+往返次数由服务器统计：读完一条命令后客户端没有更多数据在途（即客户端正在等待
+应答）时计一次。
+
+模拟服务器（FakeMailbox、FakeIMAPHandler、FakeSMTPHandler）在 fake_servers.py 中，也用于 test_behavior.py 中的行为测试。
+
+用法:
+    python benchmark.py                  # 运行全部场景
+    python benchmark.py --quick          # 缩小语料，快速检查
+    python benchmark.py --only search    # 只运行名称包含 search 的场景
+    python benchmark.py --json out.json  # 同时把结果写入 JSON 文件
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from email.header import Header
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email import encoders
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import pyMail
+from fake_servers import (LOREM, FakeIMAPHandler, FakeMailbox, FakeSMTPHandler, ServerStats, make_small,
+                          message_date, start_server, to_bytes)
+
+
+# ==================== 合成语料 ====================
+
+_CJK_TEXT = '季度报告显示项目进展顺利，请各位同事查阅附件并在周五之前反馈意见。'
+
+
+def _attachment(data, filename):
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(data)
+    encoders.encode_base64(part)
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    return part
+
+
+def make_multipart(i, depth=8):
+    """深层嵌套 multipart：每层一个 multipart/alternative 正文和一个小附件"""
+    rng = random.Random(i)
+    inner = MIMEText('leaf %d' % i, 'plain', 'utf-8')
+    for level in range(depth):
+        outer = MIMEMultipart('mixed')
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText('level %d\n%s' % (level, LOREM), 'plain', 'utf-8'))
+        alternative.attach(MIMEText('<p>level %d</p><p>%s</p>' % (level, LOREM), 'html', 'utf-8'))
+        outer.attach(alternative)
+        outer.attach(inner)
+        outer.attach(_attachment(bytes(rng.getrandbits(8) for _ in range(512)), 'level%d.bin' % level))
+        inner = outer
+    inner['From'] = 'nested@example.com'
+    inner['To'] = 'team@example.com'
+    inner['Subject'] = 'Nested multipart #%d' % i
+    inner['Date'] = message_date(i)
+    return to_bytes(inner)
+
+
+def make_attachment(i, size):
+    """大附件：一个文本正文和一个 size 字节的 base64 附件"""
+    msg = MIMEMultipart()
+    msg['From'] = 'archive@example.com'
+    msg['To'] = 'team@example.com'
+    msg['Subject'] = 'Large attachment #%d' % i
+    msg['Date'] = message_date(i)
+    msg.attach(MIMEText('See attached.', 'plain', 'utf-8'))
+    msg.attach(_attachment(os.urandom(size), 'dump%d.bin' % i))
+    return to_bytes(msg)
+
+
+def make_cjk(i):
+    """CJK 邮件：RFC 2047 编码的主题和发件人名、base64 正文、RFC 2231 中文附件名"""
+    msg = MIMEMultipart()
+    msg['From'] = '%s <zhang%d@example.cn>' % (Header('张三%d' % (i % 20), 'utf-8').encode(), i % 20)
+    msg['To'] = '%s <team@example.cn>' % Header('项目组', 'utf-8').encode()
+    msg['Subject'] = Header('季度报告 第%d期 项目进展' % i, 'utf-8')
+    msg['Date'] = message_date(i)
+    msg.attach(MIMEText(_CJK_TEXT * (3 + i % 5), 'plain', 'utf-8'))
+    msg.attach(MIMEText('<p>%s</p>' % _CJK_TEXT, 'html', 'utf-8'))
+    part = _attachment(_CJK_TEXT.encode('utf-8') * 4, '')
+    del part['Content-Disposition']
+    part.add_header('Content-Disposition', 'attachment', filename=('utf-8', '', '报告%d.txt' % i))
+    msg.attach(part)
+    return to_bytes(msg)
+
+
+def build_corpora(quick=False):
+    """生成语料 {名称: [raw bytes]}"""
+    scale = (lambda full, small: small) if quick else (lambda full, small: full)
+    return {
+        'small': [make_small(i) for i in range(scale(2000, 300))],
+        'multipart': [make_multipart(i) for i in range(scale(200, 40))],
+        'attachment': [make_attachment(i, scale(8, 1) * 1024 * 1024) for i in range(scale(4, 2))],
+        'cjk': [make_cjk(i) for i in range(scale(1000, 200))],
+    }
+
+
+# ==================== 基准场景（在子进程中运行） ====================
+
+def _peak_rss():
+    """当前进程的峰值 RSS（字节），不支持时返回 None
+
+    Linux 上读取 /proc/self/status 的 VmHWM（ru_maxrss 会跨 exec 继承父进程的峰值）。
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _reset_peak_rss():
+    """把峰值 RSS 重置为当前 RSS（Linux 4.0+），使峰值只反映计时区间"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _receiver(ctx, folder):
+    dealer = pyMail.ReceiveMailDealer('bench', 'bench', '127.0.0.1', port=ctx['imap_port'], use_ssl=False)
+    dealer.select(folder)
+    return dealer
+
+
+def _sender(ctx):
+    return pyMail.SendMailDealer('bench@example.com', 'bench', '127.0.0.1', ctx['smtp_port'])
+
+
+def _ids(count):
+    return [str(i) for i in range(1, count + 1)]
+
+
+# 以下场景函数：setup(ctx) 返回 (run, close)；run() 返回 (操作数, 输入字节数或 None)
+def case_getMailInfo(ctx, folder, limit=None):
+    dealer = _receiver(ctx, folder)
+    ids = _ids(min(ctx['sizes'][folder], limit or ctx['sizes'][folder]))
+
+    def run():
+        for num in ids:
+            dealer.getMailInfo(num)
+        return len(ids), None
+    return run, dealer.close
+
+
+def case_getMailInfoHeaders(ctx, folder):
+    dealer = _receiver(ctx, folder)
+    ids = _ids(ctx['sizes'][folder])
+
+    def run():
+        for _ in dealer.getMailInfoBatch(ids, want=('subject', 'from', 'to')):
+            pass
+        return len(ids), None
+    return run, dealer.close
+
+
+def case_getMailInfoBatch(ctx, folder):
+    dealer = _receiver(ctx, folder)
+    ids = _ids(ctx['sizes'][folder])
+
+    def run():
+        for _ in dealer.getMailInfoBatch(ids):
+            pass
+        return len(ids), None
+    return run, dealer.close
+
+
+def case_search(ctx, folder, repeat=20):
+    dealer = _receiver(ctx, folder)
+    SearchQuery = pyMail.SearchQuery
+    queries = [
+        lambda: dealer.searchBySubject('项目进展'),
+        lambda: dealer.searchBySubject('report'),
+        lambda: dealer.searchBySender('example'),
+        lambda: dealer.searchByDateRange('05-Jan-2024', '20-Jan-2024'),
+        lambda: dealer.searchQuery(SearchQuery().unseen() & (SearchQuery().sender('zhang1')
+                                                             | SearchQuery().larger(4096))),
+        lambda: dealer.searchStats(SearchQuery().since('01-Jan-2024')),
+    ]
+
+    def run():
+        for _ in range(repeat):
+            for query in queries:
+                query()
+        return repeat * len(queries), None
+    return run, dealer.close
+
+
+def case_setMailInfo(ctx, attachment=False, count=500):
+    dealer = _sender(ctx)
+    paths = [ctx['attachment_path']] if attachment else []
+    count = 5 if attachment else count
+    text = _CJK_TEXT * 20
+    size = len(text.encode('utf-8')) + sum(os.path.getsize(p) for p in paths)
+
+    def run():
+        for i in range(count):
+            dealer.reinitMailInfo()
+            dealer.setMailInfo('team@example.com', '季度报告 第%d期' % i, text, 'plain', *paths,
+                               cc='cc@example.com')
+        return count, count * size
+    return run, dealer.close
+
+
+def case_sendMail(ctx, recipients=1, attachment=False, count=200):
+    dealer = _sender(ctx)
+    paths = [ctx['attachment_path']] if attachment else []
+    count = 3 if attachment else count
+    to = ['user%d@example.com' % i for i in range(recipients)]
+
+    def run():
+        for i in range(count):
+            dealer.reinitMailInfo()
+            dealer.setMailInfo(to, 'Weekly report #%d' % i, LOREM * 10, 'plain', *paths)
+            dealer.sendMail()
+        return count, None
+    return run, dealer.close
+
+
+# (场景名, 场景函数, 参数)
+CASES = [
+    ('getMailInfo/small', case_getMailInfo, {'folder': 'small', 'limit': 500}),
+    ('getMailInfo/multipart', case_getMailInfo, {'folder': 'multipart'}),
+    ('getMailInfo/attachment', case_getMailInfo, {'folder': 'attachment'}),
+    ('getMailInfo/cjk', case_getMailInfo, {'folder': 'cjk', 'limit': 500}),
+    ('getMailInfoBatch/small', case_getMailInfoBatch, {'folder': 'small'}),
+    ('getMailInfoBatch/multipart', case_getMailInfoBatch, {'folder': 'multipart'}),
+    ('getMailInfoBatch/cjk', case_getMailInfoBatch, {'folder': 'cjk'}),
+    ('getMailInfoBatch(headers)/small', case_getMailInfoHeaders, {'folder': 'small'}),
+    ('search/small', case_search, {'folder': 'small', 'repeat': 5}),
+    ('search/cjk', case_search, {'folder': 'cjk', 'repeat': 5}),
+    ('setMailInfo/text', case_setMailInfo, {}),
+    ('setMailInfo/attachment', case_setMailInfo, {'attachment': True}),
+    ('sendMail/small', case_sendMail, {}),
+    ('sendMail/50-recipients', case_sendMail, {'recipients': 50, 'count': 50}),
+    ('sendMail/attachment', case_sendMail, {'attachment': True}),
+]
+
+
+def _run_case(conn, ctx, func, kwargs):
+    """子进程入口：准备好后通知父进程，收到 go 后计时运行，结果通过 conn 返回"""
+    try:
+        run, close = func(ctx, **kwargs)
+        _reset_peak_rss()
+        conn.send(('ready', _peak_rss()))
+        conn.recv()
+        start = time.perf_counter()
+        ops, input_bytes = run()
+        elapsed = time.perf_counter() - start
+        conn.send(('done', {'ops': ops, 'seconds': elapsed, 'input_bytes': input_bytes,
+                            'peak_rss': _peak_rss()}))
+        conn.recv()
+        close()
+    except Exception as e:
+        conn.send(('error', '%s: %s' % (type(e).__name__, e)))
+
+
+def run_case(ctx, stats, name, func, kwargs):
+    """在独立子进程中运行一个场景，返回结果字典"""
+    mp = multiprocessing.get_context('spawn')
+    parent, child = mp.Pipe()
+    process = mp.Process(target=_run_case, args=(child, ctx, func, kwargs))
+    process.start()
+    try:
+        kind, baseline = parent.recv()
+        if kind == 'error':
+            return {'name': name, 'error': baseline}
+        before = stats.snapshot()
+        parent.send('go')
+        kind, result = parent.recv()
+        if kind == 'error':
+            return {'name': name, 'error': result}
+        after = stats.snapshot()
+        parent.send('close')
+    finally:
+        process.join()
+    delta = {key: after[key] - before[key] for key in after}
+    result.update(name=name, round_trips=delta['round_trips'], commands=delta['commands'],
+                  bytes=result['input_bytes'] or delta['bytes_in'] + delta['bytes_out'],
+                  rss_baseline=baseline)
+    return result
+
+
+# ==================== 报告 ====================
+
+def _mb(value):
+    return '-' if value is None else '%.1f' % (value / 1024.0 / 1024.0)
+
+
+def print_report(results):
+    header = '%-34s %7s %10s %9s %9s %8s %9s %8s' % (
+        'case', 'ops', 'ops/s', 'MB/s', 'rt', 'rt/op', 'peakRSS', 'dRSS')
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        if 'error' in r:
+            print('%-34s ERROR %s' % (r['name'], r['error']))
+            continue
+        seconds = max(r['seconds'], 1e-9)
+        grown = None if r['peak_rss'] is None else r['peak_rss'] - r['rss_baseline']
+        print('%-34s %7d %10.1f %9.2f %9d %8.2f %9s %8s' % (
+            r['name'], r['ops'], r['ops'] / seconds, r['bytes'] / seconds / 1024.0 / 1024.0,
+            r['round_trips'], r['round_trips'] / float(r['ops'] or 1), _mb(r['peak_rss']), _mb(grown)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='pyMail benchmark against local fake IMAP/SMTP servers')
+    parser.add_argument('--quick', action='store_true', help='use smaller corpora')
+    parser.add_argument('--only', action='append', default=[],
+                        help='run only cases whose name contains this text (repeatable)')
+    parser.add_argument('--json', metavar='PATH', help='also write results to PATH as JSON')
+    args = parser.parse_args(argv)
+
+    cases = [case for case in CASES if not args.only or any(text in case[0] for text in args.only)]
+    if not cases:
+        parser.error('no case matches --only')
+
+    print('Building corpora...')
+    corpora = build_corpora(args.quick)
+    mailbox = FakeMailbox()
+    for folder, raws in corpora.items():
+        for raw in raws:
+            mailbox.append(folder, raw)
+    for folder, raws in corpora.items():
+        print('  %-10s %6d messages %10.1f MB' % (folder, len(raws), sum(map(len, raws)) / 1024.0 / 1024.0))
+
+    stats = ServerStats()
+    imap_server, imap_port = start_server(FakeIMAPHandler, stats, mailbox=mailbox)
+    smtp_server, smtp_port = start_server(FakeSMTPHandler, stats)
+    workdir = tempfile.mkdtemp(prefix='pymail-bench-')
+    attachment_path = os.path.join(workdir, 'attachment.bin')
+    with open(attachment_path, 'wb') as f:
+        f.write(os.urandom((1 if args.quick else 8) * 1024 * 1024))
+    ctx = {'imap_port': imap_port, 'smtp_port': smtp_port, 'attachment_path': attachment_path,
+           'sizes': {folder: len(raws) for folder, raws in corpora.items()}}
+
+    results = []
+    try:
+        print()
+        for name, func, kwargs in cases:
+            results.append(run_case(ctx, stats, name, func, kwargs))
+        print_report(results)
+    finally:
+        imap_server.shutdown()
+        smtp_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version, 'quick': args.quick, 'results': results}, f, indent=2)
+    return 1 if any('error' in r for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,633 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pyMail 的模拟 IMAP / SMTP 服务器和测试邮件
+
+FakeMailbox 保存文件夹和邮件，FakeIMAPHandler、FakeSMTPHandler 实现 pyMail 用到的命令，
+由 start_server 在后台线程中启动。服务器统计命令数、往返次数和流量（ServerStats），
+并可以注入一次性故障（断开连接、4xx/5xx 应答）。benchmark.py 和 test_behavior.py 共用。
+"""
+
+import base64
+import email
+import email.header
+import email.utils
+import re
+import select
+import socket
+import socketserver
+import threading
+import time
+from email.mime.text import MIMEText
+
+
+# ==================== 模拟服务器公共部分 ====================
+
+class ServerStats:
+    """模拟服务器的计数器（线程安全）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = 0
+        self.round_trips = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    # 增加计数
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    # 返回当前计数的快照
+    def snapshot(self):
+        with self.lock:
+            return {'commands': self.commands, 'round_trips': self.round_trips,
+                    'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out}
+
+
+class _CountingHandler(socketserver.StreamRequestHandler):
+    """统计命令数、往返次数和流量的连接处理基类
+
+    faults 为 {命令: 应答} 字典时，该命令下一次出现时不执行，直接返回预设的应答
+    （'drop' 表示不应答直接断开连接），用于测试错误处理。
+    """
+
+    stats = None
+    faults = None
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    # 发送应答
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.stats.add(bytes_out=len(data))
+        self.wfile.write(data)
+
+    # 读取一行（命令行或数据行）
+    def readline(self):
+        line = self.rfile.readline()
+        self.stats.add(bytes_in=len(line))
+        return line
+
+    # 客户端已发来、尚未读取的数据（不阻塞）
+    def pending(self):
+        self.connection.setblocking(False)
+        try:
+            return self.rfile.peek(1)
+        except (BlockingIOError, ValueError):
+            return b''
+        finally:
+            self.connection.setblocking(True)
+
+    # 等待客户端数据，timeout 秒内有数据可读（或连接已关闭）时返回 True
+    def waitInput(self, timeout):
+        if self.pending():
+            return True
+        return bool(select.select([self.connection], [], [], timeout)[0])
+
+    # 读完一条命令后调用：客户端没有更多数据在途时说明它在等待应答，计一次往返
+    def countCommand(self, commands=1):
+        self.stats.add(commands=commands, round_trips=0 if self.pending() else 1)
+
+    # 取出命令的一次性故障注入：返回预设的应答（'drop' 表示直接断开连接），没有时返回 None
+    def takeFault(self, command):
+        return self.faults.pop(command, None) if self.faults else None
+
+
+def start_server(handler, stats, **attrs):
+    """在后台线程中启动模拟服务器，返回 (server, port)"""
+    attrs['stats'] = stats
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), type('Handler', (handler,), attrs))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+# ==================== 模拟 IMAP 服务器 ====================
+
+def _imap_tokens(text):
+    """把 IMAP 命令参数切分为嵌套列表，带引号的字符串表示为 ('str', value)"""
+    stack = [[]]
+    pos, n = 0, len(text)
+    while pos < n:
+        c = text[pos]
+        if c == ' ':
+            pos += 1
+        elif c == '(':
+            stack[-1].append([])
+            stack.append(stack[-1][-1])
+            pos += 1
+        elif c == ')':
+            stack.pop()
+            pos += 1
+        elif c == '"':
+            pos += 1
+            buf = []
+            while pos < n and text[pos] != '"':
+                if text[pos] == '\\':
+                    pos += 1
+                buf.append(text[pos])
+                pos += 1
+            stack[-1].append(('str', ''.join(buf)))
+            pos += 1
+        else:
+            start, depth = pos, 0
+            while pos < n:
+                c = text[pos]
+                if c == '[':
+                    depth += 1
+                elif c == ']':
+                    depth -= 1
+                elif depth <= 0 and c in ' ()':
+                    break
+                pos += 1
+            stack[-1].append(text[start:pos])
+    return stack[0]
+
+
+def _val(token):
+    return token[1] if isinstance(token, tuple) else token
+
+
+def _parse_set(spec, maxval):
+    """解析 sequence-set（如 1:5,7,9:*）"""
+    result = set()
+    for piece in spec.split(','):
+        if ':' in piece:
+            a, b = (maxval if x == '*' else int(x) for x in piece.split(':'))
+            result.update(range(min(a, b), max(a, b) + 1))
+        else:
+            result.add(maxval if piece == '*' else int(piece))
+    return result
+
+
+def _header_text(value):
+    try:
+        return str(email.header.make_header(email.header.decode_header(value)))
+    except Exception:
+        return value
+
+
+class FakeMailbox:
+    """模拟 IMAP 服务器的邮件存储：{文件夹: [邮件]}"""
+
+    def __init__(self):
+        self.folders = {}
+        self.uidnext = {}
+        self.lock = threading.RLock()
+
+    # 创建文件夹（已存在时不变）
+    def create(self, folder):
+        with self.lock:
+            self.folders.setdefault(folder, [])
+            self.uidnext.setdefault(folder, 1)
+
+    # 添加一封邮件，返回它的 UID
+    def append(self, folder, raw, flags=()):
+        head = email.message_from_bytes(raw.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n')
+        date = email.utils.parsedate(head.get('Date', ''))
+        return self.insert(folder, {
+            'raw': raw, 'flags': set(flags), 'date': tuple(date[:3]) if date else (0, 0, 0),
+            'headers': {k.upper(): _header_text(str(v)).lower() for k, v in head.items()},
+        })
+
+    # 把邮件（或另一个文件夹中邮件的副本）放入文件夹，分配新的 UID
+    def insert(self, folder, message):
+        with self.lock:
+            self.create(folder)
+            uid = self.uidnext[folder]
+            self.uidnext[folder] = uid + 1
+            self.folders[folder].append(dict(message, uid=uid, flags=set(message['flags'])))
+            return uid
+
+
+class FakeIMAPHandler(_CountingHandler):
+    """模拟 IMAP 服务器（只实现基准测试和行为测试用到的命令）
+
+    password 不为 None 时 LOGIN 校验密码。其他连接添加到已选文件夹的邮件
+    在 NOOP 和 IDLE 期间以 EXISTS 通知。
+    """
+
+    mailbox = None
+    password = None
+    capabilities = 'IMAP4rev1 ESEARCH IDLE MOVE UIDPLUS'
+
+    # 读取一条完整命令（含 literal）
+    def readCommand(self):
+        line = self.readline()
+        if not line:
+            return None
+        tokens = []
+        while True:
+            m = re.search(rb'\{(\d+)\}\r\n$', line)
+            if not m:
+                tokens.extend(_imap_tokens(line.rstrip(b'\r\n').decode('utf-8', 'replace')))
+                break
+            tokens.extend(_imap_tokens(line[:m.start()].decode('utf-8', 'replace')))
+            self.countCommand(commands=0)
+            self.send('+ go ahead\r\n')
+            literal = self.rfile.read(int(m.group(1)))
+            self.stats.add(bytes_in=len(literal))
+            tokens.append(('str', literal.decode('utf-8', 'replace')))
+            line = self.readline()
+        self.countCommand()
+        return tokens
+
+    def handle(self):
+        self.folder = None
+        self.known = 0  # 已通知客户端的邮件数
+        self.send('* OK fake IMAP ready\r\n')
+        while True:
+            tokens = self.readCommand()
+            if tokens is None:
+                return
+            if len(tokens) < 2:
+                continue
+            tag, cmd, args = tokens[0], tokens[1].upper(), tokens[2:]
+            if cmd == 'UID':
+                uid, cmd, args = True, args[0].upper(), args[1:]
+            else:
+                uid = False
+            if cmd == 'LOGOUT':
+                self.send('* BYE\r\n%s OK LOGOUT completed\r\n' % tag)
+                return
+            fault = self.takeFault(cmd)
+            if fault == 'drop':
+                return
+            try:
+                status = fault or self.dispatch(cmd, args, uid)
+            except Exception as e:
+                status = 'BAD %s' % e
+            if status is None:  # 连接已关闭
+                return
+            self.send('%s %s\r\n' % (tag, status))
+
+    @property
+    def messages(self):
+        return self.mailbox.folders[self.folder]
+
+    def dispatch(self, cmd, args, uid):
+        if cmd == 'CAPABILITY':
+            self.send('* CAPABILITY %s\r\n' % self.capabilities)
+        elif cmd == 'LOGIN':
+            if self.password is not None and _val(args[1]) != self.password:
+                return 'NO [AUTHENTICATIONFAILED] invalid credentials'
+        elif cmd == 'NOOP':
+            with self.mailbox.lock:
+                self.notify()
+        elif cmd in ('SELECT', 'EXAMINE'):
+            name = _val(args[0])
+            with self.mailbox.lock:
+                if name not in self.mailbox.folders:
+                    return 'NO no such folder'
+                self.folder = name
+                self.known = len(self.messages)
+                self.send('* %d EXISTS\r\n* 0 RECENT\r\n* OK [UIDVALIDITY 1]\r\n'
+                          '* OK [UIDNEXT %d]\r\n' % (self.known, self.mailbox.uidnext[name]))
+        elif cmd == 'STATUS':
+            with self.mailbox.lock:
+                return self.status(_val(args[0]), args[1])
+        elif self.folder is None:
+            return 'BAD no folder selected'
+        elif cmd == 'IDLE':
+            return self.idle()
+        elif cmd in ('COPY', 'MOVE'):
+            with self.mailbox.lock:
+                return self.copy(args, uid, move=cmd == 'MOVE')
+        elif cmd == 'EXPUNGE':
+            with self.mailbox.lock:
+                wanted = _parse_set(_val(args[0]), self.maxUid()) if uid else None
+                self.expunge([(seq, m) for seq, m in enumerate(self.messages, 1) if '\\Deleted' in m['flags']
+                              and (wanted is None or m['uid'] in wanted)])
+        elif cmd == 'SEARCH':
+            with self.mailbox.lock:
+                self.search(args, uid)
+        elif cmd == 'FETCH':
+            with self.mailbox.lock:
+                self.fetch(args, uid)
+        elif cmd == 'STORE':
+            with self.mailbox.lock:
+                self.storeFlags(args, uid)
+        else:
+            return 'BAD unknown command %s' % cmd
+        return 'OK %s completed' % cmd
+
+    # 把其他连接添加的邮件以 EXISTS 通知客户端
+    def notify(self):
+        if self.folder is not None and len(self.messages) > self.known:
+            self.known = len(self.messages)
+            self.send('* %d EXISTS\r\n' % self.known)
+
+    # IDLE：等待 DONE，期间通知新邮件
+    def idle(self):
+        self.send('+ idling\r\n')
+        while not self.waitInput(0.02):
+            with self.mailbox.lock:
+                self.notify()
+        line = self.readline()
+        if not line:
+            return None
+        self.countCommand(commands=0)
+        return 'OK IDLE terminated' if line.strip().upper() == b'DONE' else 'BAD expected DONE'
+
+    # 删除邮件并发送 EXPUNGE（从大到小，前面的序号不受影响）
+    def expunge(self, victims):
+        for seq, m in sorted(victims, key=lambda item: item[0], reverse=True):
+            del self.messages[seq - 1]
+            self.known -= 1
+            self.send('* %d EXPUNGE\r\n' % seq)
+
+    def copy(self, args, uid, move=False):
+        target = _val(args[1])
+        if target not in self.mailbox.folders:
+            return 'NO [TRYCREATE] no such folder'
+        victims = self.resolve(_val(args[0]), uid)
+        for _, m in victims:
+            self.mailbox.insert(target, m)
+        if move:
+            self.expunge(victims)
+        return 'OK %s completed' % ('MOVE' if move else 'COPY')
+
+    def status(self, name, items):
+        if name not in self.mailbox.folders:
+            return 'NO no such folder'
+        messages = self.mailbox.folders[name]
+        values = {'MESSAGES': len(messages), 'RECENT': 0, 'UIDNEXT': self.mailbox.uidnext[name],
+                  'UIDVALIDITY': 1, 'UNSEEN': sum(1 for m in messages if '\\Seen' not in m['flags'])}
+        items = items if isinstance(items, list) else [items]
+        self.send('* STATUS "%s" (%s)\r\n' % (name, ' '.join(
+            '%s %d' % (_val(item).upper(), values[_val(item).upper()]) for item in items)))
+        return 'OK STATUS completed'
+
+    # 当前文件夹最大的 UID（UID 集合中 * 的取值）
+    def maxUid(self):
+        return self.messages[-1]['uid'] if self.messages else 0
+
+    def resolve(self, spec, uid):
+        messages = self.messages
+        wanted = _parse_set(spec, self.maxUid() if uid else len(messages))
+        if uid:
+            return [(i, m) for i, m in enumerate(messages, 1) if m['uid'] in wanted]
+        return [(i, messages[i - 1]) for i in sorted(wanted) if 0 < i <= len(messages)]
+
+    def match(self, keys, seq, m):
+        i = 0
+        while i < len(keys):
+            ok, i = self.matchOne(keys, i, seq, m)
+            if not ok:
+                return False
+        return True
+
+    def matchOne(self, keys, i, seq, m):
+        key = keys[i]
+        if isinstance(key, list):
+            return self.match(key, seq, m), i + 1
+        k = _val(key).upper()
+        if k == 'ALL':
+            return True, i + 1
+        if k in ('SEEN', 'UNSEEN', 'FLAGGED', 'UNFLAGGED', 'ANSWERED', 'DELETED', 'UNDELETED'):
+            has = ('\\' + k.replace('UN', '', 1).capitalize()) in m['flags']
+            return (not has) if k.startswith('UN') else has, i + 1
+        if k in ('SUBJECT', 'FROM', 'TO', 'CC', 'BCC'):
+            return _val(keys[i + 1]).lower() in m['headers'].get(k, ''), i + 2
+        if k == 'HEADER':
+            return _val(keys[i + 2]).lower() in m['headers'].get(_val(keys[i + 1]).upper(), ''), i + 3
+        if k in ('BODY', 'TEXT'):
+            return _val(keys[i + 1]).encode('utf-8').lower() in m['raw'].lower(), i + 2
+        if k in ('LARGER', 'SMALLER'):
+            size, n = len(m['raw']), int(_val(keys[i + 1]))
+            return (size > n) if k == 'LARGER' else (size < n), i + 2
+        if k in ('SINCE', 'BEFORE', 'ON', 'SENTSINCE', 'SENTBEFORE', 'SENTON'):
+            ref = tuple(time.strptime(_val(keys[i + 1]), '%d-%b-%Y')[:3])
+            if k.endswith('SINCE'):
+                return m['date'] >= ref, i + 2
+            if k.endswith('BEFORE'):
+                return m['date'] < ref, i + 2
+            return m['date'] == ref, i + 2
+        if k == 'NOT':
+            ok, j = self.matchOne(keys, i + 1, seq, m)
+            return not ok, j
+        if k == 'OR':
+            a, j = self.matchOne(keys, i + 1, seq, m)
+            b, j = self.matchOne(keys, j, seq, m)
+            return a or b, j
+        if k == 'UID':
+            return m['uid'] in _parse_set(_val(keys[i + 1]), self.maxUid()), i + 2
+        if re.match(r'^[\d:*,]+$', k):
+            return seq in _parse_set(k, len(self.messages)), i + 1
+        raise ValueError('unsupported search key %s' % k)
+
+    def search(self, args, uid):
+        args = list(args)
+        returns = None
+        if args and _val(args[0]).upper() == 'RETURN':
+            returns = [r.upper() for r in args[1]] or ['ALL']
+            args = args[2:]
+        if args and _val(args[0]).upper() == 'CHARSET':
+            args = args[2:]
+        hits = [m['uid'] if uid else seq for seq, m in enumerate(self.messages, 1)
+                if self.match(args, seq, m)]
+        if returns is None:
+            self.send('* SEARCH%s\r\n' % ''.join(' %d' % h for h in hits))
+            return
+        items = []
+        if 'MIN' in returns and hits:
+            items.append('MIN %d' % min(hits))
+        if 'MAX' in returns and hits:
+            items.append('MAX %d' % max(hits))
+        if 'COUNT' in returns:
+            items.append('COUNT %d' % len(hits))
+        if 'ALL' in returns and hits:
+            items.append('ALL %s' % ','.join(str(h) for h in hits))
+        self.send('* ESEARCH (TAG "x")%s %s\r\n' % (' UID' if uid else '', ' '.join(items)))
+
+    def fetch(self, args, uid):
+        items = args[1] if isinstance(args[1], list) else [args[1]]
+        items = [_val(item).upper() for item in items]
+        if uid and 'UID' not in items:
+            items.insert(0, 'UID')
+        for seq, m in self.resolve(args[0], uid):
+            parts = []
+            for item in items:
+                if item == 'UID':
+                    parts.append(('UID %d' % m['uid']).encode())
+                elif item == 'FLAGS':
+                    parts.append(('FLAGS (%s)' % ' '.join(sorted(m['flags']))).encode())
+                elif item == 'RFC822.SIZE':
+                    parts.append(('RFC822.SIZE %d' % len(m['raw'])).encode())
+                else:
+                    key, data = self.section(m, item)
+                    parts.append(('%s {%d}\r\n' % (key, len(data))).encode() + data)
+            self.send(('* %d FETCH (' % seq).encode() + b' '.join(parts) + b')\r\n')
+
+    def section(self, m, item):
+        raw = m['raw']
+        if item == 'RFC822':
+            m['flags'].add('\\Seen')
+            return 'RFC822', raw
+        if item == 'RFC822.HEADER':
+            return item, raw.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n'
+        if not item.startswith(('BODY[', 'BODY.PEEK[')):
+            raise ValueError('unsupported fetch item %s' % item)
+        if item.startswith('BODY['):
+            m['flags'].add('\\Seen')
+        end = item.rindex(']')
+        name = item[item.index('[') + 1:end]
+        head, _, body = raw.partition(b'\r\n\r\n')
+        data = {'': raw, 'HEADER': head + b'\r\n\r\n', 'TEXT': body}.get(name)
+        if data is None:
+            raise ValueError('unsupported section %s' % name)
+        partial = item[end + 1:]
+        if partial:
+            # 部分读取 <起点.长度>，应答的键只带起点
+            start, length = (int(x) for x in partial.strip('<>').split('.'))
+            return 'BODY[%s]<%d>' % (name, start), data[start:start + length]
+        return 'BODY[%s]' % name, data
+
+    def storeFlags(self, args, uid):
+        item = _val(args[1]).upper()
+        flags = args[2] if isinstance(args[2], list) else [args[2]]
+        flags = set(_val(f) for f in flags)
+        for seq, m in self.resolve(args[0], uid):
+            if item.startswith('+'):
+                m['flags'] |= flags
+            elif item.startswith('-'):
+                m['flags'] -= flags
+            else:
+                m['flags'] = set(flags)
+            if not item.endswith('.SILENT'):
+                self.send('* %d FETCH (FLAGS (%s))\r\n' % (seq, ' '.join(sorted(m['flags']))))
+
+
+# ==================== 模拟 SMTP 服务器 ====================
+
+class FakeSMTPHandler(_CountingHandler):
+    """模拟 SMTP 服务器（ESMTP，PIPELINING，AUTH PLAIN/LOGIN）
+
+    received 为列表时把收到的邮件记录为 (发件人, [收件人], 邮件内容 bytes)，否则直接丢弃。
+    password 不为 None 时 AUTH 校验密码；地址以 reject 开头的收件人返回 550。
+    faults 的键为 MAIL、RCPT、DATA 等命令，预设的 421 应答发出后断开连接。
+    """
+
+    extensions = ('PIPELINING', 'AUTH PLAIN LOGIN', 'SIZE 100000000', '8BITMIME')
+    password = None
+    received = None
+
+    def reply(self, line):
+        self.send(line + '\r\n')
+
+    # AUTH PLAIN / LOGIN，返回客户端提供的密码
+    def authenticate(self, parts):
+        if parts[1].upper() != 'LOGIN':
+            return base64.b64decode(parts[2]).split(b'\0')[-1].decode('utf-8')
+        values = []
+        for prompt in ('VXNlcm5hbWU6', 'UGFzc3dvcmQ6')[len(parts) - 2:]:
+            self.reply('334 ' + prompt)
+            values.append(self.readline().strip())
+            self.countCommand(commands=0)
+        return base64.b64decode(values[-1]).decode('utf-8')
+
+    # 读取 DATA 内容直到单独一行的点，返回 (是否读到结束的点, 去掉点转义的内容（不需要记录时为 None）)
+    def readData(self):
+        lines = []
+        while True:
+            line = self.readline()
+            if line in (b'.\r\n', b'.\n', b''):
+                return line != b'', b''.join(lines) if self.received is not None else None
+            if self.received is not None:
+                lines.append(line[1:] if line.startswith(b'..') else line)
+
+    def handle(self):
+        self.reply('220 fake ESMTP')
+        sender, rcpts = None, []
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            self.countCommand()
+            cmd = line.decode('utf-8', 'replace').strip()
+            up = cmd.upper()
+            fault = self.takeFault(up.split(' ', 1)[0].split(':', 1)[0])
+            if fault == 'drop':
+                return
+            if fault:
+                self.reply(fault)
+                if fault.startswith('421'):
+                    return
+                if up == 'DATA' and fault.startswith('354'):
+                    self.readData()
+                continue
+            if up.startswith(('EHLO', 'HELO')):
+                lines = ['fake'] + list(self.extensions)
+                self.send(''.join('250%s%s\r\n' % (' ' if i == len(lines) - 1 else '-', text)
+                                  for i, text in enumerate(lines)))
+            elif up.startswith('AUTH'):
+                password = self.authenticate(cmd.split())
+                ok = self.password is None or password == self.password
+                self.reply('235 ok' if ok else '535 authentication failed')
+            elif up.startswith('MAIL FROM'):
+                if sender is not None:
+                    self.reply('503 nested MAIL command')
+                    continue
+                sender, rcpts = cmd[10:].strip().strip('<>'), []
+                self.reply('250 ok')
+            elif up.startswith('RCPT TO'):
+                address = cmd[8:].strip().strip('<>')
+                if address.startswith('reject'):
+                    self.reply('550 no such user')
+                else:
+                    rcpts.append(address)
+                    self.reply('250 ok')
+            elif up == 'DATA':
+                if not rcpts:
+                    self.reply('503 no recipients')
+                    continue
+                self.reply('354 go ahead')
+                complete, data = self.readData()
+                if not complete:  # 连接在 DATA 中途关闭：丢弃不完整的邮件
+                    return
+                self.countCommand()
+                if data is not None:
+                    self.received.append((sender, rcpts, data))
+                sender, rcpts = None, []
+                self.reply('250 queued')
+            elif up == 'RSET':
+                sender, rcpts = None, []
+                self.reply('250 ok')
+            elif up == 'NOOP':
+                self.reply('250 ok')
+            elif up == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('500 unknown command')
+
+
+# ==================== 测试邮件 ====================
+
+LOREM = ('The quick brown fox jumps over the lazy dog. Pack my box with five dozen liquor jugs. '
+         'How vexingly quick daft zebras jump. ')
+
+
+# 第 i 封邮件的 Date 头
+def message_date(i):
+    return email.utils.formatdate(1704067200 + i * 3600, localtime=False)
+
+
+def to_bytes(msg):
+    """把邮件序列化为 CRLF 换行的 bytes（与 IMAP 服务器返回的格式一致）"""
+    return msg.as_bytes(policy=msg.policy.clone(linesep='\r\n'))
+
+
+def make_small(i):
+    """小邮件：纯文本，ASCII 头，约 1-2 KB"""
+    msg = MIMEText(LOREM * (5 + i % 10), 'plain', 'utf-8')
+    msg['From'] = 'Sender %d <sender%d@example.com>' % (i % 50, i % 50)
+    msg['To'] = 'team@example.com'
+    msg['Subject'] = 'Weekly report #%d' % i
+    msg['Date'] = message_date(i)
+    return to_bytes(msg)
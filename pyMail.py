@@ -1,20 +1,52 @@
 # -*- coding: utf-8 -*-
 import imaplib
 import email
+import binascii
 import os
+import re
+import json
+import mmap
+import tempfile
+import sqlite3
+import uuid
+import weakref
+import copy
+from string import Template
+import threading
+import queue
+import ssl
+import socket
+import select
+import time
+import asyncio
+import bisect
+import contextlib
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
 import smtplib
 import logging
+from email.message import Message
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email import encoders
 from email.header import Header, decode_header, make_header
 from email import utils as email_utils
+from email.parser import BytesHeaderParser, HeaderParser
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+from urllib.parse import quote, unquote
 
 # 配置日志
 logger = logging.getLogger('pymail')
 logger.addHandler(logging.NullHandler())
 
+# 旧版本 imaplib 的命令表中可能没有 MOVE（RFC 6851），uid('MOVE', ...) 需要它
+imaplib.Commands.setdefault('MOVE', ('SELECTED',))
+
 
 # ========== 自定义异常 ==========
 class MailError(Exception):
@@ -37,472 +69,5617 @@ class MailFetchError(MailError):
     pass
 
 
-# ========== 接收邮件部分（IMAP）==========
-# 处理接收邮件的类
-class ReceiveMailDealer:
+# ========== IMAP 响应解析工具 ==========
+_FETCH_HEAD_RE = re.compile(rb'^(\d+) \(')
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+# 限制缓存字节数时每封邮件至少预读的字节数（决定每条 FETCH 最多包含多少封邮件）
+_FETCH_PREFIX_MIN = 16 * 1024
 
-    # 构造函数(用户名，密码，imap服务器)
-    def __init__(self, username, password, server):
-        try:
-            self.mail = imaplib.IMAP4_SSL(server)
-            logger.info(f"Connected to IMAP server: {server}")
-        except Exception as e:
-            logger.error(f"Failed to connect to IMAP server {server}: {e}")
-            raise MailConnectionError(f"Cannot connect to {server}: {e}")
-        
-        try:
-            self.mail.login(username, password)
-            logger.info(f"Logged in as: {username}")
-        except Exception as e:
-            logger.error(f"Authentication failed for {username}: {e}")
-            raise MailAuthError(f"Login failed: {e}")
-        
-        self.select("INBOX")
-        
-    # 返回所有文件夹
-    def showFolders(self):
-        return self.mail.list()
-    
-    # 选择收件箱（如"INBOX"，如果不知道可以调用showFolders）
-    def select(self, selector):
-        return self.mail.select(selector)
 
-    # 搜索邮件(参照RFC文档http://tools.ietf.org/html/rfc3501#page-49)
-    def search(self, charset, *criteria):
+# 将 search() 的返回值、id 列表或空格分隔的字符串统一为 str 列表
+def _id_list(ids):
+    """统一邮件序号/UID 列表
+
+    Args:
+        ids: search() 返回的 (status, [data])、id 列表，或空格分隔的 str/bytes
+
+    Returns:
+        str 列表，如 ['1', '2', '3']
+    """
+    if isinstance(ids, tuple) and len(ids) == 2 and isinstance(ids[1], list):
+        ids = ids[1]
+    if isinstance(ids, (bytes, str)):
+        ids = [ids]
+    result = []
+    for item in ids:
+        if item is None:
+            continue
+        if isinstance(item, int):
+            result.append(str(item))
+            continue
+        if isinstance(item, bytes):
+            item = item.decode('ascii')
+        result.extend(item.split())
+    return result
+
+
+# 将 id 列表压缩为 IMAP sequence-set（如 1:5,7,9:12）
+def _compress_ids(ids):
+    """压缩 id 列表为 RFC 3501 sequence-set 字符串
+
+    Args:
+        ids: id 列表（str 或 int）
+
+    Returns:
+        sequence-set 字符串
+    """
+    return ','.join(_id_ranges(ids))
+
+
+# 命令行中 sequence-set 的最大长度（RFC 7162 建议客户端的命令行不超过 8192 字节，留出命令和参数的空间）
+_MAX_SET_LENGTH = 7900
+
+
+# 将 id 列表压缩后切分为多个 sequence-set，每个不超过 max_length 字节
+def _chunk_id_set(ids, max_length=_MAX_SET_LENGTH):
+    """压缩 id 列表并按命令行长度切分
+
+    Args:
+        ids: id 列表（str 或 int）
+        max_length: 每个 sequence-set 的最大长度
+
+    Returns:
+        sequence-set 字符串列表，按 id 升序；连续的 id 通常只需要一个
+    """
+    chunks, current, size = [], [], 0
+    for piece in _id_ranges(ids):
+        if current and size + 1 + len(piece) > max_length:
+            chunks.append(','.join(current))
+            current, size = [], 0
+        size += len(piece) + (1 if current else 0)
+        current.append(piece)
+    if current:
+        chunks.append(','.join(current))
+    return chunks
+
+
+# 将 id 列表合并为升序的区间字符串列表（如 ['1:5', '7', '9:12']）
+def _id_ranges(ids):
+    numbers = sorted(set(int(i) for i in ids))
+    ranges = []
+    start = prev = None
+    for n in numbers:
+        if start is None:
+            start = prev = n
+        elif n == prev + 1:
+            prev = n
+        else:
+            ranges.append(str(start) if start == prev else f'{start}:{prev}')
+            start = prev = n
+    if start is not None:
+        ranges.append(str(start) if start == prev else f'{start}:{prev}')
+    return ranges
+
+
+# 按固定大小切分列表
+def _chunks(items, size):
+    """按 size 切分列表"""
+    size = max(1, int(size))
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# 解析 IMAP 括号表达式（支持字符串、NIL、{n} literal）
+def _parse_imap_tokens(texts, literals):
+    """解析 IMAP 响应为嵌套列表
+
+    Args:
+        texts: 文本片段列表
+        literals: literals[i] 是紧跟 texts[i] 末尾 {n} 标记的 literal 数据
+
+    Returns:
+        嵌套列表，原子为 bytes，NIL 为 None
+    """
+    stack = [[]]
+    for index, text in enumerate(texts):
+        pos = 0
+        n = len(text)
+        while pos < n:
+            c = text[pos]
+            if c in b' \r\n':
+                pos += 1
+            elif c == 0x28:  # (
+                new = []
+                stack[-1].append(new)
+                stack.append(new)
+                pos += 1
+            elif c == 0x29:  # )
+                if len(stack) > 1:
+                    stack.pop()
+                pos += 1
+            elif c == 0x22:  # "
+                pos += 1
+                buf = bytearray()
+                while pos < n and text[pos] != 0x22:
+                    if text[pos] == 0x5c and pos + 1 < n:  # \
+                        pos += 1
+                    buf.append(text[pos])
+                    pos += 1
+                stack[-1].append(bytes(buf))
+                pos += 1
+            elif c == 0x7b and _LITERAL_RE.match(text, pos):  # {n}
+                literal = literals[index] if index < len(literals) else None
+                stack[-1].append(literal if literal is not None else b'')
+                pos = n
+            else:
+                start = pos
+                depth = 0
+                while pos < n:
+                    c = text[pos]
+                    if c == 0x5b:  # [
+                        depth += 1
+                    elif c == 0x5d:  # ]
+                        depth -= 1
+                    elif depth <= 0 and c in b' ()\r\n':
+                        break
+                    pos += 1
+                atom = text[start:pos]
+                stack[-1].append(None if atom.upper() == b'NIL' else atom)
+    return stack[0]
+
+
+# FETCH 数据项在应答中的名字：去掉 .PEEK，部分读取 <起点.长度> 只保留起点
+def _fetch_attr(item):
+    return re.sub(r'<(\d+)\.\d+>$', r'<\1>', item.upper().replace('.PEEK', ''))
+
+
+# 解析 FETCH 响应，返回 [(序号, {属性名: 值})]
+def _parse_fetch_response(data):
+    """解析 imaplib fetch() 返回的数据
+
+    Args:
+        data: imaplib 返回的数据列表（bytes 与 (header, literal) 元组混合）
+
+    Returns:
+        [(seq, attrs)] 列表，seq 为 str，attrs 的键为大写属性名（如 'UID', 'RFC822'）
+    """
+    messages = []
+    texts = literals = None
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            head, literal = item[0], item[1]
+        else:
+            head, literal = item, None
+        if _FETCH_HEAD_RE.match(head):
+            texts, literals = [], []
+            messages.append((texts, literals))
+        elif texts is None:
+            continue
+        texts.append(head)
+        literals.append(literal)
+    result = []
+    for texts, literals in messages:
+        tokens = _parse_imap_tokens(texts, literals)
+        if len(tokens) < 2 or not isinstance(tokens[1], list):
+            continue
+        items = tokens[1]
+        attrs = {}
+        for i in range(0, len(items) - 1, 2):
+            key = items[i]
+            if isinstance(key, bytes):
+                attrs[key.decode('ascii', 'replace').upper()] = items[i + 1]
+        result.append((tokens[0].decode('ascii'), attrs))
+    return result
+
+
+# 解码并清洗附件文件名，防止路径遍历和非法字符 (Issue #7)
+def _clean_filename(filename, default_prefix):
+    """解码并清洗附件文件名
+
+    Args:
+        filename: 原始文件名（可能是多段编码）
+        default_prefix: 文件名为空或只有扩展名时使用的前缀
+
+    Returns:
+        清洗后的文件名
+    """
+    try:
+        # 正确解码多段编码的文件名
+        decoded_parts = decode_header(filename)
+        filename = ''.join([
+            part.decode(encoding or 'utf-8') if isinstance(part, bytes) else str(part)
+            for part, encoding in decoded_parts
+        ])
+    except Exception as e:
+        logger.warning("Failed to decode filename: %s", e)
+
+    filename = os.path.basename(filename)  # 去除路径
+    filename = filename.replace('\\', '_').replace('/', '_')  # 替换路径分隔符
+
+    # 清洗其他非法文件名字符
+    illegal_chars = '<>:"|?*'
+    for char in illegal_chars:
+        filename = filename.replace(char, '_')
+
+    # 如果文件名为空或只有扩展名，生成默认名称
+    if not filename or filename.startswith('.'):
+        filename = f'{default_prefix}{filename}'
+    return filename
+
+
+# 在目录中创建不重名的文件，返回 (路径, 文件对象)
+def _open_unique(directory, filename):
+    os.makedirs(directory, exist_ok=True)
+    base, ext = os.path.splitext(filename)
+    counter = 0
+    while True:
+        name = filename if counter == 0 else f'{base}_{counter}{ext}'
+        path = os.path.join(directory, name)
         try:
-            return self.mail.search(charset, *criteria)
-        except Exception as e:
-            logger.warning(f"Search failed, retrying after selecting INBOX: {e}")
+            return path, open(path, 'xb')
+        except FileExistsError:
+            counter += 1
+
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+_BASE64_JUNK_RE = re.compile(r'[^A-Za-z0-9+/=]')
+_BASE64_JUNK_BYTES_RE = re.compile(rb'[^A-Za-z0-9+/=]')
+_HEADER_PARSER = BytesHeaderParser()
+_HEADER_TEXT_PARSER = HeaderParser()
+
+
+# 分块解码 part 的 base64/quoted-printable 数据并写入文件对象，返回写入字节数
+def _write_decoded_payload(message_part, fileobj, chunk_size=_STREAM_CHUNK_SIZE):
+    """分块解码附件数据并写入 fileobj
+
+    Args:
+        message_part: 非 multipart 的邮件 part
+        fileobj: 可写的二进制文件对象
+        chunk_size: 每次处理的编码字符数
+
+    Returns:
+        写入的字节数
+    """
+    cte = str(message_part.get('Content-Transfer-Encoding', '')).strip().lower()
+    if cte in ('base64', 'quoted-printable'):
+        return _write_decoded(cte, message_part.get_payload(), fileobj, chunk_size=chunk_size)
+    data = message_part.get_payload(decode=True) or b''
+    for pos in range(0, len(data), chunk_size):
+        fileobj.write(data[pos:pos + chunk_size])
+    return len(data)
+
+
+# 分块解码 payload[start:end]（str 或 bytes）中的 base64/quoted-printable 数据并写入文件对象
+def _write_decoded(cte, payload, fileobj, start=0, end=None, chunk_size=_STREAM_CHUNK_SIZE):
+    """每次只解码 chunk_size 个编码字符，返回写入的字节数"""
+    end = len(payload) if end is None else end
+    empty = payload[:0]
+    written = 0
+    if cte == 'base64':
+        junk = _BASE64_JUNK_RE if isinstance(payload, str) else _BASE64_JUNK_BYTES_RE
+        carry = empty
+        for pos in range(start, end, chunk_size):
+            piece = carry + junk.sub(empty, payload[pos:min(pos + chunk_size, end)])
+            cut = len(piece) - len(piece) % 4
+            if cut:
+                data = binascii.a2b_base64(piece[:cut])
+                fileobj.write(data)
+                written += len(data)
+            carry = piece[cut:]
+        if len(carry) > 1:
             try:
-                self.select("INBOX")
-                return self.mail.search(charset, *criteria)
-            except Exception as e2:
-                logger.error(f"Search failed after retry: {e2}")
-                raise MailFetchError(f"Search failed: {e2}")
+                padding = '=' if isinstance(carry, str) else b'='
+                data = binascii.a2b_base64(carry + padding * (-len(carry) % 4))
+                fileobj.write(data)
+                written += len(data)
+            except binascii.Error as e:
+                logger.warning("Failed to decode trailing base64 data: %s", e)
+    else:
+        newline = '\n' if isinstance(payload, str) else b'\n'
+        pos = start
+        while pos < end:
+            stop = payload.find(newline, pos + chunk_size, end)
+            stop = end if stop < 0 else stop + 1
+            piece = payload[pos:stop]
+            if isinstance(piece, str):
+                piece = piece.encode('ascii', 'surrogateescape')
+            data = binascii.a2b_qp(piece)
+            fileobj.write(data)
+            written += len(data)
+            pos = stop
+    return written
 
-    # 返回所有未读的邮件列表（返回的是包含邮件序号的列表）
-    def getUnread(self):
-        """获取未读邮件列表"""
-        return self.search(None, "Unseen")
-    
-    # 获取所有邮件列表 (Issue #4)
-    def getAll(self):
-        """获取所有邮件列表"""
-        return self.search(None, 'ALL')
-    
-    # 按主题搜索 (Issue #10)
-    def searchBySubject(self, keyword):
-        """按主题关键词搜索邮件
-        
-        Args:
-            keyword: 主题关键词
-        
-        Returns:
-            搜索结果 (status, [mail_ids])
+
+# Content-Disposition 是否为 attachment
+def _is_attachment_part(part):
+    disposition = part.get('Content-Disposition')
+    return bool(disposition) and disposition.strip().split(';', 1)[0].lower() == 'attachment'
+
+
+# 按 ASCII 解码原始邮件（不可解码的字节用 surrogateescape 保留），同 BytesParser；raw 可以是任意 bytes-like 对象
+def _raw_text(raw):
+    return str(raw, 'ascii', 'surrogateescape')
+
+
+# 拆分原始数据 raw[start:end] 中一个 MIME 部分的邮件头和正文，返回 (邮件头结束位置, 正文开始位置)
+def _split_raw_header(raw, start, end):
+    # 用切片比较而不是 startswith，raw 也可以是 mmap
+    if raw[start:min(start + 2, end)] == b'\r\n':
+        return start, start + 2
+    if raw[start:min(start + 1, end)] == b'\n':
+        return start, start + 1
+    found = [(pos + 1, pos + 3) for pos in [raw.find(b'\n\r\n', start, end)] if pos >= 0]
+    found += [(pos + 1, pos + 2) for pos in [raw.find(b'\n\n', start, end)] if pos >= 0]
+    return min(found) if found else (end, end)
+
+
+# 按 MIME 结构遍历原始邮件，不复制正文
+def _iter_raw_parts(raw, start=0, end=None):
+    """深度优先遍历 raw[start:end]，顺序同 Message.walk()，只产出叶子部分
+
+    multipart 按分隔行拆分，message/rfc822 展开为内嵌邮件。
+
+    Yields:
+        (邮件头 Message, 部分开始位置, 正文开始位置, 正文结束位置)
+    """
+    end = len(raw) if end is None else end
+    header_end, body_start = _split_raw_header(raw, start, end)
+    headers = _HEADER_PARSER.parsebytes(raw[start:header_end])
+    content_type = headers.get_content_type()
+    boundary = headers.get_boundary() if headers.get_content_maintype() == 'multipart' else None
+    if content_type == 'message/rfc822':
+        yield from _iter_raw_parts(raw, body_start, end)
+        return
+    if not boundary:
+        yield headers, start, body_start, end
+        return
+    delimiter = b'--' + boundary.encode('ascii', 'surrogateescape')
+    part_start = None
+    pos = body_start
+    while True:
+        found = raw.find(delimiter, pos, end)
+        if found < 0:
+            break
+        line_end = raw.find(b'\n', found, end)
+        line_end = end if line_end < 0 else line_end + 1
+        rest = raw[found + len(delimiter):line_end].rstrip()
+        # 分隔行必须在行首，后面只能是 -- 或空白
+        if (found > body_start and raw[found - 1:found] != b'\n') or (rest and not rest.startswith(b'--')):
+            pos = found + 1
+            continue
+        if part_start is not None:
+            # 分隔行前的换行属于分隔符
+            part_end = found - (2 if raw[found - 2:found] == b'\r\n' else 1)
+            yield from _iter_raw_parts(raw, part_start, max(part_end, part_start))
+        if rest.startswith(b'--'):
+            return
+        part_start = pos = line_end
+    if part_start is not None:
+        yield from _iter_raw_parts(raw, part_start, end)
+
+
+# 解码文本 part，按声明的字符集解码，失败时使用 utf-8
+def _decode_text_part(part, label='body'):
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return ''
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        return payload.decode(charset, errors='replace')
+    except Exception as e:
+        logger.warning("Failed to decode %s with %s, using utf-8: %s", label, charset, e)
+        return payload.decode('utf-8', errors='replace')
+
+
+_IDLE_EVENT_RE = re.compile(rb'^\* (\d+) (EXISTS|EXPUNGE)', re.I)
+_STATUS_ITEM_RE = re.compile(rb'(MESSAGES|RECENT|UIDNEXT|UIDVALIDITY|UNSEEN|HIGHESTMODSEQ) (\d+)', re.I)
+
+
+# 将 BODYSTRUCTURE 中的原子/字符串转为 str
+def _imap_str(value):
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+# 解析 BODYSTRUCTURE 参数列表，支持 RFC 2231 编码（如 FILENAME*）
+def _bodystructure_params(values):
+    """将 ("NAME" "a.pdf" "CHARSET" "utf-8") 转为 {'name': 'a.pdf', 'charset': 'utf-8'}"""
+    params = {}
+    if not isinstance(values, list):
+        return params
+    for i in range(0, len(values) - 1, 2):
+        key = (_imap_str(values[i]) or '').lower()
+        value = _imap_str(values[i + 1]) or ''
+        if key.endswith('*'):
+            key = key[:-1]
+            charset, _, rest = value.partition("'")
+            _, _, encoded = rest.partition("'")
+            try:
+                value = unquote(encoded, encoding=charset or 'utf-8', errors='replace')
+            except LookupError:
+                value = unquote(encoded)
+        params[key] = value
+    return params
+
+
+# 遍历 BODYSTRUCTURE，产出每个叶子 MIME part 的信息
+def _walk_bodystructure(node, prefix=''):
+    """遍历 BODYSTRUCTURE（RFC 3501 7.4.2）
+
+    Args:
+        node: _parse_imap_tokens 解析出的 BODYSTRUCTURE 列表
+        prefix: 父 part 的 section 编号
+
+    Yields:
+        字典 {section, content_type, params, encoding, size, disposition, disposition_params}
+    """
+    if not isinstance(node, list) or not node:
+        return
+    if isinstance(node[0], list):
+        index = 0
+        for child in node:
+            if not isinstance(child, list):
+                break
+            index += 1
+            section = f'{prefix}.{index}' if prefix else str(index)
+            yield from _walk_bodystructure(child, section)
+        return
+
+    maintype = (_imap_str(node[0]) or 'text').lower()
+    subtype = (_imap_str(node[1]) or 'plain').lower()
+    content_type = f'{maintype}/{subtype}'
+    if maintype == 'text':
+        ext_start = 8
+    elif content_type == 'message/rfc822':
+        ext_start = 10
+    else:
+        ext_start = 7
+    disposition, disposition_params = None, {}
+    if len(node) > ext_start + 1 and isinstance(node[ext_start + 1], list):
+        dsp = node[ext_start + 1]
+        disposition = (_imap_str(dsp[0]) or '').lower() if dsp else None
+        if len(dsp) > 1:
+            disposition_params = _bodystructure_params(dsp[1])
+    try:
+        size = int(node[6]) if len(node) > 6 and node[6] is not None else 0
+    except (TypeError, ValueError):
+        size = 0
+    yield {
+        'section': prefix or '1',
+        'content_type': content_type,
+        'params': _bodystructure_params(node[2] if len(node) > 2 else None),
+        'encoding': ((_imap_str(node[5]) if len(node) > 5 else None) or '7bit').lower(),
+        'size': size,
+        'disposition': disposition,
+        'disposition_params': disposition_params,
+    }
+
+
+# 按 Content-Transfer-Encoding 解码 part 数据
+def _decode_transfer(data, encoding):
+    encoding = (encoding or '').lower()
+    try:
+        if encoding == 'base64':
+            return binascii.a2b_base64(data)
+        if encoding == 'quoted-printable':
+            return binascii.a2b_qp(data)
+    except binascii.Error as e:
+        logger.warning("Failed to decode %s payload, using raw: %s", encoding, e)
+    return data
+
+
+# ========== 指标与追踪 ==========
+# 命令延迟直方图的默认桶上界（秒），同 Prometheus 客户端的默认值再加 30 秒
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Histogram:
+    """累积直方图（桶计数、总和、次数）"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+# Prometheus 标签值转义
+def _prom_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MailMetrics:
+    """收发邮件的指标和追踪
+
+    传给 ReceiveMailDealer / SendMailDealer 的 metrics 参数后记录：每条 IMAP/SMTP 命令的
+    延迟直方图（SELECT、SEARCH、FETCH、MAIL、RCPT、DATA 等）和成败、收发字节数、
+    每封邮件的解析耗时、重试次数。一个实例可以被多个连接（连接池）共享，线程安全。
+
+    导出方式：
+        callback: 每条命令、每次解析、每次重试调用 callback(event)，event 为字典
+        toPrometheus(): Prometheus 文本格式，可直接作为 /metrics 的响应
+        on_span: 每条命令结束时调用 on_span(span)，span 为 OpenTelemetry 风格的字典
+            （name, trace_id, span_id, parent_id, start_time/end_time 纳秒, attributes, status），
+            用 span() 开启的外层 span 会成为命令 span 的父节点
+    """
+
+    def __init__(self, callback=None, on_span=None, buckets=_LATENCY_BUCKETS, prefix='pymail'):
         """
-        return self.search(None, 'SUBJECT', f'"{keyword}"')
-    
-    # 按发件人搜索 (Issue #10)
-    def searchBySender(self, sender_email):
-        """按发件人邮箱搜索邮件
-        
         Args:
-            sender_email: 发件人邮箱地址
-        
-        Returns:
-            搜索结果 (status, [mail_ids])
+            callback: 事件回调（可选）
+            on_span: span 回调（可选）
+            buckets: 延迟直方图的桶上界（秒）
+            prefix: Prometheus 指标名前缀
         """
-        return self.search(None, 'FROM', sender_email)
-    
-    # 按日期范围搜索
-    def searchByDateRange(self, since_date, before_date=None):
-        """按日期范围搜索邮件
-        
+        self.callback = callback
+        self.on_span = on_span
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    # 清空所有指标
+    def reset(self):
+        """清空所有已记录的指标"""
+        with self._lock:
+            self._commands = {}  # (protocol, command) -> _Histogram
+            self._errors = {}  # (protocol, command) -> 失败次数
+            self._bytes = {}  # (protocol, direction) -> 字节数
+            self._retries = {}  # (protocol, operation) -> 次数
+            self._parse = _Histogram(len(self.buckets) + 1)
+            self._parse_bytes = 0
+
+    def _observe(self, histogram, value):
+        histogram.counts[bisect.bisect_left(self.buckets, value)] += 1
+        histogram.sum += value
+        histogram.count += 1
+
+    def _emit(self, event):
+        if self.callback is not None:
+            try:
+                self.callback(event)
+            except Exception as e:
+                logger.warning("Metrics callback failed: %s", e)
+
+    # 记录收发字节数（热路径，只累加计数）
+    def addBytes(self, protocol, direction, count):
+        """累加字节数
+
         Args:
-            since_date: 开始日期 (格式: DD-MMM-YYYY, 如 01-Jan-2023)
-            before_date: 结束日期 (可选)
-        
-        Returns:
-            搜索结果 (status, [mail_ids])
+            protocol: 'imap' 或 'smtp'
+            direction: 'in' 或 'out'
+            count: 字节数
         """
-        criteria = ['SINCE', since_date]
-        if before_date:
-            criteria.extend(['BEFORE', before_date])
-        return self.search(None, *criteria)
-    
-    # 以RFC822协议格式返回邮件详情的email对象
-    def getEmailFormat(self, num):
-        """获取邮件的email对象
-        
+        key = (protocol, direction)
+        with self._lock:
+            self._bytes[key] = self._bytes.get(key, 0) + count
+
+    # 记录一条命令的延迟和结果
+    def observeCommand(self, protocol, command, duration, ok=True, bytes_in=0, bytes_out=0, start=None):
+        """记录一条命令
+
         Args:
-            num: 邮件序号
-        
-        Returns:
-            email.message.Message 对象
-        
-        Raises:
-            MailFetchError: 获取邮件失败
+            protocol: 'imap' 或 'smtp'
+            command: 命令名，如 'FETCH'、'UID SEARCH'、'RCPT'
+            duration: 从发出命令到收到最终应答的秒数
+            ok: 命令是否成功
+            bytes_in: 该命令收到的字节数
+            bytes_out: 该命令发出的字节数
+            start: 开始时间（time.time() 秒，可选，用于 span）
         """
-        try:
-            data = self.mail.fetch(num, 'RFC822')
-            if data[0] == 'OK' and data[1] and data[1][0]:
-                # Python 3: 使用 message_from_bytes
-                mail_data = data[1][0][1]
-                if isinstance(mail_data, bytes):
-                    return email.message_from_bytes(mail_data)
-                else:
-                    return email.message_from_string(mail_data)
-            else:
-                raise MailFetchError(f"Failed to fetch email {num}: {data}")
-        except Exception as e:
-            logger.error(f"Error fetching email {num}: {e}")
-            raise MailFetchError(f"Failed to fetch email {num}: {e}")
+        key = (protocol, command)
+        with self._lock:
+            histogram = self._commands.get(key)
+            if histogram is None:
+                histogram = self._commands[key] = _Histogram(len(self.buckets) + 1)
+            self._observe(histogram, duration)
+            if not ok:
+                self._errors[key] = self._errors.get(key, 0) + 1
+        if self.callback is not None:
+            self._emit({'type': 'command', 'protocol': protocol, 'command': command, 'duration': duration,
+                        'ok': ok, 'bytes_in': bytes_in, 'bytes_out': bytes_out})
+        if self.on_span is not None:
+            end = time.time()
+            start = end - duration if start is None else start
+            self._exportSpan(f'{protocol.upper()} {command}', start, end, 'OK' if ok else 'ERROR', {
+                'mail.protocol': protocol, 'mail.command': command,
+                'mail.bytes_in': bytes_in, 'mail.bytes_out': bytes_out,
+            })
+
+    # 记录一封邮件的解析耗时
+    def observeParse(self, duration, size=None):
+        """记录解析耗时
 
-    # 返回发送者的信息——元组（邮件称呼，邮件地址）
-    def getSenderInfo(self, msg):
-        """解析发件人信息
-        
         Args:
-            msg: email.message.Message 对象
-        
-        Returns:
-            (name, address) 元组
+            duration: 秒数
+            size: 原始邮件字节数（可选）
         """
-        from_header = msg.get('from', '')
-        name, address = email_utils.parseaddr(from_header)
-        
-        # 使用 make_header 处理多段编码的 Header
-        if name:
-            try:
-                decoded_name = str(make_header(decode_header(name)))
-            except Exception as e:
-                logger.warning(f"Failed to decode sender name, using raw: {e}")
-                decoded_name = name
-        else:
-            decoded_name = ''
-        
-        return (decoded_name, address)
+        with self._lock:
+            self._observe(self._parse, duration)
+            self._parse_bytes += size or 0
+        if self.callback is not None:
+            self._emit({'type': 'parse', 'duration': duration, 'size': size})
+
+    # 记录一次重试
+    def addRetry(self, protocol, operation):
+        """记录一次重试（如搜索失败后重新选择文件夹、SMTP 重连）
 
-    # 返回接收者的信息——元组（邮件称呼，邮件地址）
-    def getReceiverInfo(self, msg):
-        """解析收件人信息
-        
         Args:
-            msg: email.message.Message 对象
-        
-        Returns:
-            (name, address) 元组
+            protocol: 'imap' 或 'smtp'
+            operation: 被重试的操作，如 'SEARCH'、'reconnect'
         """
-        to_header = msg.get('to', '')
-        name, address = email_utils.parseaddr(to_header)
-        
-        # 使用 make_header 处理多段编码的 Header
-        if name:
-            try:
-                decoded_name = str(make_header(decode_header(name)))
-            except Exception as e:
-                logger.warning(f"Failed to decode receiver name, using raw: {e}")
-                decoded_name = name
-        else:
-            decoded_name = ''
-        
-        return (decoded_name, address)
+        key = (protocol, operation)
+        with self._lock:
+            self._retries[key] = self._retries.get(key, 0) + 1
+        if self.callback is not None:
+            self._emit({'type': 'retry', 'protocol': protocol, 'operation': operation})
+
+    # 开启一个 span，期间记录的命令 span 以它为父节点
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """开启一个外层 span（上下文管理器），结束时交给 on_span
 
-    # 返回邮件的主题（参数msg是email对象，可调用getEmailFormat获得）
-    def getSubjectContent(self, msg):
-        """解析邮件主题
-        
         Args:
-            msg: email.message.Message 对象
-        
-        Returns:
-            解码后的主题字符串
+            name: span 名称，如 'sync INBOX'
+            **attributes: span 属性
+
+        Yields:
+            span 字典，可以在 with 块中修改 attributes
         """
-        subject = msg.get('subject', '')
-        if not subject:
-            return ''
-        
+        stack = self._spanStack()
+        parent = stack[-1] if stack else None
+        span = {
+            'name': name,
+            'trace_id': parent['trace_id'] if parent else os.urandom(16).hex(),
+            'span_id': os.urandom(8).hex(),
+            'parent_id': parent['span_id'] if parent else None,
+            'start_time': int(time.time() * 1e9),
+            'end_time': None,
+            'attributes': dict(attributes),
+            'status': 'OK',
+        }
+        stack.append(span)
         try:
-            # 使用 make_header 处理多段编码
-            return str(make_header(decode_header(subject)))
+            yield span
+        except BaseException as e:
+            span['status'] = 'ERROR'
+            span['attributes']['error'] = str(e)
+            raise
+        finally:
+            stack.pop()
+            span['end_time'] = int(time.time() * 1e9)
+            if self.on_span is not None:
+                # 导出失败不能掩盖 with 块的结果或异常
+                try:
+                    self.on_span(span)
+                except Exception as e:
+                    logger.warning("Span exporter failed: %s", e)
+
+    def _spanStack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _exportSpan(self, name, start, end, status, attributes):
+        stack = self._spanStack()
+        parent = stack[-1] if stack else None
+        try:
+            self.on_span({
+                'name': name,
+                'trace_id': parent['trace_id'] if parent else os.urandom(16).hex(),
+                'span_id': os.urandom(8).hex(),
+                'parent_id': parent['span_id'] if parent else None,
+                'start_time': int(start * 1e9),
+                'end_time': int(end * 1e9),
+                'attributes': attributes,
+                'status': status,
+            })
         except Exception as e:
-            logger.warning(f"Failed to decode subject, using raw: {e}")
-            return subject
+            logger.warning("Span exporter failed: %s", e)
+
+    # 返回当前指标的快照
+    def snapshot(self):
+        """返回当前指标
 
-    # 判断是否有附件，并解析（解析email对象的part）
-    # 返回字典（内容类型，大小，文件名，数据流）
-    def parse_attachment(self, message_part):
-        """解析附件
-        
-        Args:
-            message_part: 邮件的一个 part
-        
         Returns:
-            附件字典 {content_type, size, name, data} 或 None
+            字典 {commands: {(protocol, command): {count, sum, errors, buckets}},
+            bytes: {(protocol, direction): n}, parse: {count, sum, bytes, buckets},
+            retries: {(protocol, operation): n}}，buckets 为 [(上界, 累计次数)]
         """
-        content_disposition = message_part.get("Content-Disposition", None)
-        if content_disposition:
-            dispositions = content_disposition.strip().split(";")
-            if bool(content_disposition and dispositions[0].lower() == "attachment"):
-                file_data = message_part.get_payload(decode=True)
-                if not file_data:
-                    return None
-                
-                attachment = {}
-                attachment["content_type"] = message_part.get_content_type()
-                attachment["size"] = len(file_data)
-                
-                # 获取并清洗文件名 (修复 Issue #7)
-                filename = message_part.get_filename()
-                if filename:
-                    try:
-                        # 正确解码多段编码的文件名
-                        decoded_parts = decode_header(filename)
-                        filename = ''.join([
-                            part.decode(encoding or 'utf-8') if isinstance(part, bytes) else str(part)
-                            for part, encoding in decoded_parts
-                        ])
-                    except Exception as e:
-                        logger.warning(f"Failed to decode filename: {e}")
-                    
-                    # 清洗文件名，防止路径遍历和非法字符 (Issue #7)
-                    filename = os.path.basename(filename)  # 去除路径
-                    filename = filename.replace('\\', '_').replace('/', '_')  # 替换路径分隔符
-                    
-                    # 清洗其他非法文件名字符
-                    illegal_chars = '<>:"|?*'
-                    for char in illegal_chars:
-                        filename = filename.replace(char, '_')
-                    
-                    # 如果文件名为空或只有扩展名，生成默认名称
-                    if not filename or filename.startswith('.'):
-                        filename = f'attachment_{id(message_part)}{filename}'
-                else:
-                    # 无文件名，生成默认名称
-                    ext = message_part.get_content_subtype()
-                    filename = f'attachment_{id(message_part)}.{ext}'
-                
-                attachment["name"] = filename
-                attachment["data"] = file_data
-                logger.debug(f"Parsed attachment: {filename} ({len(file_data)} bytes)")
-                
-                return attachment
-        return None
+        def buckets(histogram):
+            total, result = 0, []
+            for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                total += count
+                result.append((bound, total))
+            return result
+
+        with self._lock:
+            return {
+                'commands': {key: {'count': h.count, 'sum': h.sum, 'errors': self._errors.get(key, 0),
+                                   'buckets': buckets(h)} for key, h in self._commands.items()},
+                'bytes': dict(self._bytes),
+                'parse': {'count': self._parse.count, 'sum': self._parse.sum, 'bytes': self._parse_bytes,
+                          'buckets': buckets(self._parse)},
+                'retries': dict(self._retries),
+            }
+
+    # 导出为 Prometheus 文本格式
+    def toPrometheus(self):
+        """导出为 Prometheus 文本格式（text/plain; version=0.0.4）
 
-    # 返回邮件的解析后信息部分
-    # 返回字典包含（主题，纯文本正文部分，html的正文部分，发件人元组，收件人元组，附件列表）
-    def getMailInfo(self, num):
-        """获取邮件完整信息
-        
-        Args:
-            num: 邮件序号
-        
         Returns:
-            字典 {subject, body, html, from, to, attachments}
-        """
-        msg = self.getEmailFormat(num)
-        attachments = []
-        body = None
-        html = None
-        
-        for part in msg.walk():
-            attachment = self.parse_attachment(part)
-            if attachment:
-                attachments.append(attachment)
-            elif part.get_content_type() == "text/plain":
-                if body is None:
-                    body = ""
-                # 正确处理 bytes 到 str 的转换
-                payload = part.get_payload(decode=True)
-                if payload:
-                    if isinstance(payload, bytes):
-                        charset = part.get_content_charset() or 'utf-8'
-                        try:
-                            body += payload.decode(charset, errors='replace')
-                        except Exception as e:
-                            logger.warning(f"Failed to decode body with {charset}, using utf-8: {e}")
-                            body += payload.decode('utf-8', errors='replace')
-                    else:
-                        body += payload
-            elif part.get_content_type() == "text/html":
-                if html is None:
-                    html = ""
-                # 正确处理 bytes 到 str 的转换
-                payload = part.get_payload(decode=True)
-                if payload:
-                    if isinstance(payload, bytes):
-                        charset = part.get_content_charset() or 'utf-8'
-                        try:
-                            html += payload.decode(charset, errors='replace')
-                        except Exception as e:
-                            logger.warning(f"Failed to decode html with {charset}, using utf-8: {e}")
-                            html += payload.decode('utf-8', errors='replace')
-                    else:
-                        html += payload
-        
-        return {
-            'subject': self.getSubjectContent(msg),
-            'body': body,
-            'html': html,
-            'from': self.getSenderInfo(msg),
-            'to': self.getReceiverInfo(msg),
-            'attachments': attachments,
-        }
+            str
+        """
+        snap = self.snapshot()
+        p = self.prefix
+        lines = []
 
+        def histogram(name, labels, data):
+            for bound, count in data['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{{labels}le="{le}"}} {count}')
+            labels = f'{{{labels.rstrip(",")}}}' if labels else ''
+            lines.append(f'{name}_sum{labels} {data["sum"]!r}')
+            lines.append(f'{name}_count{labels} {data["count"]}')
 
-# ========== 发送邮件部分(smtp) ==========
+        lines.append(f'# HELP {p}_command_duration_seconds IMAP/SMTP command latency.')
+        lines.append(f'# TYPE {p}_command_duration_seconds histogram')
+        for (protocol, command), data in sorted(snap['commands'].items()):
+            labels = f'protocol="{_prom_label(protocol)}",command="{_prom_label(command)}",'
+            histogram(f'{p}_command_duration_seconds', labels, data)
+        lines.append(f'# HELP {p}_command_errors_total IMAP/SMTP commands that did not succeed.')
+        lines.append(f'# TYPE {p}_command_errors_total counter')
+        for (protocol, command), data in sorted(snap['commands'].items()):
+            lines.append(f'{p}_command_errors_total{{protocol="{_prom_label(protocol)}",'
+                         f'command="{_prom_label(command)}"}} {data["errors"]}')
+        lines.append(f'# HELP {p}_bytes_total Bytes sent to and received from mail servers.')
+        lines.append(f'# TYPE {p}_bytes_total counter')
+        for (protocol, direction), count in sorted(snap['bytes'].items()):
+            lines.append(f'{p}_bytes_total{{protocol="{_prom_label(protocol)}",'
+                         f'direction="{_prom_label(direction)}"}} {count}')
+        lines.append(f'# HELP {p}_parse_duration_seconds Time spent parsing one message.')
+        lines.append(f'# TYPE {p}_parse_duration_seconds histogram')
+        histogram(f'{p}_parse_duration_seconds', '', snap['parse'])
+        lines.append(f'# HELP {p}_parse_bytes_total Raw bytes of parsed messages (when known).')
+        lines.append(f'# TYPE {p}_parse_bytes_total counter')
+        lines.append(f'{p}_parse_bytes_total {snap["parse"]["bytes"]}')
+        lines.append(f'# HELP {p}_retries_total Retried operations.')
+        lines.append(f'# TYPE {p}_retries_total counter')
+        for (protocol, operation), count in sorted(snap['retries'].items()):
+            lines.append(f'{p}_retries_total{{protocol="{_prom_label(protocol)}",'
+                         f'operation="{_prom_label(operation)}"}} {count}')
+        return '\n'.join(lines) + '\n'
 
-class SendMailDealer:
 
-    # 构造函数（用户名，密码，smtp服务器，端口，是否使用TLS）
-    def __init__(self, user, passwd, smtp, port, usettls=False):
-        """初始化SMTP连接
-        
-        Args:
-            user: 邮箱用户名
-            passwd: 密码或应用专用密码
-            smtp: SMTP服务器地址
-            port: 端口 (587用于STARTTLS, 465用于SSL)
-            usettls: 是否使用STARTTLS (True for port 587, False for port 465)
-        
-        Raises:
-            MailConnectionError: 连接失败
+# 给 imaplib 连接挂上指标统计（实例属性覆盖 send/read/readline/_command/_command_complete）
+def _instrument_imap(conn, metrics):
+    """让 imaplib.IMAP4 连接向 metrics 报告每条命令的延迟和收发字节数"""
+    send, read, readline = conn.send, conn.read, conn.readline
+    command, command_complete = conn._command, conn._command_complete
+    totals = [0, 0]  # 本连接累计的 [收到, 发出] 字节数，用于按命令归属流量
+    pending = {}  # 已发出、尚未完成的命令：{标签: (命令名, 开始时间, time.time(), 开始时的收发字节数)}
+
+    def _send(data):
+        totals[1] += len(data)
+        metrics.addBytes('imap', 'out', len(data))
+        return send(data)
+
+    def _read(size):
+        data = read(size)
+        totals[0] += len(data)
+        metrics.addBytes('imap', 'in', len(data))
+        return data
+
+    def _readline():
+        line = readline()
+        totals[0] += len(line)
+        metrics.addBytes('imap', 'in', len(line))
+        return line
+
+    def _observe(entry, ok):
+        name, start, start_wall, bytes_in, bytes_out = entry
+        metrics.observeCommand('imap', name, time.perf_counter() - start, ok,
+                               totals[0] - bytes_in, totals[1] - bytes_out, start_wall)
+
+    # 发出和完成分开统计，流水线发出的命令（见 ReceiveMailDealer._startFetch）也能记录
+    def _command(name, *args):
+        entry = (f'UID {args[0].upper()}' if name == 'UID' and args else name,
+                 time.perf_counter(), time.time(), totals[0], totals[1])
+        try:
+            tag = command(name, *args)
+        except BaseException:
+            _observe(entry, False)
+            raise
+        pending[tag] = entry
+        return tag
+
+    def _command_complete(name, tag):
+        entry = pending.pop(tag, None)
+        ok = False
+        try:
+            result = command_complete(name, tag)
+            ok = result[0] == 'OK' or (name == 'LOGOUT' and result[0] == 'BYE')
+            return result
+        finally:
+            if entry is not None:
+                _observe(entry, ok)
+
+    conn.send, conn.read, conn.readline = _send, _read, _readline
+    conn._command, conn._command_complete = _command, _command_complete
+
+
+# 给 smtplib 连接挂上指标统计（实例属性覆盖 send/putcmd/getreply）
+def _instrument_smtp(conn, metrics):
+    """让 smtplib.SMTP 连接向 metrics 报告每条命令的延迟和收发字节数
+
+    已发出、尚未收到最终应答的命令按顺序排队（PIPELINING 时可能有多条）；
+    3xx 中间应答（DATA 的 354、AUTH 的 334）不结束命令，DATA 的延迟包含邮件内容的传输。
+    """
+    send, putcmd, getreply = conn.send, conn.putcmd, conn.getreply
+    pending = deque()  # (命令名, 开始时间, time.time(), 开始时的收发字节数)
+    state = {'continuation': False, 'in': 0, 'out': 0}
+
+    def _send(data):
+        state['out'] += len(data)
+        metrics.addBytes('smtp', 'out', len(data))
+        return send(data)
+
+    def _expect(names):
+        start_wall, start = time.time(), time.perf_counter()
+        for name in names:
+            pending.append((name, start, start_wall, state['in'], state['out']))
+
+    def _putcmd(cmd, args=''):
+        if state['continuation']:
+            # 对 3xx 的应答（如 AUTH LOGIN 的用户名/密码）属于同一条命令
+            state['continuation'] = False
+        else:
+            _expect([cmd.split(' ', 1)[0].upper() or 'NOOP'])
+        return putcmd(cmd, args)
+
+    def _getreply():
+        code, resp = getreply()
+        size = len(resp) + 5 * (resp.count(b'\n') + 1) + 1
+        state['in'] += size
+        metrics.addBytes('smtp', 'in', size)
+        if pending:
+            if 300 <= code < 400:
+                state['continuation'] = True
+            else:
+                name, start, start_wall, bytes_in, bytes_out = pending.popleft()
+                metrics.observeCommand('smtp', name, time.perf_counter() - start, 0 < code < 400,
+                                       state['in'] - bytes_in, state['out'] - bytes_out, start_wall)
+        return code, resp
+
+    conn.send, conn.putcmd, conn.getreply = _send, _putcmd, _getreply
+    conn._pymail_expect = _expect
+
+
+# ========== 连接保活 ==========
+# 断线重连后在新连接上自动重发的 imaplib 方法（重发不会产生重复副作用）和 UID 命令。
+# STORE 的 -FLAGS / +FLAGS 重发时可能覆盖其他客户端在断线期间做的修改，COPY / MOVE / EXPUNGE
+# 重发可能重复执行，都不重发；使用序号的 FETCH / SEARCH 也不重发：序号只在一个会话内有效，
+# 断线期间有邮件被删除时新会话上同样的序号指向别的邮件，重连后抛出 MailConnectionError
+_IMAP_REPLAYABLE = frozenset(['capability', 'noop', 'select', 'status', 'list', 'lsub', 'check', 'enable'])
+_IMAP_UID_REPLAYABLE = frozenset(['FETCH', 'SEARCH'])
+
+
+class _KeepaliveThread(threading.Thread):
+    """连接空闲超过 interval 秒时调用 dealer.noop() 的后台线程
+
+    只持有 dealer 的弱引用，dealer 被回收或调用 cancel() 后线程退出；
+    dealer 正在执行命令（持有 dealer._lock）时跳过本次保活。
+    """
+
+    def __init__(self, dealer, interval):
+        super().__init__(name='pymail-keepalive', daemon=True)
+        self._dealer = weakref.ref(dealer)
+        self.interval = interval
+        self._cancelled = threading.Event()
+
+    # 停止线程
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        wait = self.interval
+        while not self._cancelled.wait(wait):
+            dealer = self._dealer()
+            if dealer is None:
+                return
+            idle = time.monotonic() - dealer._last_used
+            wait = self.interval
+            if idle < self.interval:
+                wait -= idle
+            elif dealer._lock.acquire(blocking=False):
+                try:
+                    dealer.noop()
+                except Exception as e:
+                    logger.warning("Keepalive NOOP failed: %s", e)
+                finally:
+                    dealer._lock.release()
+            del dealer
+
+
+# ========== IMAP 搜索条件 ==========
+_IMAP_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+# searchStats 只请求 COUNT / MIN / MAX；ALL 的值是 sequence-set（如 1:5,9），不按数字解析
+_ESEARCH_ITEM_RE = re.compile(rb'\b(COUNT|MIN|MAX) (\d+)', re.I)
+
+
+# IMAP 参数加引号
+def _imap_quote(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+# 日期转换为 RFC 3501 格式（DD-Mon-YYYY），字符串原样返回
+def _imap_date(value):
+    if isinstance(value, str):
+        return value
+    return f'{value.day:02d}-{_IMAP_MONTHS[value.month - 1]}-{value.year}'
+
+
+def _is_ascii(text):
+    try:
+        text.encode('ascii')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+# 可组合的 IMAP 搜索条件，编译为一条 SEARCH / UID SEARCH 命令
+class SearchQuery:
+    """IMAP 搜索条件构造器
+
+    每个方法返回新的 SearchQuery，条件之间为 AND；``a | b`` 为 OR，``~a`` 为 NOT，
+    ``a & b`` 合并两组条件。交给 ReceiveMailDealer.searchQuery() 在服务器端执行::
+
+        query = SearchQuery().sender('boss@company.com').subject('发票').since(date(2025, 1, 1))
+        query = (SearchQuery().sender('a@x.com') | SearchQuery().sender('b@x.com')) & ~SearchQuery().seen()
+
+    非 ASCII 文本使用 CHARSET UTF-8 并以 literal 发送。imaplib 每条命令只能带一个 literal，
+    且必须位于命令末尾，所以一条查询最多包含一个非 ASCII 文本条件，并且不能位于多条件的
+    OR/NOT 分组内（会自动调整顺序把它放到最后）。
+    """
+
+    def __init__(self, terms=()):
+        self.terms = tuple(terms)
+
+    def _add(self, *items):
+        return SearchQuery(self.terms + (items,))
+
+    def __and__(self, other):
+        return SearchQuery(self.terms + other.terms)
+
+    def __or__(self, other):
+        return SearchQuery([('OR', self, other)])
+
+    def __invert__(self):
+        return SearchQuery([('NOT', self)])
+
+    def __repr__(self):
+        charset, criteria, literal = self.compile()
+        text = criteria + (f' {{{literal.decode("utf-8")}}}' if literal is not None else '')
+        return f'<SearchQuery {text}>'
+
+    # 标志条件
+    def all(self):
+        return self._add('ALL')
+
+    def seen(self, value=True):
+        return self._add('SEEN' if value else 'UNSEEN')
+
+    def unseen(self):
+        return self._add('UNSEEN')
+
+    def flagged(self, value=True):
+        return self._add('FLAGGED' if value else 'UNFLAGGED')
+
+    def answered(self, value=True):
+        return self._add('ANSWERED' if value else 'UNANSWERED')
+
+    def deleted(self, value=True):
+        return self._add('DELETED' if value else 'UNDELETED')
+
+    def draft(self, value=True):
+        return self._add('DRAFT' if value else 'UNDRAFT')
+
+    def recent(self):
+        return self._add('RECENT')
+
+    def keyword(self, flag, value=True):
+        """自定义标志（如 $Important）"""
+        return self._add('KEYWORD' if value else 'UNKEYWORD', flag)
+
+    # 邮件头和内容条件（子串匹配，是否区分大小写由服务器决定）
+    def subject(self, text):
+        return self._add('SUBJECT', ('str', text))
+
+    def sender(self, text):
+        return self._add('FROM', ('str', text))
+
+    def to(self, text):
+        return self._add('TO', ('str', text))
+
+    def cc(self, text):
+        return self._add('CC', ('str', text))
+
+    def bcc(self, text):
+        return self._add('BCC', ('str', text))
+
+    def body(self, text):
+        return self._add('BODY', ('str', text))
+
+    def text(self, text):
+        """邮件头或正文包含 text"""
+        return self._add('TEXT', ('str', text))
+
+    def header(self, name, text=''):
+        """任意邮件头包含 text（text 为空时只要求存在该邮件头）"""
+        return self._add('HEADER', _imap_quote(name), ('str', text))
+
+    # 日期条件：date/datetime 或 'DD-Mon-YYYY' 字符串
+    def since(self, day):
+        """服务器收到日期 >= day"""
+        return self._add('SINCE', _imap_date(day))
+
+    def before(self, day):
+        """服务器收到日期 < day"""
+        return self._add('BEFORE', _imap_date(day))
+
+    def on(self, day):
+        return self._add('ON', _imap_date(day))
+
+    def sentSince(self, day):
+        """Date 邮件头 >= day"""
+        return self._add('SENTSINCE', _imap_date(day))
+
+    def sentBefore(self, day):
+        return self._add('SENTBEFORE', _imap_date(day))
+
+    def sentOn(self, day):
+        return self._add('SENTON', _imap_date(day))
+
+    # 大小条件（字节）
+    def larger(self, size):
+        return self._add('LARGER', str(int(size)))
+
+    def smaller(self, size):
+        return self._add('SMALLER', str(int(size)))
+
+    def uid(self, ids):
+        """限定 UID 范围（search() 结果、列表或 '1:100' 这样的字符串）"""
+        ids = ids if isinstance(ids, str) and ':' in ids else _compress_ids(_id_list(ids))
+        return self._add('UID', ids)
+
+    # 是否包含非 ASCII 文本
+    def _nonAscii(self):
+        return sum(1 for term in self.terms for item in term
+                   if (isinstance(item, tuple) and not _is_ascii(item[1]))
+                   or (isinstance(item, SearchQuery) and item._nonAscii()))
+
+    # 展开为 token 列表，非 ASCII 的条件排在最后
+    def _tokens(self):
+        tokens = []
+        for term in sorted(self.terms, key=lambda term: SearchQuery([term])._nonAscii() > 0):
+            items = list(term)
+            if items[0] == 'OR' and items[1]._nonAscii():
+                items[1], items[2] = items[2], items[1]
+            for item in items:
+                if isinstance(item, SearchQuery):
+                    group = item._tokens() or ['ALL']
+                    tokens.extend(['('] + group + [')'] if len(item.terms) > 1 else group)
+                else:
+                    tokens.append(item)
+        return tokens
+
+    # 编译为 (charset, 条件字符串, literal)
+    def compile(self):
+        """编译为 IMAP SEARCH 参数
+
+        Returns:
+            (charset, criteria, literal)：charset 为 None 或 'UTF-8'；literal 不为 None 时
+            需设置为 imaplib 的 literal，由 imaplib 追加到命令末尾
+
+        Raises:
+            MailError: 非 ASCII 条件超过一个，或位于多条件分组内
+        """
+        tokens = self._tokens() or ['ALL']
+        literal = None
+        if self._nonAscii():
+            last = tokens[-1]
+            if self._nonAscii() > 1 or not isinstance(last, tuple) or _is_ascii(last[1]):
+                raise MailError("Only one non-ASCII search term is supported, "
+                                "and it cannot be inside an OR/NOT group of several terms")
+            literal = tokens.pop()[1].encode('utf-8')
+        parts = []
+        for token in tokens:
+            text = _imap_quote(token[1]) if isinstance(token, tuple) else token
+            if parts and parts[-1] != '(' and text != ')':
+                parts.append(' ')
+            parts.append(text)
+        return ('UTF-8' if literal is not None else None), ''.join(parts), literal
+
+
+# ========== 邮件解析部分 ==========
+_MAIL_INFO_FIELDS = frozenset(('subject', 'body', 'html', 'from', 'to', 'attachments'))
+_BODY_FIELDS = frozenset(('body', 'html', 'attachments'))
+
+
+# 解码文本 part，按声明的字符集解码，失败时使用 utf-8
+def _decode_text_part(part, label='body'):
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return ''
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        return payload.decode(charset, errors='replace')
+    except Exception as e:
+        logger.warning("Failed to decode %s with %s, using utf-8: %s", label, charset, e)
+        return payload.decode('utf-8', errors='replace')
+
+
+# 解码主题等非结构化邮件头（RFC 2047 编码词）
+def _decode_subject(value):
+    if not value:
+        return ''
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception as e:
+        logger.warning("Failed to decode subject, using raw: %s", e)
+        return str(value)
+
+
+# 解析地址邮件头为 (称呼, 地址)，称呼按 RFC 2047 解码
+def _decode_address(value, label='sender'):
+    name, address = email_utils.parseaddr(value or '')
+    if not name:
+        return ('', address)
+    try:
+        return (str(make_header(decode_header(name))), address)
+    except Exception as e:
+        logger.warning("Failed to decode %s name, using raw: %s", label, e)
+        return (name, address)
+
+
+_UNSET = object()
+# 映射键 -> 属性名，顺序即 keys() 的顺序
+_MAIL_INFO_KEYS = (('subject', 'subject'), ('body', 'body'), ('html', 'html'),
+                   ('attachments', 'attachments'), ('from', 'sender'), ('to', 'receiver'))
+_MAIL_INFO_ATTRS = dict(_MAIL_INFO_KEYS)
+_MAIL_INFO_HEADER_KEYS = {'subject': 'subject', 'sender': 'from', 'receiver': 'to'}
+# 延迟解码的邮件头：属性名 -> (槽位, 标志位, 解码函数)
+_LAZY_HEADERS = {
+    'subject': ('_subject', 1, _decode_subject),
+    'sender': ('_sender', 2, lambda value: _decode_address(value, 'sender')),
+    'receiver': ('_receiver', 4, lambda value: _decode_address(value, 'receiver')),
+}
+
+
+# 附件信息：compact 模式下 parse_attachment 的返回值，可以像字典一样读写
+class Attachment(MutableMapping):
+    """附件信息
+
+    属性 content_type、size、name、data、path、file；同时是映射，
+    attachment['name']、attachment.get('path')、attachment['data'] = None 等字典写法照常可用，
+    但不能添加其他键。path（save_dir）和 file（sink）只在使用时出现在 keys() 中。
+    需要真正的字典时使用 toDict()。
+    """
+
+    __slots__ = ('content_type', 'size', 'name', 'data', 'path', 'file')
+    _KEYS = ('content_type', 'size', 'name', 'data')
+
+    def __init__(self, content_type, size, name, data=None, path=None, file=None):
+        self.content_type = content_type
+        self.size = size
+        self.name = name
+        self.data = data
+        self.path = path
+        self.file = file
+
+    def __getitem__(self, key):
+        if key in self._KEYS or (key in ('path', 'file') and getattr(self, key) is not None):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(f"Attachment has no field {key!r}")
+        setattr(self, key, value)
+
+    # 只有 path 和 file 可以删除
+    def __delitem__(self, key):
+        if key not in ('path', 'file') or getattr(self, key) is None:
+            raise KeyError(key)
+        setattr(self, key, None)
+
+    def __iter__(self):
+        yield from self._KEYS
+        if self.path is not None:
+            yield 'path'
+        if self.file is not None:
+            yield 'file'
+
+    def __len__(self):
+        return 4 + (self.path is not None) + (self.file is not None)
+
+    def __repr__(self):
+        return f'<Attachment {self.name!r} {self.content_type} {self.size} bytes>'
+
+    # 转为普通字典（与默认模式的解析结果相同）
+    def toDict(self):
+        return {key: getattr(self, key) for key in self}
+
+
+# 邮件信息：compact 模式下 getMailInfo / parseMailInfo 的返回值，可以像字典一样读写
+class MailInfo(MutableMapping):
+    """邮件信息
+
+    比字典紧凑（__slots__，没有每个对象的 __dict__），适合在内存中保留大量邮件的元信息。
+    属性 subject、body、html、attachments、sender、receiver；同时是映射，
+    键为 subject/body/html/attachments/from/to，info['from']、info.get('body')、
+    info['subject'] = ... 等写法照常可用，但不能添加其他键；
+    需要真正的字典（如 json.dumps 或添加自定义键）时使用 toDict()。
+    解析时指定了 want 的，只包含请求的字段。
+
+    subject、sender、receiver 保存原始邮件头，首次读取时才做 RFC 2047 解码。
+    """
+
+    __slots__ = ('_subject', '_sender', '_receiver', '_lazy', 'body', 'html', 'attachments')
+
+    def __init__(self, subject=_UNSET, body=_UNSET, html=_UNSET, attachments=_UNSET,
+                 sender=_UNSET, receiver=_UNSET):
+        """
+        Args:
+            subject: 主题
+            body: 纯文本正文（没有 text/plain 部分时为 None）
+            html: HTML 正文（没有 text/html 部分时为 None）
+            attachments: Attachment 列表
+            sender: 发件人 (name, address)
+            receiver: 收件人 (name, address)
+        """
+        self._lazy = 0
+        for attr, value in (('subject', subject), ('body', body), ('html', html),
+                            ('attachments', attachments), ('sender', sender), ('receiver', receiver)):
+            if value is not _UNSET:
+                setattr(self, attr, value)
+
+    # 保存原始邮件头，读取时再解码
+    def _setRaw(self, attr, value):
+        slot, flag, _ = _LAZY_HEADERS[attr]
+        setattr(self, slot, value)
+        self._lazy |= flag
+
+    def _getHeader(self, attr):
+        slot, flag, decode = _LAZY_HEADERS[attr]
+        value = getattr(self, slot)
+        if self._lazy & flag:
+            value = decode(value)
+            setattr(self, slot, value)
+            self._lazy &= ~flag
+        return value
+
+    def _setHeader(self, attr, value):
+        slot, flag, _ = _LAZY_HEADERS[attr]
+        setattr(self, slot, value)
+        self._lazy &= ~flag
+
+    # 主题
+    @property
+    def subject(self):
+        return self._getHeader('subject')
+
+    @subject.setter
+    def subject(self, value):
+        self._setHeader('subject', value)
+
+    # 发件人 (name, address)
+    @property
+    def sender(self):
+        return self._getHeader('sender')
+
+    @sender.setter
+    def sender(self, value):
+        self._setHeader('sender', value)
+
+    # 收件人 (name, address)
+    @property
+    def receiver(self):
+        return self._getHeader('receiver')
+
+    @receiver.setter
+    def receiver(self, value):
+        self._setHeader('receiver', value)
+
+    # 字段是否存在（不触发解码）
+    def _has(self, attr):
+        try:
+            getattr(self, _LAZY_HEADERS[attr][0] if attr in _LAZY_HEADERS else attr)
+        except AttributeError:
+            return False
+        return True
+
+    def __getitem__(self, key):
+        attr = _MAIL_INFO_ATTRS.get(key)
+        if attr is None or not self._has(attr):
+            raise KeyError(key)
+        return getattr(self, attr)
+
+    def __setitem__(self, key, value):
+        attr = _MAIL_INFO_ATTRS.get(key)
+        if attr is None:
+            raise KeyError(f"MailInfo has no field {key!r}")
+        setattr(self, attr, value)
+
+    def __delitem__(self, key):
+        attr = _MAIL_INFO_ATTRS.get(key)
+        if attr is None or not self._has(attr):
+            raise KeyError(key)
+        if attr in _LAZY_HEADERS:
+            slot, flag, _ = _LAZY_HEADERS[attr]
+            delattr(self, slot)
+            self._lazy &= ~flag
+        else:
+            delattr(self, attr)
+
+    def __contains__(self, key):
+        attr = _MAIL_INFO_ATTRS.get(key)
+        return attr is not None and self._has(attr)
+
+    def __iter__(self):
+        for key, attr in _MAIL_INFO_KEYS:
+            if self._has(attr):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        subject = self.get('subject')
+        return f'<MailInfo {subject!r} fields={list(self)}>'
+
+    # 转为普通字典（与默认模式的解析结果相同，附件也转为字典）
+    def toDict(self):
+        """返回 {subject, body, html, attachments, from, to} 字典，邮件头已解码，可以直接 json.dumps
+        （附件的 data 为 bytes，与默认模式相同）"""
+        result = {key: getattr(self, attr) for key, attr in _MAIL_INFO_KEYS if self._has(attr)}
+        if result.get('attachments'):
+            result['attachments'] = [a.toDict() if isinstance(a, Attachment) else a
+                                     for a in result['attachments']]
+        return result
+
+    # 转为列式数据，便于批量分析
+    @staticmethod
+    def toColumns(infos, fields=None):
+        """把一组邮件信息转为列式数据（每个字段一个列表）
+
+        发件人/收件人拆为 name 和 address 两列，附件汇总为数量、总大小和文件名列表，
+        结果可以直接交给 pandas.DataFrame 或 pyarrow.table。
+
+        Args:
+            infos: 可迭代对象，元素为 MailInfo（或同样键的字典），
+                或 getMailInfoBatch / iterMail / syncFolder 产出的 (id, info) 元组（此时增加 id 列）
+            fields: 需要的列（可选），默认全部：subject, from_name, from_address, to_name,
+                to_address, body, html, attachment_count, attachment_size, attachment_names
+
+        Returns:
+            OrderedDict {列名: 列表}，各列等长；缺失的字段为 None
+        """
+        columns = OrderedDict((name, []) for name in (fields or _MAIL_INFO_COLUMNS))
+        unknown = set(columns).difference(_MAIL_INFO_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns: {sorted(unknown)}")
+        ids = []
+        for item in infos:
+            if isinstance(item, tuple):
+                num, item = item
+                ids.append(num)
+            for name, values in columns.items():
+                values.append(_MAIL_INFO_COLUMNS[name](item))
+        if ids:
+            columns['id'] = ids
+            columns.move_to_end('id', last=False)
+        return columns
+
+    # 转为 pyarrow.Table（可用 pyarrow.parquet.write_table 写为 Parquet）
+    @staticmethod
+    def toArrow(infos, fields=None):
+        """把一组邮件信息转为 pyarrow.Table，参数同 toColumns
+
+        Raises:
+            ImportError: 没有安装 pyarrow
+        """
+        try:
+            import pyarrow
+        except ImportError as e:
+            raise ImportError("MailInfo.toArrow requires pyarrow (pip install pyarrow)") from e
+        return pyarrow.table(MailInfo.toColumns(infos, fields))
+
+
+def _info_address(info, key, index):
+    value = info.get(key)
+    return value[index] if value else None
+
+
+def _info_attachments(info):
+    return info.get('attachments') or ()
+
+
+# 列名 -> 从一封邮件信息中取值的函数
+_MAIL_INFO_COLUMNS = OrderedDict((
+    ('subject', lambda info: info.get('subject')),
+    ('from_name', lambda info: _info_address(info, 'from', 0)),
+    ('from_address', lambda info: _info_address(info, 'from', 1)),
+    ('to_name', lambda info: _info_address(info, 'to', 0)),
+    ('to_address', lambda info: _info_address(info, 'to', 1)),
+    ('body', lambda info: info.get('body')),
+    ('html', lambda info: info.get('html')),
+    ('attachment_count', lambda info: len(_info_attachments(info))),
+    ('attachment_size', lambda info: sum(a.get('size') or 0 for a in _info_attachments(info))),
+    ('attachment_names', lambda info: [a.get('name') for a in _info_attachments(info)]),
+))
+
+
+# 邮件解析方法（不依赖网络连接），由 ReceiveMailDealer 等类继承
+class MailParser:
+
+    # 指标收集器（MailMetrics），设置后记录每封邮件的解析耗时
+    metrics = None
+    # 为 True 时解析结果为 MailInfo / Attachment（更省内存，邮件头首次读取时才解码），默认为普通字典
+    compact = False
+
+    # 返回发送者的信息——元组（邮件称呼，邮件地址）
+    def getSenderInfo(self, msg):
+        """解析发件人信息
+        
+        Args:
+            msg: email.message.Message 对象
+        
+        Returns:
+            (name, address) 元组
+        """
+        return _decode_address(msg.get('from', ''), 'sender')
+
+
+    # 返回接收者的信息——元组（邮件称呼，邮件地址）
+    def getReceiverInfo(self, msg):
+        """解析收件人信息
+        
+        Args:
+            msg: email.message.Message 对象
+        
+        Returns:
+            (name, address) 元组
+        """
+        return _decode_address(msg.get('to', ''), 'receiver')
+
+
+    # 返回邮件的主题（参数msg是email对象，可调用getEmailFormat获得）
+    def getSubjectContent(self, msg):
+        """解析邮件主题
+        
+        Args:
+            msg: email.message.Message 对象
+        
+        Returns:
+            解码后的主题字符串
+        """
+        return _decode_subject(msg.get('subject', ''))
+
+
+    # 判断是否有附件，并解析（解析email对象的part）
+    # 返回字典（内容类型，大小，文件名，数据流），compact 模式下为 Attachment
+    def parse_attachment(self, message_part, save_dir=None, sink=None):
+        """解析附件
+        
+        指定 save_dir 或 sink 时，base64/quoted-printable 附件按固定大小分块解码
+        并直接写出，data 为 None，解码后的数据不会整体留在内存中
+        （message_part 本身已在内存中；parseMailBytes 可以直接从原始数据解码）。
+
+        Args:
+            message_part: 邮件的一个 part
+            save_dir: 附件保存目录（可选），重名时自动加序号
+            sink: 可选的 callable(name, content_type)，返回可写的二进制文件对象
+                （写完后不关闭，由调用方负责）
+        
+        Returns:
+            附件字典 {content_type, size, name, data}（compact 模式下为 Attachment）或 None；
+            使用 save_dir 时另含 path（文件路径），使用 sink 时另含 file（文件对象）
+        """
+        if _is_attachment_part(message_part):
+            if save_dir is not None or sink is not None:
+                if message_part.is_multipart() or not message_part.get_payload():
+                    return None
+                return self._storeAttachment(message_part, save_dir, sink,
+                                             lambda fileobj: _write_decoded_payload(message_part, fileobj))
+            file_data = message_part.get_payload(decode=True)
+            if not file_data:
+                return None
+            filename = self._attachmentFilename(message_part)
+            logger.debug("Parsed attachment: %s (%s bytes)", filename, len(file_data))
+            attachment = Attachment(message_part.get_content_type(), len(file_data), filename, file_data)
+            return attachment if self.compact else attachment.toDict()
+        return None
+
+
+    # 获取并清洗附件文件名 (修复 Issue #7)，无文件名时生成默认名称
+    def _attachmentFilename(self, message_part):
+        filename = message_part.get_filename()
+        if filename:
+            return _clean_filename(filename, f'attachment_{id(message_part)}')
+        ext = message_part.get_content_subtype()
+        return f'attachment_{id(message_part)}.{ext}'
+
+
+    # 把附件写入 save_dir 或 sink，write(fileobj) 写出解码后的数据并返回字节数
+    def _storeAttachment(self, message_part, save_dir, sink, write):
+        content_type = message_part.get_content_type()
+        filename = self._attachmentFilename(message_part)
+        path = fileobj = None
+        if save_dir is not None:
+            path, saved = _open_unique(save_dir, filename)
+            with saved:
+                size = write(saved)
+        else:
+            fileobj = sink(filename, content_type)
+            size = write(fileobj)
+            fileobj.flush()
+        logger.debug("Parsed attachment: %s (%s bytes)", filename, size)
+        attachment = Attachment(content_type, size, filename, None, path=path, file=fileobj)
+        return attachment if self.compact else attachment.toDict()
+
+
+    # 从原始邮件数据中分块解码一个附件并写入 save_dir 或 sink，不构造正文的 Message
+    def _storeRawAttachment(self, headers, raw, part_start, body_start, body_end, save_dir, sink):
+        if body_end <= body_start:
+            return None
+        cte = str(headers.get('Content-Transfer-Encoding', '')).strip().lower()
+
+        def write(fileobj):
+            if cte in ('base64', 'quoted-printable'):
+                return _write_decoded(cte, raw, fileobj, body_start, body_end)
+            if cte in ('', '7bit', '8bit', 'binary'):
+                for pos in range(body_start, body_end, _STREAM_CHUNK_SIZE):
+                    fileobj.write(raw[pos:min(pos + _STREAM_CHUNK_SIZE, body_end)])
+                return body_end - body_start
+            # 其他编码（如 x-uuencode）交给 email 解码
+            return _write_decoded_payload(email.message_from_bytes(raw[part_start:body_end]), fileobj)
+
+        return self._storeAttachment(headers, save_dir, sink, write)
+
+
+    # 解析 email 对象为 MailInfo
+    def parseMailInfo(self, msg, save_dir=None, sink=None, want=None):
+        """解析邮件对象
+
+        一次遍历完成分类：附件交给 parse_attachment，正文和 HTML 片段收集后一次拼接；
+        want 中没有的字段不解码（只要邮件头字段时完全不遍历 part）。
+
+        Args:
+            msg: email.message.Message 对象
+            save_dir: 附件保存目录（可选），见 parse_attachment
+            sink: 附件输出 callable（可选），见 parse_attachment
+            want: 需要的字段（可选），如 ('subject', 'body')，默认全部
+
+        Returns:
+            字典 {subject, body, html, from, to, attachments}（compact 模式下为 MailInfo）；
+            指定 want 时只包含这些字段
+        """
+        if self.metrics is None:
+            return self._parseMailInfo(msg, save_dir, sink, want)
+        start = time.perf_counter()
+        info = self._parseMailInfo(msg, save_dir, sink, want)
+        self.metrics.observeParse(time.perf_counter() - start)
+        return info
+
+    # 新建解析结果：compact 模式下为 MailInfo，否则直接构造字典
+    def _newMailInfo(self):
+        return MailInfo() if self.compact else {}
+
+    # 写入邮件头字段：MailInfo 保存原始值（读取时再解码），字典直接写入解码后的值
+    def _setMailHeader(self, info, attr, value):
+        if self.compact:
+            info._setRaw(attr, value)
+        else:
+            info[_MAIL_INFO_HEADER_KEYS[attr]] = _LAZY_HEADERS[attr][2](value)
+
+    def _parseMailInfo(self, msg, save_dir, sink, want):
+        want = _MAIL_INFO_FIELDS if want is None else frozenset(want)
+        info = self._newMailInfo()
+        if 'subject' in want:
+            self._setMailHeader(info, 'subject', msg.get('subject', ''))
+        want_body = 'body' in want
+        want_html = 'html' in want
+        want_attachments = 'attachments' in want
+        if want_body or want_html or want_attachments:
+            body, html, attachments = [], [], []
+            has_body = has_html = False
+            for part in msg.walk():
+                if part.is_multipart():
+                    continue
+                if _is_attachment_part(part):
+                    if want_attachments:
+                        attachment = self.parse_attachment(part, save_dir=save_dir, sink=sink)
+                        if attachment:
+                            attachments.append(attachment)
+                            continue
+                    elif part.get_payload():
+                        continue
+                content_type = part.get_content_type()
+                if content_type == 'text/plain':
+                    has_body = True
+                    if want_body:
+                        body.append(_decode_text_part(part, 'body'))
+                elif content_type == 'text/html':
+                    has_html = True
+                    if want_html:
+                        html.append(_decode_text_part(part, 'html'))
+            if want_body:
+                info['body'] = ''.join(body) if has_body else None
+            if want_html:
+                info['html'] = ''.join(html) if has_html else None
+            if want_attachments:
+                info['attachments'] = attachments
+        if 'from' in want:
+            self._setMailHeader(info, 'sender', msg.get('from', ''))
+        if 'to' in want:
+            self._setMailHeader(info, 'receiver', msg.get('to', ''))
+        return info
+
+    # 同 parseMailInfo，但直接遍历原始数据（见 parseMailBytes），用于把附件写入 save_dir / sink
+    def _parseRawMailInfo(self, raw, save_dir, sink, want):
+        want = _MAIL_INFO_FIELDS if want is None else frozenset(want)
+        header_end, _ = _split_raw_header(raw, 0, len(raw))
+        msg = _HEADER_PARSER.parsebytes(raw[:header_end])
+        info = self._newMailInfo()
+        if 'subject' in want:
+            self._setMailHeader(info, 'subject', msg.get('subject', ''))
+        want_body = 'body' in want
+        want_html = 'html' in want
+        body, html, attachments = [], [], []
+        has_body = has_html = False
+        for headers, part_start, body_start, body_end in _iter_raw_parts(raw):
+            if _is_attachment_part(headers):
+                attachment = self._storeRawAttachment(headers, raw, part_start, body_start, body_end,
+                                                      save_dir, sink)
+                if attachment:
+                    attachments.append(attachment)
+                    continue
+            content_type = headers.get_content_type()
+            if content_type == 'text/plain':
+                has_body = True
+                if want_body:
+                    body.append(_decode_text_part(email.message_from_bytes(raw[part_start:body_end]), 'body'))
+            elif content_type == 'text/html':
+                has_html = True
+                if want_html:
+                    html.append(_decode_text_part(email.message_from_bytes(raw[part_start:body_end]), 'html'))
+        if want_body:
+            info['body'] = ''.join(body) if has_body else None
+        if want_html:
+            info['html'] = ''.join(html) if has_html else None
+        info['attachments'] = attachments
+        if 'from' in want:
+            self._setMailHeader(info, 'sender', msg.get('from', ''))
+        if 'to' in want:
+            self._setMailHeader(info, 'receiver', msg.get('to', ''))
+        return info
+
+    # 从原始邮件解析：只需要邮件头字段时只解析邮件头，把附件写入 save_dir / sink 时直接遍历原始数据
+    def parseMailBytes(self, raw, save_dir=None, sink=None, want=None):
+        """解析原始 RFC822 数据，参数和返回值同 parseMailInfo
+
+        want 只包含 subject/from/to 时只解析邮件头，不解析正文。
+        指定 save_dir 或 sink 时不把整封邮件解析为 Message：按 MIME 分隔行定位各部分，
+        附件直接从 raw 分块解码写出，只有正文部分单独解析；除 raw 本身外，
+        内存占用不随附件大小增长。raw 也可以是 mmap（iterMail 对超大邮件产出的），
+        此时只有这条路径不把整封邮件复制到内存。
+        raw 还可以是 memoryview（如共享内存）：解析为 Message 时直接从中解码，不先复制为 bytes。
+        设置了 metrics 时记录的解析耗时包含 MIME 结构的解析。
+        """
+        start = time.perf_counter()
+        if want is not None and not _BODY_FIELDS.intersection(want):
+            info = self._parseMailInfo(_HEADER_TEXT_PARSER.parsestr(_raw_text(raw)), save_dir, sink, want)
+        elif (save_dir is not None or sink is not None) and (want is None or 'attachments' in want):
+            # 按分隔行定位需要 find()，memoryview 没有，复制为 bytes
+            info = self._parseRawMailInfo(raw if hasattr(raw, 'find') else bytes(raw), save_dir, sink, want)
+        else:
+            info = self._parseMailInfo(email.message_from_string(_raw_text(raw)), save_dir, sink, want)
+        if self.metrics is not None:
+            self.metrics.observeParse(time.perf_counter() - start, len(raw))
+        return info
+
+    # 多进程解析：原始邮件交给进程池，按输入顺序产出结果
+    def parseMailParallel(self, items, workers=None, want=None, save_dir=None, batch_size=16,
+                          max_pending=None):
+        """用进程池并行解析原始邮件（MIME 解码是 CPU 密集的，多进程可以利用多核）
+
+        小邮件按 batch_size 封一组提交以减少进程间通信；不小于 1 MB 的邮件放入共享内存
+        （Python 3.8+），不经过管道传输，子进程直接从共享内存解析（见 parseMailBytes）。
+        最多 max_pending 组同时在途，输入按需读取。
+
+        Args:
+            items: 可迭代对象，元素为 (id, RFC822 bytes)
+            workers: 进程数（默认 CPU 核数），或已有的 concurrent.futures.Executor（不会被关闭）
+            want: 需要的字段（可选），见 parseMailInfo
+            save_dir: 附件保存目录（可选），由子进程写入；不支持 sink
+            batch_size: 每个任务包含的邮件数
+            max_pending: 同时在途的任务数，默认为进程数的 2 倍
+
+        Yields:
+            (id, 邮件信息) 元组，按输入顺序，格式同 parseMailInfo
+        """
+        own_executor = not isinstance(workers, Executor)
+        executor = ProcessPoolExecutor(workers) if own_executor else workers
+        if max_pending is None:
+            max_pending = 2 * (getattr(executor, '_max_workers', None) or os.cpu_count() or 1)
+        pending = deque()  # (ids, future, 共享内存块)
+        ids, batch, blocks, batch_bytes = [], [], [], 0
+        try:
+            for num, raw in items:
+                if shared_memory is not None and len(raw) >= _SHM_THRESHOLD:
+                    block = shared_memory.SharedMemory(create=True, size=len(raw))
+                    block.buf[:len(raw)] = raw
+                    blocks.append(block)
+                    batch.append((block.name, len(raw)))
+                else:
+                    # iterMail 对超大邮件产出的 mmap 不能传给子进程，复制为 bytes（已是 bytes 时不复制）
+                    batch.append(bytes(raw))
+                    batch_bytes += len(raw)
+                ids.append(num)
+                del raw
+                if len(batch) >= batch_size or batch_bytes >= _SHM_THRESHOLD:
+                    pending.append((ids, executor.submit(_parse_raw_batch, batch, want, save_dir, self.compact), blocks))
+                    ids, batch, blocks, batch_bytes = [], [], [], 0
+                while len(pending) >= max_pending:
+                    for result in _collect_parsed(pending.popleft()):
+                        yield result
+            if batch:
+                pending.append((ids, executor.submit(_parse_raw_batch, batch, want, save_dir, self.compact), blocks))
+                blocks = []
+            while pending:
+                for result in _collect_parsed(pending.popleft()):
+                    yield result
+        finally:
+            for _, future, pending_blocks in pending:
+                # 已经在子进程中运行的任务无法取消，完成后再释放它的共享内存
+                if future.cancel() or future.done():
+                    _release_blocks(pending_blocks)
+                else:
+                    future.add_done_callback(lambda _, pending_blocks=pending_blocks: _release_blocks(pending_blocks))
+            _release_blocks(blocks)
+            if own_executor:
+                executor.shutdown()
+
+
+# ========== 多进程解析 ==========
+_SHM_THRESHOLD = 1024 * 1024
+
+
+# 子进程中解析一组原始邮件；(name, size) 元组表示放在共享内存中的邮件
+def _parse_raw_batch(batch, want=None, save_dir=None, compact=False):
+    parser = MailParser()
+    parser.compact = compact
+    results = []
+    for item in batch:
+        if not isinstance(item, tuple):
+            results.append(parser.parseMailBytes(item, save_dir=save_dir, want=want))
+            continue
+        name, size = item
+        block = shared_memory.SharedMemory(name=name)
+        raw = block.buf[:size]
+        try:
+            results.append(parser.parseMailBytes(raw, save_dir=save_dir, want=want))
+        finally:
+            # 关闭共享内存前先释放对它的引用
+            raw.release()
+            block.close()
+    return results
+
+
+def _release_blocks(blocks):
+    for block in blocks:
+        block.close()
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# 等待一组解析任务完成并释放它的共享内存
+def _collect_parsed(entry):
+    ids, future, blocks = entry
+    try:
+        results = future.result()
+    finally:
+        _release_blocks(blocks)
+    return zip(ids, results)
+
+
+# ========== 接收邮件部分（IMAP）==========
+# 处理接收邮件的类
+class ReceiveMailDealer(MailParser):
+
+    # 构造函数(用户名，密码，imap服务器，可选的邮件缓存 MailCache，端口，是否使用SSL，可选的指标收集器 MailMetrics，
+    # 保活间隔秒数，断线时是否自动重连，是否返回 MailInfo 而不是字典)
+    def __init__(self, username, password, server, cache=None, port=None, use_ssl=True, metrics=None,
+                 keepalive=None, auto_reconnect=True, compact=False):
+        self.cache = cache
+        self.metrics = metrics
+        self.compact = compact
+        self.folder = None
+        self.uidvalidity = None
+        self.exists = 0
+        self.username = username
+        self.password = password
+        self.server = server
+        self.port = port or (imaplib.IMAP4_SSL_PORT if use_ssl else imaplib.IMAP4_PORT)
+        self.use_ssl = use_ssl
+        self.auto_reconnect = auto_reconnect
+        self.mail = None
+        self._lock = threading.RLock()
+        self._last_used = time.monotonic()
+        self._reconnecting = False
+        self._keepalive = None
+        self._expunged = 0  # 收到的 EXPUNGE 总数
+        self._pending_fetches = {}  # 流水线发出、尚未读取应答的 FETCH：{标签: 命令名}
+        self._fetched = {}  # 已读取、尚未被取走的流水线 FETCH 结果：{标签: (typ, data) 或异常}
+        self._connect()
+        self.select("INBOX")
+        if keepalive:
+            self._keepalive = _KeepaliveThread(self, keepalive)
+            self._keepalive.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 建立连接并登录；重连时创建新的 imaplib 对象
+    def _connect(self):
+        """建立 IMAP 连接并登录
+
+        每次都创建新的 imaplib 对象并重新挂上指标统计、自动重连包装和邮箱状态跟踪；
+        重连时正在执行的命令能否在新连接上重发见 _reconnecting_method。
+
+        Raises:
+            MailConnectionError: 连接失败
+            MailAuthError: 认证失败
+        """
+        server = self.server
+        try:
+            # 重连时也创建新的连接对象，旧对象的缓冲区和未处理的响应不会带到新连接
+            imap_class = imaplib.IMAP4_SSL if self.use_ssl else imaplib.IMAP4
+            self.mail = imap_class(server, self.port)
+            # 旧连接上在途的流水线 FETCH 不会再有应答，由 _finishFetch 决定重新获取还是报错
+            for tag in self._pending_fetches:
+                self._fetched[tag] = MailConnectionError("IMAP connection was reset before FETCH completed")
+            self._pending_fetches.clear()
+            if self.metrics is not None:
+                _instrument_imap(self.mail, self.metrics)
+            self._wrapCommands()
+            self._trackMailbox()
+            # 避免 Nagle 算法和延迟 ACK 叠加，使 literal 等分多次写出的命令多等 40 ms
+            self.mail.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            logger.info("Connected to IMAP server: %s", server)
+        except Exception as e:
+            logger.error("Failed to connect to IMAP server %s: %s", server, e)
+            raise MailConnectionError(f"Cannot connect to {server}: {e}")
+        
+        try:
+            self.mail.login(self.username, self.password)
+            logger.info("Logged in as: %s", self.username)
+        except Exception as e:
+            logger.error("Authentication failed for %s: %s", self.username, e)
+            raise MailAuthError(f"Login failed: {e}")
+
+    # 包装 imaplib 的命令入口：串行化命令、记录最后使用时间；包装公开方法，断线时重连
+    def _wrapCommands(self):
+        mail = self.mail
+        simple_command = mail._simple_command
+
+        def _simple_command(name, *args):
+            with self._lock:
+                # 先读完流水线 FETCH 的应答，避免其他命令取走它的 FETCH 响应
+                self._drainFetches()
+                try:
+                    return simple_command(name, *args)
+                finally:
+                    self._last_used = time.monotonic()
+
+        mail._simple_command = _simple_command
+        mail._pymail_methods = {}
+        for method in _IMAP_REPLAYABLE | {'fetch', 'search', 'uid'}:
+            mail._pymail_methods[method] = getattr(mail, method)
+            setattr(mail, method, self._reconnecting_method(mail, method))
+
+    # 包装 imaplib 的公开方法：断线时重连，可以安全重发的命令直接在新连接上重发并返回新连接的结果
+    def _reconnecting_method(self, mail, method):
+        call = mail._pymail_methods[method]
+
+        def wrapper(*args, **kwargs):
+            with self._lock:
+                literal = mail.literal  # _command 发出命令时会清空 literal，重发前在新连接上恢复
+                try:
+                    return call(*args, **kwargs)
+                except (imaplib.IMAP4.abort, OSError) as e:
+                    command = str(args[0]).upper() if method == 'uid' and args else method.upper()
+                    if method == 'uid':
+                        replayable = command in _IMAP_UID_REPLAYABLE
+                    else:
+                        replayable = method in _IMAP_REPLAYABLE
+                    if self._reconnecting or not self.auto_reconnect or not (replayable or method in ('fetch', 'search')):
+                        raise
+                    logger.warning("IMAP connection lost during %s, reconnecting: %s", command, e)
+                    self.reconnect()
+                    if not replayable:
+                        raise MailConnectionError(
+                            f"IMAP connection lost during {command}; reconnected, but message sequence numbers "
+                            f"may have changed, search again (or use UIDs): {e}") from e
+                    # 在新连接上直接重发（不经过包装，不再进入重连流程）
+                    self.mail.literal = literal
+                    return self.mail._pymail_methods[method](*args, **kwargs)
+
+        return wrapper
+
+    # 跟踪服务器推送的 EXISTS / EXPUNGE，使 self.exists 始终是当前文件夹的邮件数
+    def _trackMailbox(self):
+        append_untagged = self.mail._append_untagged
+
+        def _append_untagged(typ, dat):
+            if typ == 'EXISTS':
+                try:
+                    self.exists = int(dat)
+                except (TypeError, ValueError):
+                    pass
+            elif typ == 'EXPUNGE':
+                self.exists = max(self.exists - 1, 0)
+                self._expunged += 1
+            append_untagged(typ, dat)
+
+        self.mail._append_untagged = _append_untagged
+
+    # 重新连接、登录并重新选择之前的文件夹
+    def reconnect(self):
+        """关闭当前连接（忽略错误），重新连接、登录，并重新选择之前选择的文件夹
+
+        Raises:
+            MailConnectionError: 连接失败或无法重新选择文件夹
+            MailAuthError: 认证失败
+        """
+        if self.metrics is not None:
+            self.metrics.addRetry('imap', 'reconnect')
+        with self._lock:
+            self._reconnecting = True
+            try:
+                try:
+                    self.mail.shutdown()
+                except Exception as e:
+                    logger.debug("Error closing IMAP connection before reconnect: %s", e)
+                self._connect()
+                folder, uidvalidity = self.folder or 'INBOX', self.uidvalidity
+                typ, data = self.select(folder)
+                if typ != 'OK':
+                    raise MailConnectionError(f"Cannot reselect {folder} after reconnect: {data}")
+                if uidvalidity is not None and self.uidvalidity != uidvalidity:
+                    logger.warning("UIDVALIDITY of %s changed after reconnect: %s -> %s",
+                                   folder, uidvalidity, self.uidvalidity)
+            finally:
+                self._reconnecting = False
+
+    # 发送 NOOP（保持连接、接收服务器状态更新），连接已断开时自动重连
+    def noop(self):
+        """发送 NOOP
+
+        Returns:
+            (status, data)
+        """
+        return self.mail.noop()
+
+    # 关闭连接（登出）
+    def close(self):
+        """登出并关闭IMAP连接"""
+        if getattr(self, '_keepalive', None) is not None:
+            self._keepalive.cancel()
+            self._keepalive = None
+        try:
+            if hasattr(self, 'mail') and self.mail:
+                self.mail.logout()
+                logger.info("IMAP connection closed")
+        except Exception as e:
+            logger.warning("Error closing IMAP connection: %s", e)
+
+    # 返回所有文件夹
+    def showFolders(self):
+        return self.mail.list()
+    
+    # 选择收件箱（如"INBOX"，如果不知道可以调用showFolders）
+    def select(self, selector):
+        result = self.mail.select(selector)
+        if result[0] == 'OK':
+            # 记录当前文件夹和 UIDVALIDITY，作为缓存键的一部分
+            self.folder = selector
+            try:
+                self.exists = int(result[1][0])
+            except (TypeError, ValueError, IndexError):
+                self.exists = 0
+            typ, data = self.mail.response('UIDVALIDITY')
+            try:
+                self.uidvalidity = int(data[-1]) if data and data[-1] else None
+            except (TypeError, ValueError):
+                self.uidvalidity = None
+        return result
+
+    # 搜索邮件(参照RFC文档http://tools.ietf.org/html/rfc3501#page-49)
+    def search(self, charset, *criteria):
+        try:
+            return self.mail.search(charset, *criteria)
+        except MailConnectionError:
+            # 已重连，序号可能已变化，由调用方重新搜索
+            raise
+        except Exception as e:
+            logger.warning("Search failed, retrying after selecting %s: %s", self.folder or 'INBOX', e)
+            if self.metrics is not None:
+                self.metrics.addRetry('imap', 'SEARCH')
+            try:
+                self.select(self.folder or 'INBOX')
+                return self.mail.search(charset, *criteria)
+            except Exception as e2:
+                logger.error("Search failed after retry: %s", e2)
+                raise MailFetchError(f"Search failed: {e2}")
+
+    # 返回所有未读的邮件列表（返回的是包含邮件序号的列表）
+    def getUnread(self):
+        """获取未读邮件列表"""
+        return self.search(None, "Unseen")
+    
+    # 获取所有邮件列表 (Issue #4)
+    def getAll(self):
+        """获取所有邮件列表"""
+        return self.search(None, 'ALL')
+    
+    # 执行 SearchQuery（一条 SEARCH / UID SEARCH 命令）
+    def searchQuery(self, query, uid=False):
+        """在服务器端执行组合搜索条件
+
+        Args:
+            query: SearchQuery 对象
+            uid: 是否使用 UID SEARCH（返回 UID）
+
+        Returns:
+            搜索结果 (status, [b'1 2 3'])，格式同 search()
+
+        Raises:
+            MailError: 条件无法编译（见 SearchQuery.compile）
+            MailConnectionError: 序号搜索期间连接中断（已自动重连，需要重新搜索）
+            MailFetchError: 搜索失败
+        """
+        charset, criteria, literal = query.compile()
+        return self._searchCompiled(charset, criteria, literal, uid=uid)
+
+    # 发送编译后的搜索命令，出错（BAD、连接问题）时重新选择当前文件夹后重试一次
+    def _searchCompiled(self, charset, criteria, literal, uid=False, returns=None):
+        """服务器回答 NO（如 BADCHARSET）说明条件本身不被接受，直接抛出，不重试"""
+        args = ([f'RETURN ({returns})'] if returns else []) + \
+               (['CHARSET', charset] if charset else []) + [criteria]
+        for attempt in range(2):
+            try:
+                # 设置 literal 和发出命令之间不能插入保活 NOOP
+                with self._lock:
+                    self.mail.literal = literal
+                    if uid:
+                        typ, data = self.mail.uid('SEARCH', *args)
+                    else:
+                        typ, data = self.mail.search(None, *args)
+                break
+            except MailConnectionError:
+                raise
+            except Exception as e:
+                if attempt:
+                    logger.error("Search failed after retry: %s", e)
+                    raise MailFetchError(f"Search failed: {e}")
+                logger.warning("Search failed, retrying after selecting %s: %s", self.folder or 'INBOX', e)
+                if self.metrics is not None:
+                    self.metrics.addRetry('imap', 'SEARCH')
+                try:
+                    self.select(self.folder or 'INBOX')
+                except Exception as select_error:
+                    raise MailFetchError(f"Search failed: {e}; reselect failed: {select_error}")
+            finally:
+                self.mail.literal = None
+        if typ != 'OK':
+            logger.error("Search failed: %s", data)
+            raise MailFetchError(f"Search failed: {data}")
+        return typ, data
+
+    # 搜索结果统计：数量、最小和最大序号/UID
+    def searchStats(self, query, uid=False):
+        """统计搜索结果，服务器支持 ESEARCH（RFC 4731）时只返回统计值而不传输完整列表
+
+        Args:
+            query: SearchQuery 对象
+            uid: min/max 是否为 UID
+
+        Returns:
+            {'count': n, 'min': 最小值或 None, 'max': 最大值或 None}
+
+        Raises:
+            MailError: 条件无法编译
+            MailFetchError: 搜索失败
+        """
+        charset, criteria, literal = query.compile()
+        if 'ESEARCH' not in self.mail.capabilities:
+            typ, data = self._searchCompiled(charset, criteria, literal, uid=uid)
+            ids = [int(num) for num in _id_list(data)]
+            return {'count': len(ids), 'min': min(ids) if ids else None, 'max': max(ids) if ids else None}
+
+        self.mail.response('ESEARCH')
+        self._searchCompiled(charset, criteria, literal, uid=uid, returns='COUNT MIN MAX')
+        stats = {'count': 0, 'min': None, 'max': None}
+        for line in self.mail.response('ESEARCH')[1]:
+            if isinstance(line, bytes):
+                for name, value in _ESEARCH_ITEM_RE.findall(line):
+                    stats[name.decode('ascii').lower()] = int(value)
+        return stats
+
+    # 按主题搜索 (Issue #10)
+    def searchBySubject(self, keyword):
+        """按主题关键词搜索邮件（支持中文等非 ASCII 关键词）
+        
+        Args:
+            keyword: 主题关键词
+        
+        Returns:
+            搜索结果 (status, [mail_ids])
+        """
+        return self.searchQuery(SearchQuery().subject(keyword))
+    
+    # 按发件人搜索 (Issue #10)
+    def searchBySender(self, sender_email):
+        """按发件人邮箱搜索邮件
+        
+        Args:
+            sender_email: 发件人邮箱地址
+        
+        Returns:
+            搜索结果 (status, [mail_ids])
+        """
+        return self.searchQuery(SearchQuery().sender(sender_email))
+    
+    # 按日期范围搜索
+    def searchByDateRange(self, since_date, before_date=None):
+        """按日期范围搜索邮件
+        
+        Args:
+            since_date: 开始日期 (格式: DD-MMM-YYYY, 如 01-Jan-2023，或 date 对象)
+            before_date: 结束日期 (可选)
+        
+        Returns:
+            搜索结果 (status, [mail_ids])
+        """
+        query = SearchQuery().since(since_date)
+        if before_date:
+            query = query.before(before_date)
+        return self.searchQuery(query)
+
+    # 执行一条可加 UID 前缀的命令，失败时抛出 MailError
+    def _uidCommand(self, command, uid, *args):
+        try:
+            if uid:
+                typ, data = self.mail.uid(command, *args)
+            else:
+                typ, data = self.mail._simple_command(command, *args)
+        except imaplib.IMAP4.error as e:
+            logger.error("%s failed: %s", command, e)
+            raise MailError(f"{command} failed: {e}")
+        if typ != 'OK':
+            logger.error("%s failed: %s", command, data)
+            raise MailError(f"{command} failed: {data}")
+        return typ, data
+
+    # 取出并统计服务器报告的 EXPUNGE（self.exists 已由 _trackMailbox 更新）
+    def _takeExpunged(self):
+        typ, data = self.mail.response('EXPUNGE')
+        return len([item for item in data if item is not None])
+
+    # 批量设置标志：id 压缩为 sequence-set，每段一条 STORE
+    def setFlags(self, ids, flags, action='+', uid=False):
+        """批量添加、移除或替换邮件标志
+
+        ids 压缩为 sequence-set（如 1:500,502），一条 STORE 命令处理整个集合，
+        命令行过长时才切分为多条。
+
+        Args:
+            ids: search() 的返回值、id 列表或空格分隔的字符串
+            flags: 标志，如 '\\Seen'，或标志列表 ['\\Seen', '\\Flagged']
+            action: '+' 添加，'-' 移除，'' 替换为 flags
+            uid: ids 是否为 UID
+
+        Returns:
+            发送的 STORE 命令数
+
+        Raises:
+            MailError: action 无效或服务器拒绝
+        """
+        if action not in ('+', '-', ''):
+            raise MailError(f"Invalid flag action: {action!r}")
+        flags = [flags] if isinstance(flags, str) else list(flags)
+        chunks = _chunk_id_set(_id_list(ids))
+        self._storeChunks(chunks, action, flags, uid)
+        logger.debug("Set flags %s%s on %s in %s commands", action, flags, self.folder, len(chunks))
+        return len(chunks)
+
+    # 对每个 sequence-set 发送一条 STORE
+    def _storeChunks(self, chunks, action, flags, uid):
+        for msg_set in chunks:
+            self._uidCommand('STORE', uid, msg_set, f'{action}FLAGS.SILENT', f'({" ".join(flags)})')
+
+    # 批量标记为已读（seen=False 时标记为未读）
+    def markSeen(self, ids, uid=False, seen=True):
+        """批量标记已读/未读，参数见 setFlags
+
+        Returns:
+            发送的 STORE 命令数
+        """
+        return self.setFlags(ids, '\\Seen', '+' if seen else '-', uid=uid)
+
+    # 删除已标记 \Deleted 的邮件：UID 集合且服务器支持 UIDPLUS 时只删除这些邮件
+    def _expungeSets(self, chunks, uid):
+        if uid and 'UIDPLUS' in self.mail.capabilities:
+            for msg_set in chunks:
+                self._uidCommand('EXPUNGE', True, msg_set)
+        else:
+            self._uidCommand('EXPUNGE', False)
+
+    # 批量删除邮件
+    def delete(self, ids, uid=False, expunge=True):
+        """批量删除邮件：STORE +FLAGS (\\Deleted)，然后 EXPUNGE
+
+        uid=True 且服务器支持 UIDPLUS（RFC 4315）时用 UID EXPUNGE 只删除这些邮件；
+        否则 EXPUNGE 会同时删除当前文件夹中其他已标记 \\Deleted 的邮件。
+
+        Args:
+            ids: search() 的返回值、id 列表或空格分隔的字符串
+            uid: ids 是否为 UID
+            expunge: 是否立即 EXPUNGE（False 时只做标记）
+
+        Returns:
+            服务器报告删除的邮件数
+
+        Raises:
+            MailError: 服务器拒绝
+        """
+        chunks = _chunk_id_set(_id_list(ids))
+        if not chunks:
+            return 0
+        self.mail.response('EXPUNGE')
+        self._storeChunks(chunks, '+', ['\\Deleted'], uid)
+        if expunge:
+            self._expungeSets(chunks, uid)
+        removed = self._takeExpunged()
+        logger.info("Deleted %s emails from %s", removed, self.folder)
+        return removed
+
+    # 批量移动邮件到另一个文件夹
+    def move(self, ids, folder, uid=False):
+        """批量移动邮件
+
+        服务器支持 MOVE（RFC 6851）时每个 sequence-set 一条 MOVE；否则 COPY，
+        再 STORE +FLAGS (\\Deleted) 和 EXPUNGE（规则同 delete）。
+        按序号移动且需要多条 MOVE 时从大到小处理，前面的移动不会改变后面各段的序号。
+
+        Args:
+            ids: search() 的返回值、id 列表或空格分隔的字符串
+            folder: 目标文件夹（含空格时自动加引号）
+            uid: ids 是否为 UID
+
+        Returns:
+            从当前文件夹移走的邮件数（服务器报告的 EXPUNGE 数）
+
+        Raises:
+            MailError: 服务器拒绝（如目标文件夹不存在）
+        """
+        chunks = _chunk_id_set(_id_list(ids))
+        if not chunks:
+            return 0
+        target = folder if folder.startswith('"') else _imap_quote(folder)
+        self.mail.response('EXPUNGE')
+        if 'MOVE' in self.mail.capabilities:
+            for msg_set in (chunks if uid else reversed(chunks)):
+                self._uidCommand('MOVE', uid, msg_set, target)
+        else:
+            for msg_set in chunks:
+                self._uidCommand('COPY', uid, msg_set, target)
+            self._storeChunks(chunks, '+', ['\\Deleted'], uid)
+            self._expungeSets(chunks, uid)
+        moved = self._takeExpunged()
+        logger.info("Moved %s emails from %s to %s", moved, self.folder, folder)
+        return moved
+    
+    # 以RFC822协议格式返回邮件详情的email对象
+    def getEmailFormat(self, num, uid=False):
+        """获取邮件的email对象
+        
+        设置了 cache 时先按 文件夹+UIDVALIDITY+UID 查找缓存，未命中才 FETCH。
+
+        Args:
+            num: 邮件序号
+            uid: num 是否为 UID（使用缓存时可省去一次序号到 UID 的查询）
+        
+        Returns:
+            email.message.Message 对象
+        
+        Raises:
+            MailFetchError: 获取邮件失败
+        """
+        mail_data = self._fetchRawMail(num, uid)
+        if isinstance(mail_data, bytes):
+            return email.message_from_bytes(mail_data)
+        return email.message_from_string(mail_data)
+
+    # 获取一封原始邮件（RFC822 bytes），设置了 cache 时先查缓存
+    def _fetchRawMail(self, num, uid=False):
+        if self.cache is not None and self.uidvalidity is not None:
+            ids = _id_list([num])
+            raw = self._fetchRawCached(ids, uid=uid).get(ids[0])
+            if raw is None:
+                raise MailFetchError(f"Failed to fetch email {num}: not found")
+            return raw
+
+        try:
+            if uid:
+                data = self.mail.uid('FETCH', num, '(RFC822)')
+            else:
+                data = self.mail.fetch(num, 'RFC822')
+            if data[0] == 'OK' and data[1] and data[1][0]:
+                return data[1][0][1]
+            else:
+                raise MailFetchError(f"Failed to fetch email {num}: {data}")
+        except MailConnectionError:
+            raise
+        except Exception as e:
+            logger.error("Error fetching email %s: %s", num, e)
+            raise MailFetchError(f"Failed to fetch email {num}: {e}")
+
+    # 返回邮件的解析后信息部分
+    # 返回字典包含（主题，纯文本正文部分，html的正文部分，发件人元组，收件人元组，附件列表）
+    def getMailInfo(self, num, save_dir=None, sink=None, uid=False, want=None):
+        """获取邮件完整信息
+        
+        Args:
+            num: 邮件序号
+            save_dir: 附件保存目录（可选），见 parse_attachment
+            sink: 附件输出 callable（可选），见 parse_attachment
+            uid: num 是否为 UID
+            want: 需要的字段（可选），见 parseMailInfo；只要 subject/from/to 时
+                只获取邮件头（BODY.PEEK[HEADER]，不标记已读）
+        
+        Returns:
+            字典 {subject, body, html, from, to, attachments}（compact 模式下为 MailInfo）
+        """
+        if want is not None and not _BODY_FIELDS.intersection(want):
+            ids = _id_list([num])
+            raw = self._fetchRawChunk(ids, uid=uid, item='BODY.PEEK[HEADER]').get(ids[0])
+            if raw is None:
+                raise MailFetchError(f"Failed to fetch email {num}: not found")
+            return self.parseMailBytes(raw, want=want)
+        if save_dir is not None or sink is not None:
+            # 附件直接从原始数据分块解码写出，见 parseMailBytes
+            return self.parseMailBytes(self._fetchRawMail(num, uid), save_dir=save_dir, sink=sink, want=want)
+        return self.parseMailInfo(self.getEmailFormat(num, uid=uid), want=want)
+
+    # 批量获取原始邮件（一次 FETCH 获取多封），返回 {id: RFC822 bytes}
+    def _fetchRawChunk(self, ids, uid=False, item='RFC822'):
+        """用一条 FETCH 命令获取一组邮件的原始数据
+
+        Args:
+            ids: id 列表（str）
+            uid: ids 是否为 UID
+            item: FETCH 的数据项，如 'RFC822'、'BODY.PEEK[HEADER]' 或部分读取 'BODY.PEEK[]<0.1024>'
+
+        Returns:
+            {id: bytes} 字典，服务器未返回的 id 不在其中
+
+        Raises:
+            MailFetchError: 获取失败
+        """
+        attr = _fetch_attr(item)
+        result = {}
+        for num, attrs in self._fetchAttrs(ids, uid, item).items():
+            raw = attrs.get(attr)
+            if raw is not None:
+                result[num] = raw
+        return result
+
+    # 用一条 FETCH 命令获取一组邮件的数据项，返回 {id: {数据项: 值}}
+    def _fetchAttrs(self, ids, uid, items):
+        msg_set = _compress_ids(ids)
+        try:
+            if uid:
+                typ, data = self.mail.uid('FETCH', msg_set, f'(UID {items})')
+            else:
+                typ, data = self.mail.fetch(msg_set, f'({items})')
+        except MailConnectionError:
+            raise
+        except Exception as e:
+            logger.error("Error fetching emails %s: %s", msg_set, e)
+            raise MailFetchError(f"Failed to fetch emails {msg_set}: {e}")
+        if typ != 'OK':
+            raise MailFetchError(f"Failed to fetch emails {msg_set}: {data}")
+        return self._fetchedById(data, uid)
+
+    # 按 id 整理 FETCH 应答：UID FETCH 以 UID 为键，否则以序号为键
+    def _fetchedById(self, data, uid):
+        result = {}
+        for seq, attrs in _parse_fetch_response(data):
+            if uid:
+                if attrs.get('UID') is None:
+                    continue
+                result[_imap_str(attrs['UID'])] = attrs
+            else:
+                result[seq] = attrs
+        return result
+
+    # 发出 FETCH 但不等待应答，返回命令标签（发送失败时返回记录了异常的占位标签）；应答由 _finishFetch 读取
+    def _startFetch(self, ids, uid, items):
+        """流水线发出 FETCH：服务器传输这组邮件时，调用方可以继续处理上一组
+
+        同一时刻只有一条流水线 FETCH 在途；其间执行的其他命令会先读完它的应答（见 _wrapCommands）。
+        """
+        msg_set = _compress_ids(ids)
+        with self._lock:
+            self._drainFetches()
+            try:
+                if uid:
+                    tag = self.mail._command('UID', 'FETCH', msg_set, f'(UID {items})')
+                else:
+                    tag = self.mail._command('FETCH', msg_set, f'({items})')
+            except (imaplib.IMAP4.abort, OSError) as e:
+                logger.warning("Error sending FETCH %s: %s", msg_set, e)
+                tag = object()
+                self._fetched[tag] = e
+                return tag
+            except Exception as e:
+                logger.error("Error fetching emails %s: %s", msg_set, e)
+                raise MailFetchError(f"Failed to fetch emails {msg_set}: {e}")
+            finally:
+                self._last_used = time.monotonic()
+            self._pending_fetches[tag] = 'UID' if uid else 'FETCH'
+            return tag
+
+    # 读完所有在途的流水线 FETCH，结果暂存在 self._fetched（调用方持有 self._lock）
+    def _drainFetches(self):
+        while self._pending_fetches:
+            tag = next(iter(self._pending_fetches))
+            name = self._pending_fetches.pop(tag)
+            try:
+                typ, data = self.mail._command_complete(name, tag)
+                self._fetched[tag] = self.mail._untagged_response(typ, data, 'FETCH')
+            except (imaplib.IMAP4.error, OSError) as e:
+                self._fetched[tag] = e
+
+    # 读取 _startFetch 发出的 FETCH 的应答，返回 {id: {数据项: 值}}
+    def _finishFetch(self, tag, ids, uid, items):
+        """读取流水线 FETCH 的应答
+
+        命令没有发出、或连接在此期间中断过时：UID FETCH 在（自动重连后的）连接上重新获取；
+        序号 FETCH 不重新获取（新会话上同样的序号可能指向别的邮件），重连后抛出 MailConnectionError。
+
+        Raises:
+            MailConnectionError: 序号 FETCH 期间连接中断（已重连，需要重新搜索）
+            MailFetchError: 获取失败
+        """
+        with self._lock:
+            if tag in self._pending_fetches:
+                self._drainFetches()
+            result = self._fetched.pop(tag, None)
+        msg_set = _compress_ids(ids)
+        reset = isinstance(result, MailConnectionError)
+        if reset or (isinstance(result, (imaplib.IMAP4.abort, OSError)) and self.auto_reconnect):
+            if uid:
+                logger.warning("IMAP connection lost during UID FETCH, fetching again: %s", result)
+                return self._fetchAttrs(ids, uid, items)
+            if not reset:
+                logger.warning("IMAP connection lost during FETCH %s, reconnecting: %s", msg_set, result)
+                self.reconnect()
+            raise MailConnectionError(
+                f"IMAP connection lost during FETCH {msg_set}; reconnected, but message sequence numbers "
+                f"may have changed, search again (or use UIDs): {result}") from result
+        if isinstance(result, Exception):
+            logger.error("Error fetching emails %s: %s", msg_set, result)
+            raise MailFetchError(f"Failed to fetch emails {msg_set}: {result}")
+        typ, data = result
+        if typ != 'OK':
+            raise MailFetchError(f"Failed to fetch emails {msg_set}: {data}")
+        return self._fetchedById(data, uid)
+
+    # 放弃流水线 FETCH（如遍历提前结束）：读完应答并丢弃
+    def _discardFetch(self, tag):
+        with self._lock:
+            if tag in self._pending_fetches:
+                self._drainFetches()
+            self._fetched.pop(tag, None)
+
+    # 批量查询序号对应的 UID，返回 {序号: UID}
+    def _fetchUids(self, nums):
+        """用一条 FETCH (UID) 命令查询一组序号的 UID"""
+        msg_set = _compress_ids(nums)
+        try:
+            typ, data = self.mail.fetch(msg_set, '(UID)')
+        except MailConnectionError:
+            raise
+        except Exception as e:
+            logger.error("Error fetching UIDs of %s: %s", msg_set, e)
+            raise MailFetchError(f"Failed to fetch UIDs of {msg_set}: {e}")
+        if typ != 'OK':
+            raise MailFetchError(f"Failed to fetch UIDs of {msg_set}: {data}")
+        return {seq: _imap_str(attrs['UID'])
+                for seq, attrs in _parse_fetch_response(data) if attrs.get('UID') is not None}
+
+    # 先查缓存，只 FETCH 未命中的邮件，返回 {id: RFC822 bytes}
+    def _fetchRawCached(self, ids, uid=False):
+        """获取一组邮件的原始数据，优先使用 self.cache
+
+        Args:
+            ids: id 列表（str）
+            uid: ids 是否为 UID
+
+        Returns:
+            {id: bytes} 字典
+        """
+        if self.cache is None or self.uidvalidity is None:
+            return self._fetchRawChunk(ids, uid=uid)
+
+        uids = {num: num for num in ids} if uid else self._fetchUids(ids)
+        raws = {}
+        missing = []
+        for num in ids:
+            raw = None
+            if uids.get(num) is not None:
+                raw = self.cache.get(self.folder, self.uidvalidity, uids[num])
+            if raw is None:
+                missing.append(num)
+            else:
+                raws[num] = raw
+        if missing:
+            logger.debug("Cache hit %s/%s in %s", len(ids) - len(missing), len(ids), self.folder)
+            for num, raw in self._fetchRawChunk(missing, uid=uid).items():
+                if uids.get(num) is not None:
+                    self.cache.put(self.folder, self.uidvalidity, uids[num], raw)
+                raws[num] = raw
+        return raws
+
+    # 按顺序逐封产出原始邮件：流水线 FETCH，可限制同时缓存的字节数
+    def _iterRawMail(self, ids, chunk_size=500, uid=False, max_inflight_bytes=None, item='RFC822'):
+        """分组获取原始邮件并按顺序逐封产出
+
+        先发出下一组的 FETCH 再产出当前组，服务器传输下一组时调用方处理当前组。
+        限制 max_inflight_bytes 时，同一条 FETCH 取回每封邮件的 RFC822.SIZE 和开头一段，
+        其余部分在产出该邮件时分段补取；比上限的三分之一还大的邮件分段写入临时文件，
+        以只读 mmap 产出（产出后关闭）。这样当前组、预取的下一组和正在补取的邮件
+        各占不超过上限的三分之一。
+
+        Args:
+            ids: id 列表（str）
+            chunk_size: 每条 FETCH 命令包含的邮件数
+            uid: ids 是否为 UID
+            max_inflight_bytes: 同时缓存的原始邮件字节数上限（None 表示不限制）
+            item: 'RFC822'（标记为已读）或 'BODY.PEEK[]'（不改变 \\Seen 标志）
+
+        Yields:
+            (id, raw) 元组，raw 为 bytes，超大邮件为 mmap
+
+        Raises:
+            MailFetchError: 获取失败
+        """
+        section = 'BODY.PEEK[]' if item.upper() == 'BODY.PEEK[]' else 'BODY[]'
+        share = prefix = None
+        if max_inflight_bytes:
+            share = max(max_inflight_bytes // 3, 1)
+            chunk_size = max(min(chunk_size, share // _FETCH_PREFIX_MIN), 1)
+            prefix = max(share // chunk_size, 1)
+            item = f'RFC822.SIZE {section}<0.{prefix}>'
+        use_cache = self.cache is not None and self.uidvalidity is not None
+
+        def start(group):
+            cached, uids = {}, {}
+            if use_cache:
+                uids = {num: num for num in group} if uid else self._fetchUids(group)
+                for num in group:
+                    raw = self.cache.get(self.folder, self.uidvalidity, uids[num]) if num in uids else None
+                    if raw is not None:
+                        cached[num] = raw
+                if cached:
+                    logger.debug("Cache hit %s/%s in %s", len(cached), len(group), self.folder)
+            missing = [num for num in group if num not in cached]
+            tag = self._startFetch(missing, uid, item) if missing else None
+            return group, missing, tag, cached, uids
+
+        groups = _chunks(ids, chunk_size)
+        group = next(groups, None)
+        pending = start(group) if group else None
+        try:
+            while pending is not None:
+                group, missing, tag, cached, uids = pending
+                pending = None
+                fetched = self._finishFetch(tag, missing, uid, item) if missing else {}
+                group_next = next(groups, None)
+                if group_next:
+                    pending = start(group_next)
+                for num in group:
+                    raw, spool = cached.pop(num, None), None
+                    if raw is None:
+                        attrs = fetched.pop(num, None)
+                        if prefix is None:
+                            raw = attrs and attrs.get(_fetch_attr(item))
+                        elif attrs:
+                            raw, spool = self._completeRaw(num, attrs, uid, section, prefix, share)
+                        if raw is None:
+                            logger.warning("Email %s not returned by server, skipped", num)
+                            continue
+                        if num in uids and spool is None:
+                            self.cache.put(self.folder, self.uidvalidity, uids[num], raw)
+                    try:
+                        yield num, raw
+                    finally:
+                        if spool is not None:
+                            raw.close()
+                            spool.close()
+                    del raw
+        finally:
+            if pending is not None and pending[2] is not None:
+                self._discardFetch(pending[2])
+
+    # 由部分读取的开头一段补全邮件，返回 (raw, 临时文件或 None)
+    def _completeRaw(self, num, attrs, uid, section, prefix, share):
+        """补取 _iterRawMail 部分读取的邮件的其余部分
+
+        每次补取不超过 share 字节；RFC822.SIZE 超过 share 的邮件写入临时文件，返回只读 mmap。
+        """
+        head = None
+        for key, value in attrs.items():
+            if key == 'BODY[]' or key.startswith('BODY[]<'):
+                head = value
+        if head is None:
+            return None, None
+        if len(head) != prefix:
+            # 短于请求的长度说明已到结尾（长于请求的长度说明服务器忽略了部分读取）
+            return head, None
+        size = int(attrs.get('RFC822.SIZE') or share + 1)
+        spool = tempfile.TemporaryFile() if size > share else None
+        pieces = [head]
+        offset = len(head)
+        if spool is not None:
+            spool.write(head)
+            pieces = None
+        while True:
+            piece = self._fetchRawChunk([num], uid=uid, item=f'{section}<{offset}.{share}>').get(num, b'')
+            offset += len(piece)
+            if spool is not None:
+                spool.write(piece)
+            else:
+                pieces.append(piece)
+            if len(piece) < share:
+                break
+            del piece
+        if spool is None:
+            return b''.join(pieces), None
+        spool.flush()
+        return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ), spool
+
+    # 批量获取邮件信息（按 chunk_size 分组 FETCH，减少网络往返）
+    def getMailInfoBatch(self, nums, chunk_size=500, uid=False, save_dir=None, sink=None, want=None,
+                         workers=None):
+        """批量获取邮件完整信息
+
+        每 chunk_size 封邮件只发送一条 FETCH 命令（sequence-set 如 1:500），
+        按传入顺序逐封产出解析结果。
+
+        Args:
+            nums: search() 的返回值、id 列表或空格分隔的字符串
+            chunk_size: 每条 FETCH 命令包含的邮件数
+            uid: nums 是否为 UID（使用 UID FETCH）
+            save_dir: 附件保存目录（可选），见 parse_attachment
+            sink: 附件输出 callable（可选），见 parse_attachment
+            want: 需要的字段（可选），见 getMailInfo
+            workers: 进程数或 Executor（可选），指定时获取和解析并行进行，见 parseMailParallel
+
+        Yields:
+            (id, 邮件信息字典) 元组，字典格式同 getMailInfo
+
+        Raises:
+            MailFetchError: 获取失败
+        """
+        if want is not None and not _BODY_FIELDS.intersection(want):
+            for chunk in _chunks(_id_list(nums), chunk_size):
+                raws = self._fetchRawChunk(chunk, uid=uid, item='BODY.PEEK[HEADER]')
+                for num in chunk:
+                    raw = raws.pop(num, None)
+                    if raw is None:
+                        logger.warning("Email %s not returned by server, skipped", num)
+                        continue
+                    yield num, self.parseMailBytes(raw, want=want)
+            return
+        raws = self._iterRawMail(_id_list(nums), chunk_size, uid=uid)
+        if workers is not None:
+            if sink is not None:
+                raise MailError("sink cannot be used with workers, use save_dir instead")
+            for result in self.parseMailParallel(raws, workers=workers, want=want, save_dir=save_dir):
+                yield result
+            return
+        for num, raw in raws:
+            yield num, self.parseMailBytes(raw, save_dir=save_dir, sink=sink, want=want)
+
+    # 流式遍历邮箱（内存占用有上限）
+    def iterMail(self, criteria='ALL', chunk_size=100, max_inflight_bytes=64 * 1024 * 1024,
+                 save_dir=None, sink=None, want=None, workers=None):
+        """按搜索条件流式遍历邮件
+
+        FETCH 以流水线方式发出（解析当前组时服务器已在传输下一组），每封邮件解析后即释放。
+        同一时刻缓存的原始数据不超过 max_inflight_bytes：每封邮件先取开头一段
+        （与 RFC822.SIZE 在同一条 FETCH 中），其余部分解析前分段补取，
+        超过上限三分之一的邮件暂存到临时文件，以 mmap 交给解析
+        （此时需指定 save_dir 或 sink，否则解析时仍会把整封邮件读入内存）。
+
+        Args:
+            criteria: 搜索条件，字符串（如 'UNSEEN'）或条件列表（如 ['FROM', 'a@b.com']）
+            chunk_size: 每条 FETCH 命令最多包含的邮件数
+            max_inflight_bytes: 同时缓存的原始邮件字节数上限（None 表示不限制）
+            save_dir: 附件保存目录（可选），附件分块解码写盘，不保留在结果中
+            sink: 附件输出 callable（可选），见 parse_attachment
+            want: 需要的字段（可选），见 parseMailInfo
+            workers: 进程数或 Executor（可选），见 parseMailParallel；
+                此时在途的原始数据还包括进程池中等待解析的邮件
+
+        Yields:
+            (序号, 邮件信息字典) 元组，字典格式同 getMailInfo
+
+        Raises:
+            MailConnectionError: 遍历期间连接中断（已自动重连，序号可能已变化，需要重新遍历）
+            MailFetchError: 搜索或获取失败
+        """
+        if isinstance(criteria, str):
+            criteria = [criteria]
+        typ, data = self.search(None, *criteria)
+        if typ != 'OK':
+            raise MailFetchError(f"Search failed: {data}")
+        raws = self._iterRawMail(_id_list(data), chunk_size, max_inflight_bytes=max_inflight_bytes)
+        if workers is not None:
+            if sink is not None:
+                raise MailError("sink cannot be used with workers, use save_dir instead")
+            for result in self.parseMailParallel(raws, workers=workers, want=want, save_dir=save_dir):
+                yield result
+            return
+        for num, raw in raws:
+            info = self.parseMailBytes(raw, save_dir=save_dir, sink=sink, want=want)
+            del raw
+            yield num, info
+
+    # 获取延迟加载的邮件对象（只获取邮件头和 BODYSTRUCTURE）
+    def getLazyMail(self, num, uid=False):
+        """获取延迟加载的邮件对象
+
+        只发送一条 FETCH (BODY.PEEK[HEADER] BODYSTRUCTURE)，主题、发件人、收件人和
+        附件元信息立即可用；正文、HTML 和附件数据在首次访问时才按 part 获取。
+        不会将邮件标记为已读。
+
+        Args:
+            num: 邮件序号（或 UID）
+            uid: num 是否为 UID（推荐，切换文件夹或删除邮件后序号会变化）
+
+        Returns:
+            LazyMail 对象
+
+        Raises:
+            MailFetchError: 获取失败
+        """
+        for mail in self.getLazyMailBatch([num], uid=uid):
+            return mail
+        raise MailFetchError(f"Failed to fetch email {num}: not found")
+
+    # 批量获取延迟加载的邮件对象
+    def getLazyMailBatch(self, nums, chunk_size=500, uid=False):
+        """批量获取延迟加载的邮件对象（每 chunk_size 封一条 FETCH）
+
+        Args:
+            nums: search() 的返回值、id 列表或空格分隔的字符串
+            chunk_size: 每条 FETCH 命令包含的邮件数
+            uid: nums 是否为 UID
+
+        Yields:
+            LazyMail 对象，按传入顺序
+
+        Raises:
+            MailFetchError: 获取失败
+        """
+        for chunk in _chunks(_id_list(nums), chunk_size):
+            msg_set = _compress_ids(chunk)
+            try:
+                if uid:
+                    typ, data = self.mail.uid('FETCH', msg_set, '(UID BODY.PEEK[HEADER] BODYSTRUCTURE)')
+                else:
+                    typ, data = self.mail.fetch(msg_set, '(BODY.PEEK[HEADER] BODYSTRUCTURE)')
+            except MailConnectionError:
+                raise
+            except Exception as e:
+                logger.error("Error fetching headers of %s: %s", msg_set, e)
+                raise MailFetchError(f"Failed to fetch headers of {msg_set}: {e}")
+            if typ != 'OK':
+                raise MailFetchError(f"Failed to fetch headers of {msg_set}: {data}")
+
+            found = {}
+            for seq, attrs in _parse_fetch_response(data):
+                key = _imap_str(attrs.get('UID')) if uid else seq
+                if key is None or 'BODY[HEADER]' not in attrs:
+                    continue
+                found[key] = attrs
+            for num in chunk:
+                attrs = found.pop(num, None)
+                if attrs is None:
+                    logger.warning("Email %s not returned by server, skipped", num)
+                    continue
+                yield LazyMail(self, num, attrs['BODY[HEADER]'], attrs.get('BODYSTRUCTURE'), uid=uid)
+
+    # 获取邮件的若干 MIME part（BODY.PEEK[n]），返回 {section: 未解码数据}
+    def _fetchSections(self, num, sections, uid=False):
+        """用一条 FETCH 命令获取指定 part 的原始（传输编码的）数据
+
+        Args:
+            num: 邮件序号（或 UID）
+            sections: section 编号列表，如 ['1', '2.1']
+            uid: num 是否为 UID
+
+        Returns:
+            {section: bytes} 字典
+
+        Raises:
+            MailFetchError: 获取失败
+        """
+        items = ' '.join(f'BODY.PEEK[{section}]' for section in sections)
+        try:
+            if uid:
+                typ, data = self.mail.uid('FETCH', str(num), f'(UID {items})')
+            else:
+                typ, data = self.mail.fetch(str(num), f'({items})')
+        except MailConnectionError:
+            raise
+        except Exception as e:
+            logger.error("Error fetching parts of email %s: %s", num, e)
+            raise MailFetchError(f"Failed to fetch parts of email {num}: {e}")
+        if typ != 'OK':
+            raise MailFetchError(f"Failed to fetch parts of email {num}: {data}")
+
+        result = {}
+        for seq, attrs in _parse_fetch_response(data):
+            for section in sections:
+                value = attrs.get(f'BODY[{section}]')
+                if value is not None:
+                    result[section] = value
+        return result
+
+    # 等待连接上有数据可读（不消耗数据），超时返回 False
+    def _waitReadable(self, timeout):
+        sock = self.mail.sock
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            return True
+        # 先以非阻塞方式查看 imaplib 的读缓冲区，再用 select 等待 socket
+        previous = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            buffered = self.mail.file.peek(1)
+        except (BlockingIOError, ssl.SSLWantReadError):
+            buffered = None
+        finally:
+            sock.settimeout(previous)
+        if buffered:
+            return True
+        readable, _, _ = select.select([sock], [], [], max(timeout, 0))
+        return bool(readable)
+
+    # 处理 IDLE 期间的 EXISTS/EXPUNGE 响应，返回 (邮件数, 已报告的邮件数)
+    def _handleIdleLine(self, line, exists, reported):
+        m = _IDLE_EVENT_RE.match(line)
+        if m:
+            num = int(m.group(1))
+            if m.group(2).upper() == b'EXISTS':
+                return num, min(reported, num)
+            # 被删除的邮件在已报告范围内时，已报告的序号整体前移
+            return max(exists - 1, 0), reported - 1 if num <= reported else reported
+        return exists, reported
+
+    # 发送 DONE 结束 IDLE，读到带标签的完成响应为止
+    def _endIdle(self, tag, exists, reported):
+        try:
+            self.mail.send(b'DONE\r\n')
+            while True:
+                line = self.mail.readline()
+                if not line:
+                    raise MailConnectionError("Connection closed by server")
+                if line.startswith(tag):
+                    return exists, reported
+                exists, reported = self._handleIdleLine(line, exists, reported)
+        except (OSError, imaplib.IMAP4.abort) as e:
+            raise MailConnectionError(f"Connection lost while ending IDLE: {e}") from e
+
+    # IDLE 推送模式：有新邮件时产出新邮件序号，代替轮询 getUnread
+    def idle(self, timeout=None, renew_interval=25 * 60):
+        """进入 IDLE 等待新邮件（RFC 2177）
+
+        连接保持在 IDLE 状态，收到 EXISTS 时退出 IDLE 并产出新邮件序号，
+        调用方处理完（可以使用同一连接 FETCH、move、delete）后自动重新进入 IDLE；
+        调用方删除或移走的邮件会从已报告的范围中扣除，之后到达的邮件照常产出。
+        每 renew_interval 秒重新发送 IDLE，避免服务器 29 分钟超时断开。
+
+        Args:
+            timeout: 总等待秒数（None 表示一直等待）
+            renew_interval: 重新发送 IDLE 的间隔秒数（应小于 29 分钟）
+
+        Yields:
+            新邮件序号列表，如 ['11', '12']
+
+        Raises:
+            MailError: 服务器不支持 IDLE
+            MailConnectionError: 连接断开
+        """
+        if 'IDLE' not in self.mail.capabilities:
+            raise MailError("Server does not support IDLE")
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        exists = reported = self.exists
+
+        while deadline is None or time.monotonic() < deadline:
+            # IDLE 期间连接被占用，持有锁使保活线程不会插入 NOOP
+            with self._lock:
+                self._drainFetches()
+                try:
+                    tag = self.mail._new_tag()
+                    self.mail.send(tag + b' IDLE\r\n')
+                    while True:
+                        line = self.mail.readline()
+                        if not line:
+                            raise MailConnectionError("Connection closed by server")
+                        if line.startswith(b'+'):
+                            break
+                        if line.startswith(tag):
+                            raise MailFetchError(f"IDLE rejected: {line.strip()}")
+                        exists, reported = self._handleIdleLine(line, exists, reported)
+                except (OSError, imaplib.IMAP4.abort) as e:
+                    raise MailConnectionError(f"Connection lost while starting IDLE: {e}") from e
+                logger.debug("IDLE started in %s (%s emails)", self.folder, exists)
+
+                try:
+                    renew_at = time.monotonic() + renew_interval
+                    while exists <= reported:
+                        now = time.monotonic()
+                        end = renew_at if deadline is None else min(renew_at, deadline)
+                        if now >= end:
+                            break
+                        if not self._waitReadable(end - now):
+                            continue
+                        line = self.mail.readline()
+                        if not line:
+                            raise MailConnectionError("Connection closed by server")
+                        exists, reported = self._handleIdleLine(line, exists, reported)
+                except MailConnectionError:
+                    # 连接已断开，不再发送 DONE
+                    raise
+                except (OSError, imaplib.IMAP4.abort) as e:
+                    raise MailConnectionError(f"Connection lost during IDLE: {e}") from e
+                except BaseException:
+                    # 其他异常（如 KeyboardInterrupt）：先结束 IDLE，失败时保留原来的异常
+                    try:
+                        self._endIdle(tag, exists, reported)
+                    except MailConnectionError as e:
+                        logger.debug("Cannot end IDLE: %s", e)
+                    raise
+                finally:
+                    self._last_used = time.monotonic()
+                exists, reported = self._endIdle(tag, exists, reported)
+                self.exists = exists
+
+            if exists > reported:
+                new_ids = [str(n) for n in range(reported + 1, exists + 1)]
+                reported = exists
+                logger.info("%s new emails in %s", len(new_ids), self.folder)
+                expunged = self._expunged
+                yield new_ids
+                # 调用方可能用本连接移动/删除了邮件，执行的命令也可能带回了 EXPUNGE / EXISTS
+                # （都已计入 self.exists）；产出时已全部报告，删除的邮件使已报告的范围前移
+                removed = self._expunged - expunged
+                exists = self.exists
+                reported = max(min(reported - removed, exists), 0)
+
+    # IDLE 推送模式的回调版本
+    def idleLoop(self, callback, timeout=None, renew_interval=25 * 60):
+        """进入 IDLE，每当有新邮件时调用 callback(self, new_ids)
+
+        Args:
+            callback: callable(dealer, new_ids)，可在其中用本连接获取邮件
+            timeout: 总等待秒数（None 表示一直等待）
+            renew_interval: 重新发送 IDLE 的间隔秒数
+        """
+        for new_ids in self.idle(timeout=timeout, renew_interval=renew_interval):
+            callback(self, new_ids)
+
+    # 查询文件夹状态（STATUS），返回 {'UIDVALIDITY': n, 'UIDNEXT': n, ...}
+    def folderStatus(self, folder, items=('MESSAGES', 'UIDNEXT', 'UIDVALIDITY', 'UNSEEN')):
+        """查询文件夹状态（不需要先 select）
+
+        Args:
+            folder: 文件夹名称
+            items: STATUS 数据项
+
+        Returns:
+            字典，如 {'MESSAGES': 10, 'UIDNEXT': 11, 'UIDVALIDITY': 1, 'UNSEEN': 2}
+
+        Raises:
+            MailFetchError: 查询失败
+        """
+        try:
+            typ, data = self.mail.status(folder, f'({" ".join(items)})')
+        except Exception as e:
+            logger.error("Status of %s failed: %s", folder, e)
+            raise MailFetchError(f"Status of {folder} failed: {e}")
+        if typ != 'OK':
+            raise MailFetchError(f"Status of {folder} failed: {data}")
+        status = {}
+        for line in data:
+            if isinstance(line, tuple):
+                line = line[0]
+            if isinstance(line, bytes):
+                for key, value in _STATUS_ITEM_RE.findall(line):
+                    status[key.decode('ascii').upper()] = int(value)
+        return status
+
+    # 基于 UID 的增量同步：只获取上次同步之后的新邮件
+    def syncFolder(self, folder, checkpoint, chunk_size=500, on_flags=None, save_dir=None, sink=None):
+        """增量同步文件夹
+
+        checkpoint 中记录每个文件夹的 UIDVALIDITY 和已处理的最大 UID，
+        每次只获取 UID n+1:* 的新邮件；UIDVALIDITY 变化时从头同步。
+        使用 BODY.PEEK[] 获取，不会把邮件标记为已读。
+        服务器支持 CONDSTORE 时还会记录 HIGHESTMODSEQ，并通过
+        UID FETCH (FLAGS) (CHANGEDSINCE modseq) 报告已同步邮件的标记变化。
+
+        Args:
+            folder: 文件夹名称
+            checkpoint: SyncCheckpoint 对象（或实现 get/set/save 的对象）
+            chunk_size: 每条 FETCH 命令包含的邮件数，每处理完一组保存一次 checkpoint
+                （提前结束遍历时也会保存已处理的进度）
+            on_flags: 可选的 callable(uid, flags)，接收标记有变化的已同步邮件
+            save_dir: 附件保存目录（可选），见 parse_attachment
+            sink: 附件输出 callable（可选），见 parse_attachment
+
+        Yields:
+            (uid, 邮件信息字典) 元组，按 UID 升序；邮件在调用方处理完、
+            请求下一封时才计入 checkpoint
+
+        Raises:
+            MailFetchError: 查询或获取失败
+        """
+        condstore = 'CONDSTORE' in self.mail.capabilities
+        items = ('UIDVALIDITY', 'UIDNEXT', 'HIGHESTMODSEQ') if condstore else ('UIDVALIDITY', 'UIDNEXT')
+        status = self.folderStatus(folder, items)
+        uidvalidity = status.get('UIDVALIDITY')
+
+        state = checkpoint.get(folder)
+        if not state or state.get('uidvalidity') != uidvalidity:
+            if state:
+                logger.warning("UIDVALIDITY of %s changed, resyncing from scratch", folder)
+            state = {'uidvalidity': uidvalidity, 'last_uid': 0, 'highest_modseq': None}
+        last_uid = state['last_uid']
+        old_modseq = state.get('highest_modseq')
+        new_modseq = status.get('HIGHESTMODSEQ')
+
+        has_new = 'UIDNEXT' not in status or status['UIDNEXT'] - 1 > last_uid
+        flags_changed = (condstore and on_flags is not None and last_uid
+                         and old_modseq is not None and new_modseq != old_modseq)
+        if not has_new and not flags_changed:
+            logger.debug("%s is up to date (last UID %s)", folder, last_uid)
+            state['highest_modseq'] = new_modseq
+            checkpoint.set(folder, state)
+            checkpoint.save()
+            return
+
+        typ, data = self.select(folder)
+        if typ != 'OK':
+            raise MailFetchError(f"Cannot select {folder}: {data}")
+
+        if flags_changed:
+            try:
+                typ, data = self.mail.uid('FETCH', f'1:{last_uid}', f'(UID FLAGS) (CHANGEDSINCE {old_modseq})')
+            except Exception as e:
+                logger.error("Fetching changed flags of %s failed: %s", folder, e)
+                raise MailFetchError(f"Fetching changed flags of {folder} failed: {e}")
+            if typ == 'OK':
+                for seq, attrs in _parse_fetch_response(data):
+                    if attrs.get('UID') is None:
+                        continue
+                    flags = tuple(_imap_str(flag) for flag in attrs.get('FLAGS') or [])
+                    on_flags(_imap_str(attrs['UID']), flags)
+
+        if has_new:
+            try:
+                typ, data = self.mail.uid('SEARCH', 'UID', f'{last_uid + 1}:*')
+            except Exception as e:
+                logger.error("UID search in %s failed: %s", folder, e)
+                raise MailFetchError(f"UID search in {folder} failed: {e}")
+            if typ != 'OK':
+                raise MailFetchError(f"UID search in {folder} failed: {data}")
+            # UID n+1:* 在没有新邮件时也会返回最大的 UID，需要过滤
+            uids = sorted((u for u in _id_list(data) if int(u) > last_uid), key=int)
+            logger.info("Syncing %s new emails from %s", len(uids), folder)
+
+            # BODY.PEEK[] 不会把邮件标记为已读
+            pending = 0
+            try:
+                for uid, raw in self._iterRawMail(uids, chunk_size, uid=True, item='BODY.PEEK[]'):
+                    info = self.parseMailBytes(raw, save_dir=save_dir, sink=sink)
+                    del raw
+                    yield uid, info
+                    del info
+                    state['last_uid'] = int(uid)
+                    checkpoint.set(folder, state)
+                    pending += 1
+                    if pending >= chunk_size:
+                        checkpoint.save()
+                        pending = 0
+            except BaseException:
+                # 调用方提前结束遍历（break 时生成器被关闭）或获取失败：保存已处理的进度
+                if pending:
+                    checkpoint.save()
+                raise
+
+        state['highest_modseq'] = new_modseq
+        checkpoint.set(folder, state)
+        checkpoint.save()
+
+
+# ========== IMAP 连接池 ==========
+# 维护多个已登录的 ReceiveMailDealer，把 FETCH 分片到线程池中并行执行
+class ReceiveMailPool:
+
+    def __init__(self, username, password, server, size=4, folder='INBOX', **dealer_kwargs):
+        """并行建立 size 个 IMAP 连接
+
+        Args:
+            username: 用户名
+            password: 密码
+            server: IMAP 服务器
+            size: 连接数（不要超过服务器允许的单账号并发连接数）
+            folder: 默认文件夹
+            **dealer_kwargs: 传给 ReceiveMailDealer 的其他参数（如 cache）
+
+        Raises:
+            MailConnectionError: 连接失败
+            MailAuthError: 认证失败
+        """
+        self.size = size
+        self.folder = folder
+        self._executor = ThreadPoolExecutor(max_workers=size)
+        futures = [self._executor.submit(ReceiveMailDealer, username, password, server, **dealer_kwargs)
+                   for _ in range(size)]
+        self.dealers = []
+        error = None
+        for future in futures:
+            try:
+                self.dealers.append(future.result())
+            except MailError as e:
+                error = error or e
+        if error is not None:
+            self.close()
+            raise error
+
+        self._idle = queue.Queue()
+        for dealer in self.dealers:
+            self._idle.put(dealer)
+        logger.info("IMAP pool ready with %s connections", size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 关闭所有连接
+    def close(self):
+        """关闭线程池和所有IMAP连接"""
+        self._executor.shutdown(wait=True)
+        for dealer in self.dealers:
+            dealer.close()
+        self.dealers = []
+
+    # 借出一个空闲连接执行 func(dealer)，必要时先切换文件夹
+    def _run(self, folder, func):
+        dealer = self._idle.get()
+        try:
+            if folder and dealer.folder != folder:
+                typ, data = dealer.select(folder)
+                if typ != 'OK':
+                    raise MailFetchError(f"Cannot select {folder}: {data}")
+            return func(dealer)
+        finally:
+            self._idle.put(dealer)
+
+    # 按顺序执行 (folder, chunk, uid) 任务，最多 2*size 个任务同时在途
+    def _runChunks(self, tasks, save_dir=None, sink=None):
+        window = []
+        for folder, chunk, uid in tasks:
+            window.append((folder, self._executor.submit(
+                self._run, folder,
+                lambda dealer, chunk=chunk, uid=uid: list(dealer.getMailInfoBatch(
+                    chunk, chunk_size=len(chunk), uid=uid, save_dir=save_dir, sink=sink)))))
+            if len(window) >= 2 * self.size:
+                folder, future = window.pop(0)
+                for num, info in future.result():
+                    yield folder, num, info
+        for folder, future in window:
+            for num, info in future.result():
+                yield folder, num, info
+
+    # 获取单封邮件信息
+    def getMailInfo(self, num, folder=None, uid=False):
+        """获取邮件完整信息（使用任意空闲连接）
+
+        Args:
+            num: 邮件序号（或 UID）
+            folder: 文件夹（默认为连接池的 folder）
+            uid: num 是否为 UID
+
+        Returns:
+            字典，格式同 ReceiveMailDealer.getMailInfo
+        """
+        return self._run(folder or self.folder, lambda dealer: dealer.getMailInfo(num, uid=uid))
+
+    # 并行批量获取邮件信息
+    def getMailInfoBatch(self, nums, folder=None, chunk_size=200, uid=False, save_dir=None, sink=None):
+        """把邮件按 chunk_size 分片，由多个连接并行 FETCH
+
+        Args:
+            nums: search() 的返回值、id 列表或空格分隔的字符串
+            folder: 文件夹（默认为连接池的 folder）
+            chunk_size: 每个分片（每条 FETCH 命令）的邮件数
+            uid: nums 是否为 UID（推荐，序号在不同连接上一致的前提是期间没有邮件被删除）
+            save_dir: 附件保存目录（可选），见 ReceiveMailDealer.parse_attachment
+            sink: 附件输出 callable（可选，需线程安全），见 ReceiveMailDealer.parse_attachment
+
+        Yields:
+            (id, 邮件信息字典) 元组，按传入顺序
+        """
+        folder = folder or self.folder
+        tasks = ((folder, chunk, uid) for chunk in _chunks(_id_list(nums), chunk_size))
+        for _, num, info in self._runChunks(tasks, save_dir=save_dir, sink=sink):
+            yield num, info
+
+    # 并行遍历多个文件夹
+    def iterFolders(self, folders, criteria='ALL', chunk_size=200, save_dir=None, sink=None):
+        """在多个文件夹中按 UID 搜索，并把所有分片交给连接池并行获取
+
+        Args:
+            folders: 文件夹名称列表
+            criteria: 搜索条件，字符串或条件列表
+            chunk_size: 每个分片的邮件数
+            save_dir: 附件保存目录（可选）
+            sink: 附件输出 callable（可选，需线程安全）
+
+        Yields:
+            (folder, uid, 邮件信息字典) 元组，按文件夹顺序、再按 UID 顺序
+        """
+        if isinstance(criteria, str):
+            criteria = [criteria]
+
+        def search(dealer):
+            typ, data = dealer.mail.uid('SEARCH', *criteria)
+            if typ != 'OK':
+                raise MailFetchError(f"Search failed: {data}")
+            return _id_list(data)
+
+        def tasks():
+            for folder in folders:
+                uids = self._run(folder, search)
+                for chunk in _chunks(uids, chunk_size):
+                    yield folder, chunk, True
+
+        for item in self._runChunks(tasks(), save_dir=save_dir, sink=sink):
+            yield item
+
+
+# ========== 本地邮件文件 ==========
+# 离线读取 mbox 文件、Maildir 或 .eml 目录，解析方法与 ReceiveMailDealer 相同
+class LocalMailReader(MailParser):
+
+    # 构造函数（路径，格式 'mbox' / 'maildir' / 'eml'，默认自动判断，是否返回 MailInfo 而不是字典）
+    def __init__(self, path, format=None, compact=False):
+        """打开本地邮件存档
+
+        mbox 文件通过 mmap 映射，只扫描一次 "From " 分隔行记录每封邮件的偏移，
+        读取邮件时才复制对应的片段，不会把整个文件读入内存。
+
+        Args:
+            path: mbox 文件、Maildir 目录（含 cur/new）或包含 .eml 文件的目录（递归查找）
+            format: 'mbox'、'maildir' 或 'eml'，默认根据路径判断
+            compact: 为 True 时解析结果为 MailInfo（见 MailParser.compact）
+
+        Raises:
+            MailError: 路径不存在或格式无法识别
+        """
+        if not os.path.exists(path):
+            raise MailError(f"Path not found: {path}")
+        if format is None:
+            if os.path.isfile(path):
+                format = 'eml' if path.lower().endswith('.eml') else 'mbox'
+            elif os.path.isdir(os.path.join(path, 'cur')) or os.path.isdir(os.path.join(path, 'new')):
+                format = 'maildir'
+            else:
+                format = 'eml'
+        if format not in ('mbox', 'maildir', 'eml'):
+            raise MailError(f"Unknown mail archive format: {format}")
+        self.path = path
+        self.format = format
+        self.compact = compact
+        self._file = None
+        self._map = None
+        self._offsets = {}  # mbox: key -> (start, end)
+        self._paths = {}  # maildir / eml: key -> 文件路径
+        if format == 'mbox':
+            self._scanMbox()
+        elif format == 'maildir':
+            for sub in ('cur', 'new'):
+                directory = os.path.join(path, sub)
+                if os.path.isdir(directory):
+                    for name in sorted(os.listdir(directory)):
+                        if not name.startswith('.'):
+                            self._paths[f'{sub}/{name}'] = os.path.join(directory, name)
+        elif os.path.isfile(path):
+            self._paths[os.path.basename(path)] = path
+        else:
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.eml'):
+                        full_path = os.path.join(root, name)
+                        self._paths[os.path.relpath(full_path, path).replace(os.sep, '/')] = full_path
+        logger.info("Opened %s archive %s with %s emails", format, path, len(self))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets) if self.format == 'mbox' else len(self._paths)
+
+    # 关闭 mbox 映射
+    def close(self):
+        """释放 mbox 文件映射"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # 扫描 mbox 中 "From " 分隔行的位置，记录每封邮件的起止偏移
+    def _scanMbox(self):
+        self._file = open(self.path, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            return
+        self._map = mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        starts = [0] if mm[:5] == b'From ' else []
+        position = mm.find(b'\nFrom ')
+        while position != -1:
+            starts.append(position + 1)
+            position = mm.find(b'\nFrom ', position + 1)
+        size = len(mm)
+        for index, start in enumerate(starts):
+            end = starts[index + 1] if index + 1 < len(starts) else size
+            body_start = mm.find(b'\n', start, end) + 1 or end
+            # 去掉分隔邮件的空行
+            if mm[end - 4:end] == b'\r\n\r\n':
+                end -= 2
+            elif mm[end - 2:end] == b'\n\n':
+                end -= 1
+            self._offsets[str(index + 1)] = (body_start, end)
+
+    # 所有邮件的 id，格式同 ReceiveMailDealer.getAll
+    def getAll(self):
+        """获取所有邮件 id
+
+        Returns:
+            ('OK', [b'id1 id2 ...'])；mbox 的 id 为从 1 开始的序号，Maildir 为 'cur/文件名'，
+            .eml 目录为相对路径（含空格的文件名请使用 keys()）
+        """
+        return 'OK', [' '.join(self.keys()).encode('utf-8')]
+
+    # 所有邮件的 id 列表
+    def keys(self):
+        """返回所有邮件 id 的列表（按文件中的顺序或文件名排序）"""
+        return list(self._offsets if self.format == 'mbox' else self._paths)
+
+    # 读取一封邮件的原始数据
+    def getRaw(self, num):
+        """返回邮件的原始 RFC822 数据
+
+        Raises:
+            MailFetchError: 邮件不存在或读取失败
+        """
+        num = num.decode('utf-8') if isinstance(num, bytes) else str(num)
+        if self.format == 'mbox':
+            if num not in self._offsets:
+                raise MailFetchError(f"Email {num} not found in {self.path}")
+            start, end = self._offsets[num]
+            return self._map[start:end]
+        if num not in self._paths:
+            raise MailFetchError(f"Email {num} not found in {self.path}")
+        try:
+            with open(self._paths[num], 'rb') as f:
+                return f.read()
+        except OSError as e:
+            raise MailFetchError(f"Failed to read email {num}: {e}")
+
+    # 按顺序产出原始邮件
+    def iterRaw(self, nums=None):
+        """逐封产出 (id, bytes)，nums 默认为全部邮件"""
+        for num in (self.keys() if nums is None else _id_list(nums)):
+            yield num, self.getRaw(num)
+
+    # 以RFC822协议格式返回邮件详情的email对象
+    def getEmailFormat(self, num):
+        """获取邮件的email对象"""
+        return email.message_from_bytes(self.getRaw(num))
+
+    # 获取邮件完整信息，返回字典格式同 ReceiveMailDealer.getMailInfo
+    def getMailInfo(self, num, save_dir=None, sink=None, want=None):
+        """获取邮件完整信息，参数见 parseMailInfo"""
+        return self.parseMailBytes(self.getRaw(num), save_dir=save_dir, sink=sink, want=want)
+
+    # 批量解析邮件
+    def getMailInfoBatch(self, nums=None, save_dir=None, sink=None, want=None, workers=None):
+        """逐封解析邮件
+
+        Args:
+            nums: getAll() 的返回值或 id 列表，默认全部
+            save_dir: 附件保存目录（可选），见 parse_attachment
+            sink: 附件输出 callable（可选），见 parse_attachment
+            want: 需要的字段（可选），见 parseMailInfo
+            workers: 进程数或 Executor（可选），见 parseMailParallel
+
+        Yields:
+            (id, 邮件信息字典) 元组，按顺序
+        """
+        raws = self.iterRaw(nums)
+        if workers is not None:
+            if sink is not None:
+                raise MailError("sink cannot be used with workers, use save_dir instead")
+            for result in self.parseMailParallel(raws, workers=workers, want=want, save_dir=save_dir):
+                yield result
+            return
+        for num, raw in raws:
+            yield num, self.parseMailBytes(raw, save_dir=save_dir, sink=sink, want=want)
+
+
+# ========== 异步接收邮件（asyncio）==========
+_UNTAGGED_RE = re.compile(rb'^\* (?:(\d+) )?([A-Za-z-]+)(?: (.*))?$', re.S)
+_TAGGED_RE = re.compile(rb'^(\S+) (OK|NO|BAD)(?: (.*))?$', re.S | re.I)
+_LITERAL_LINE_RE = re.compile(rb'\{(\d+)\}\r\n$')
+_UIDVALIDITY_RE = re.compile(rb'\[UIDVALIDITY (\d+)\]', re.I)
+
+
+# 单个 IMAP 连接：后台任务读取响应，支持多条命令同时在途（pipelining）
+class _AsyncIMAPConnection:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.capabilities = ()
+        self._tag = 0
+        self._pending = OrderedDict()  # tag -> [future, {类型: 数据列表}]
+        self._read_task = asyncio.ensure_future(self._readLoop())
+
+    # 建立连接并读取服务器问候
+    @classmethod
+    async def open(cls, host, port=993, use_ssl=True):
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=ssl.create_default_context() if use_ssl else None)
+        greeting = await reader.readline()
+        if not greeting.startswith(b'* OK') and not greeting.startswith(b'* PREAUTH'):
+            writer.close()
+            raise MailConnectionError(f"Unexpected greeting: {greeting!r}")
+        conn = cls(reader, writer)
+        typ, untagged, text = await conn.command('CAPABILITY')
+        caps = b' '.join(untagged.get('CAPABILITY', [])).decode('ascii', 'replace').upper().split()
+        conn.capabilities = tuple(caps)
+        return conn
+
+    # 读取一条完整响应（含 literal），返回 imaplib 风格的列表
+    async def _readResponse(self):
+        items = []
+        line = await self.reader.readline()
+        if not line:
+            raise MailConnectionError("Connection closed by server")
+        while True:
+            m = _LITERAL_LINE_RE.search(line)
+            if not m:
+                items.append(line.rstrip(b'\r\n'))
+                return items
+            literal = await self.reader.readexactly(int(m.group(1)))
+            items.append((line[:m.start()] + b'{' + m.group(1) + b'}', literal))
+            line = await self.reader.readline()
+
+    # 后台读取响应：无标签响应归入最早的在途命令，带标签响应完成对应命令
+    async def _readLoop(self):
+        try:
+            while True:
+                items = await self._readResponse()
+                first = items[0][0] if isinstance(items[0], tuple) else items[0]
+                if first.startswith(b'+'):
+                    continue
+                m = _UNTAGGED_RE.match(first)
+                if m:
+                    num, typ, rest = m.groups()
+                    if num is not None:
+                        data = num + (b' ' + rest if rest else b'')
+                    else:
+                        data = rest or b''
+                    if isinstance(items[0], tuple):
+                        items[0] = (data, items[0][1])
+                    else:
+                        items[0] = data
+                    if self._pending:
+                        untagged = next(iter(self._pending.values()))[1]
+                        untagged.setdefault(typ.decode('ascii').upper(), []).extend(items)
+                    continue
+                m = _TAGGED_RE.match(first)
+                if m and m.group(1) in self._pending:
+                    future, untagged = self._pending.pop(m.group(1))
+                    if not future.done():
+                        future.set_result((m.group(2).decode('ascii').upper(), untagged, m.group(3) or b''))
+        except Exception as e:
+            error = e if isinstance(e, MailError) else MailConnectionError(f"IMAP connection lost: {e}")
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    # 发送一条命令并等待完成，返回 (状态, {类型: 数据列表}, 状态文本)
+    async def command(self, name, *args):
+        """发送命令；多个协程可同时调用，命令会在同一连接上流水线发送"""
+        if self._read_task.done():
+            raise MailConnectionError("IMAP connection is closed")
+        self._tag += 1
+        tag = f'A{self._tag:05d}'.encode('ascii')
+        try:
+            line = b' '.join([tag, name.encode('ascii')] +
+                             [arg if isinstance(arg, bytes) else str(arg).encode('ascii') for arg in args])
+        except UnicodeEncodeError as e:
+            raise MailFetchError(f"Non-ASCII argument in {name}: {e}")
+        future = asyncio.get_event_loop().create_future()
+        self._pending[tag] = [future, {}]
+        self.writer.write(line + b'\r\n')
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self._read_task.cancel()
+        self.writer.close()
+
+
+# asyncio 版本的 ReceiveMailDealer：一个连接上流水线发送命令，多个邮箱可在同一事件循环中并发
+class AsyncReceiveMailDealer(MailParser):
+
+    # 构造函数（用户名，密码，imap服务器，端口，是否使用SSL，是否返回 MailInfo 而不是字典）；
+    # 需要 await open() 或 async with
+    def __init__(self, username, password, server, port=993, use_ssl=True, compact=False):
+        self.compact = compact
+        self.username = username
+        self.password = password
+        self.server = server
+        self.port = port
+        self.use_ssl = use_ssl
+        self.conn = None
+        self.folder = None
+        self.uidvalidity = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    # 建立连接、登录并选择收件箱
+    async def open(self):
+        """连接并登录
+
+        Raises:
+            MailConnectionError: 连接失败
+            MailAuthError: 认证失败
+        """
+        try:
+            self.conn = await _AsyncIMAPConnection.open(self.server, self.port, self.use_ssl)
+            logger.info("Connected to IMAP server: %s", self.server)
+        except MailError:
+            raise
+        except Exception as e:
+            logger.error("Failed to connect to IMAP server %s: %s", self.server, e)
+            raise MailConnectionError(f"Cannot connect to {self.server}: {e}")
+
+        typ, _, text = await self.conn.command('LOGIN', _imap_quote(self.username), _imap_quote(self.password))
+        if typ != 'OK':
+            logger.error("Authentication failed for %s: %s", self.username, text)
+            await self.conn.close()
+            raise MailAuthError(f"Login failed: {text}")
+        logger.info("Logged in as: %s", self.username)
+        await self.select('INBOX')
+        return self
+
+    # 登出并关闭连接
+    async def close(self):
+        """登出并关闭IMAP连接"""
+        if self.conn is None:
+            return
+        try:
+            await self.conn.command('LOGOUT')
+        except Exception as e:
+            logger.warning("Error closing IMAP connection: %s", e)
+        await self.conn.close()
+        self.conn = None
+
+    # 选择文件夹
+    async def select(self, selector):
+        """选择文件夹，返回 (status, [邮件数])"""
+        typ, untagged, text = await self.conn.command('SELECT', selector)
+        if typ == 'OK':
+            self.folder = selector
+            self.uidvalidity = None
+            for line in untagged.get('OK', []):
+                m = _UIDVALIDITY_RE.search(line if isinstance(line, bytes) else line[0])
+                if m:
+                    self.uidvalidity = int(m.group(1))
+            return typ, untagged.get('EXISTS', [b'0'])[-1:]
+        return typ, [text]
+
+    # 搜索邮件，返回值格式同 ReceiveMailDealer.search
+    async def search(self, charset, *criteria):
+        """搜索邮件
+
+        Returns:
+            (status, [b'1 2 3'])
+
+        Raises:
+            MailFetchError: 搜索失败
+        """
+        args = (['CHARSET', charset] if charset else []) + list(criteria)
+        typ, untagged, text = await self.conn.command('SEARCH', *args)
+        if typ != 'OK':
+            logger.error("Search failed: %s", text)
+            raise MailFetchError(f"Search failed: {text}")
+        return typ, [b' '.join(item for item in untagged.get('SEARCH', []) if item)]
+
+    # 返回所有未读的邮件列表
+    async def getUnread(self):
+        """获取未读邮件列表"""
+        return await self.search(None, 'UNSEEN')
+
+    # 获取所有邮件列表
+    async def getAll(self):
+        """获取所有邮件列表"""
+        return await self.search(None, 'ALL')
+
+    # 一条 FETCH 获取一组邮件的原始数据，返回 {id: bytes}
+    async def _fetchRawChunk(self, ids, uid=False):
+        msg_set = _compress_ids(ids)
+        if uid:
+            typ, untagged, text = await self.conn.command('UID', 'FETCH', msg_set, '(UID RFC822)')
+        else:
+            typ, untagged, text = await self.conn.command('FETCH', msg_set, '(RFC822)')
+        if typ != 'OK':
+            logger.error("Error fetching emails %s: %s", msg_set, text)
+            raise MailFetchError(f"Failed to fetch emails {msg_set}: {text}")
+        result = {}
+        for seq, attrs in _parse_fetch_response(untagged.get('FETCH', [])):
+            raw = attrs.get('RFC822')
+            key = _imap_str(attrs.get('UID')) if uid else seq
+            if raw is not None and key is not None:
+                result[key] = raw
+        return result
+
+    # 以RFC822协议格式返回邮件详情的email对象
+    async def getEmailFormat(self, num, uid=False):
+        """获取邮件的email对象
+
+        Raises:
+            MailFetchError: 获取邮件失败
+        """
+        ids = _id_list([num])
+        raw = (await self._fetchRawChunk(ids, uid=uid)).get(ids[0])
+        if raw is None:
+            raise MailFetchError(f"Failed to fetch email {num}: not found")
+        return email.message_from_bytes(raw)
+
+    # 获取邮件完整信息
+    async def getMailInfo(self, num, save_dir=None, sink=None, uid=False):
+        """获取邮件完整信息，返回字典格式同 ReceiveMailDealer.getMailInfo"""
+        ids = _id_list([num])
+        raw = (await self._fetchRawChunk(ids, uid=uid)).get(ids[0])
+        if raw is None:
+            raise MailFetchError(f"Failed to fetch email {num}: not found")
+        return self.parseMailBytes(raw, save_dir=save_dir, sink=sink)
+
+    # 批量获取邮件信息：多条 FETCH 同时在途（流水线），按顺序产出
+    async def getMailInfoBatch(self, nums, chunk_size=100, uid=False, pipeline_depth=4,
+                               save_dir=None, sink=None):
+        """批量获取邮件完整信息（异步生成器）
+
+        每 chunk_size 封邮件一条 FETCH，最多 pipeline_depth 条 FETCH 同时在途，
+        不必等待上一条完成再发送下一条。
+
+        Args:
+            nums: search() 的返回值、id 列表或空格分隔的字符串
+            chunk_size: 每条 FETCH 命令包含的邮件数
+            uid: nums 是否为 UID
+            pipeline_depth: 同时在途的 FETCH 命令数
+            save_dir: 附件保存目录（可选），见 parse_attachment
+            sink: 附件输出 callable（可选），见 parse_attachment
+
+        Yields:
+            (id, 邮件信息字典) 元组，按传入顺序
+        """
+        chunks = list(_chunks(_id_list(nums), chunk_size))
+        inflight = []
+        position = 0
+        try:
+            while position < len(chunks) or inflight:
+                while position < len(chunks) and len(inflight) < pipeline_depth:
+                    chunk = chunks[position]
+                    inflight.append((chunk, asyncio.ensure_future(self._fetchRawChunk(chunk, uid=uid))))
+                    position += 1
+                chunk, task = inflight.pop(0)
+                raws = await task
+                for num in chunk:
+                    raw = raws.pop(num, None)
+                    if raw is None:
+                        logger.warning("Email %s not returned by server, skipped", num)
+                        continue
+                    yield num, self.parseMailBytes(raw, save_dir=save_dir, sink=sink)
+        finally:
+            for _, task in inflight:
+                task.cancel()
+
+
+# ========== 邮件缓存 ==========
+# 邮件原始数据缓存：内存 LRU（按字节数淘汰）+ 可选的磁盘存储，键为 文件夹+UIDVALIDITY+UID
+class MailCache:
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None):
+        """创建缓存
+
+        Args:
+            max_bytes: 内存缓存的字节数上限，超过时淘汰最久未使用的邮件（0 表示不使用内存缓存）
+            directory: 磁盘缓存目录（可选），邮件保存为 <目录>/<文件夹>/<UIDVALIDITY>/<UID>.eml
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, folder, uidvalidity, uid):
+        return os.path.join(self.directory, quote(str(folder), safe=''), str(uidvalidity), f'{uid}.eml')
+
+    def _remember(self, key, raw):
+        if len(raw) > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self.current_bytes -= len(old)
+        self._memory[key] = raw
+        self.current_bytes += len(raw)
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self.current_bytes -= len(evicted)
+
+    # 查找邮件，未命中返回 None
+    def get(self, folder, uidvalidity, uid):
+        """查找缓存的邮件原始数据
+
+        Returns:
+            bytes 或 None
+        """
+        key = (folder, uidvalidity, str(uid))
+        with self._lock:
+            raw = self._memory.get(key)
+            if raw is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return raw
+        if self.directory:
+            try:
+                with open(self._path(*key), 'rb') as f:
+                    raw = f.read()
+            except OSError:
+                raw = None
+            if raw is not None:
+                with self._lock:
+                    self._remember(key, raw)
+                    self.hits += 1
+                return raw
+        with self._lock:
+            self.misses += 1
+        return None
+
+    # 保存邮件
+    def put(self, folder, uidvalidity, uid, raw):
+        """保存邮件原始数据到内存（和磁盘）"""
+        key = (folder, uidvalidity, str(uid))
+        with self._lock:
+            self._remember(key, raw)
+        if self.directory:
+            path = self._path(*key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, path)
+
+    # 清空内存缓存（磁盘缓存保留）
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.current_bytes = 0
+
+
+# ========== 增量同步状态 ==========
+# 增量同步的 checkpoint，以 JSON 文件保存每个文件夹的 UIDVALIDITY / 最大 UID / HIGHESTMODSEQ
+class SyncCheckpoint:
+
+    def __init__(self, path):
+        """加载（或新建）checkpoint 文件
+
+        Args:
+            path: JSON 文件路径，不存在时在首次 save() 时创建
+        """
+        self.path = path
+        self.folders = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.folders = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Cannot read checkpoint %s, starting fresh: %s", path, e)
+
+    # 获取文件夹的同步状态 {uidvalidity, last_uid, highest_modseq}，没有则返回 None
+    def get(self, folder):
+        state = self.folders.get(folder)
+        return dict(state) if state else None
+
+    # 更新文件夹的同步状态（调用 save() 后写入文件）
+    def set(self, folder, state):
+        self.folders[folder] = dict(state)
+
+    # 原子写入 checkpoint 文件
+    def save(self):
+        """写入临时文件后替换，避免进程中断时损坏 checkpoint"""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.folders, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+# ========== 本地全文索引 ==========
+_INDEX_COLUMNS = ('subject', 'sender', 'receiver', 'body', 'attachments')
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+
+# 邮件地址元组 (name, address) 转为 "name <address>"
+def _format_address(pair):
+    if not pair:
+        return ''
+    name, address = pair
+    return f'{name} <{address}>' if name else address or ''
+
+
+# 基于 SQLite FTS5 的本地全文索引，同时实现 checkpoint 接口（get/set/save），可直接交给 syncFolder
+class MailIndex:
+
+    def __init__(self, path, tokenizer=None):
+        """打开（或新建）索引数据库
+
+        Args:
+            path: SQLite 数据库文件路径（':memory:' 为内存索引）
+            tokenizer: FTS5 分词器，默认 SQLite 3.34+ 使用 trigram（支持中文等任意子串），
+                否则使用 unicode61
+
+        Raises:
+            MailError: SQLite 未编译 FTS5
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        if tokenizer is None:
+            tokenizer = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61'
+        try:
+            with self.db:
+                self.db.execute('''CREATE TABLE IF NOT EXISTS mails (
+                    id INTEGER PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    uidvalidity INTEGER,
+                    uid INTEGER NOT NULL,
+                    subject TEXT,
+                    sender TEXT,
+                    receiver TEXT,
+                    attachments TEXT,
+                    UNIQUE (folder, uid))''')
+                self.db.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS mails_fts USING fts5('
+                                f'{", ".join(_INDEX_COLUMNS)}, tokenize="{tokenizer}")')
+                self.db.execute('CREATE TABLE IF NOT EXISTS sync_state (folder TEXT PRIMARY KEY, state TEXT NOT NULL)')
+        except sqlite3.OperationalError as e:
+            self.db.close()
+            raise MailError(f"Cannot create full-text index (SQLite FTS5 required): {e}")
+        row = self.db.execute("SELECT sql FROM sqlite_master WHERE name = 'mails_fts'").fetchone()
+        self.tokenizer = 'trigram' if row and 'trigram' in row[0] else 'unicode61'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """提交并关闭数据库"""
+        self.db.commit()
+        self.db.close()
+
+    # 添加或替换一封邮件（调用 save() 后提交）
+    def add(self, folder, uid, info, uidvalidity=None):
+        """把 getMailInfo / syncFolder 返回的邮件信息写入索引
+
+        Args:
+            folder: 文件夹名称
+            uid: 邮件 UID
+            info: MailInfo（或同样键的字典）{subject, body, html, from, to, attachments}
+            uidvalidity: 文件夹的 UIDVALIDITY
+        """
+        body = info.get('body')
+        if not body and info.get('html'):
+            body = _HTML_TAG_RE.sub(' ', info['html'])
+        names = [attachment.get('name') or '' for attachment in info.get('attachments') or []]
+        row = (info.get('subject') or '', _format_address(info.get('from')),
+               _format_address(info.get('to')), body or '', ' '.join(names))
+        with self._lock:
+            self._delete(folder, [int(uid)])
+            cursor = self.db.execute(
+                'INSERT INTO mails (folder, uidvalidity, uid, subject, sender, receiver, attachments) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (folder, uidvalidity, int(uid), row[0], row[1], row[2], json.dumps(names, ensure_ascii=False)))
+            self.db.execute(f'INSERT INTO mails_fts (rowid, {", ".join(_INDEX_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)',
+                            (cursor.lastrowid,) + row)
+
+    def _delete(self, folder, uids=None, keep_uidvalidity=None):
+        sql, params = 'SELECT id FROM mails WHERE folder = ?', [folder]
+        if uids is not None:
+            sql += f' AND uid IN ({", ".join("?" * len(uids))})'
+            params.extend(uids)
+        if keep_uidvalidity is not None:
+            sql += ' AND uidvalidity IS NOT ?'
+            params.append(keep_uidvalidity)
+        ids = [(row[0],) for row in self.db.execute(sql, params).fetchall()]
+        self.db.executemany('DELETE FROM mails_fts WHERE rowid = ?', ids)
+        self.db.executemany('DELETE FROM mails WHERE id = ?', ids)
+        return len(ids)
+
+    # 删除邮件（默认删除整个文件夹）
+    def remove(self, folder, uids=None):
+        """从索引中删除文件夹中的邮件，返回删除的数量"""
+        with self._lock, self.db:
+            return self._delete(folder, None if uids is None else [int(uid) for uid in _id_list(uids)])
+
+    # checkpoint 接口：文件夹的同步状态
+    def get(self, folder):
+        with self._lock:
+            row = self.db.execute('SELECT state FROM sync_state WHERE folder = ?', (folder,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # checkpoint 接口：UIDVALIDITY 变化时同时清除旧的索引
+    def set(self, folder, state):
+        uidvalidity = state.get('uidvalidity')
+        with self._lock:
+            # syncFolder 每处理一封邮件调用一次，只在 UIDVALIDITY 与已保存的不同（或首次保存）时清理
+            row = self.db.execute('SELECT state FROM sync_state WHERE folder = ?', (folder,)).fetchone()
+            if row is None or json.loads(row[0]).get('uidvalidity') != uidvalidity:
+                removed = self._delete(folder, keep_uidvalidity=uidvalidity)
+                if removed:
+                    logger.info("Removed %s stale index entries of %s", removed, folder)
+            self.db.execute('INSERT OR REPLACE INTO sync_state (folder, state) VALUES (?, ?)',
+                            (folder, json.dumps(state)))
+
+    # checkpoint 接口：提交事务，索引和同步状态一起落盘
+    def save(self):
+        with self._lock:
+            self.db.commit()
+
+    # 增量更新：只获取上次同步之后的新邮件
+    def update(self, dealer, folder, chunk_size=500):
+        """通过 dealer.syncFolder 把文件夹的新邮件加入索引
+
+        Args:
+            dealer: ReceiveMailDealer 对象
+            folder: 文件夹名称
+            chunk_size: 每条 FETCH 命令包含的邮件数，每组提交一次
+
+        Returns:
+            新加入索引的邮件数
+        """
+        count = 0
+        for uid, info in dealer.syncFolder(folder, self, chunk_size=chunk_size):
+            self.add(folder, uid, info, uidvalidity=dealer.uidvalidity)
+            count += 1
+        logger.info("Indexed %s new emails from %s", count, folder)
+        return count
+
+    # 全文搜索
+    def search(self, text=None, folder=None, fields=None, limit=50, match=None):
+        """在本地索引中搜索
+
+        Args:
+            text: 要查找的文本（子串匹配；trigram 分词器下少于 3 个字符时逐行扫描）
+            folder: 只搜索该文件夹（可选）
+            fields: 搜索的字段，默认 ('subject', 'sender', 'receiver', 'body', 'attachments')
+            limit: 最多返回的结果数
+            match: 直接使用 FTS5 查询语法（如 'subject:发票 AND body:付款'），代替 text
+
+        Returns:
+            结果列表 [{folder, uid, uidvalidity, subject, sender, receiver, attachments}]，
+            使用 FTS5 匹配时按相关度排序，否则按加入索引的顺序倒序
+
+        Raises:
+            MailError: 字段名或查询语法无效
+        """
+        fields = tuple(fields or _INDEX_COLUMNS)
+        unknown = [field for field in fields if field not in _INDEX_COLUMNS]
+        if unknown:
+            raise MailError(f"Unknown index fields: {unknown}")
+        where, params = [], []
+        if match is None and text is not None and self.tokenizer == 'trigram' and len(text) < 3:
+            escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append('(' + ' OR '.join(f"mails_fts.{field} LIKE ? ESCAPE '\\'" for field in fields) + ')')
+            params.extend([f'%{escaped}%'] * len(fields))
+            order = 'm.id DESC'
+        elif match is not None or text is not None:
+            if match is None:
+                match = '{%s} : "%s"' % (' '.join(fields), text.replace('"', '""'))
+            where.append('mails_fts MATCH ?')
+            params.append(match)
+            order = 'rank'
+        else:
+            order = 'm.id DESC'
+        if folder is not None:
+            where.append('m.folder = ?')
+            params.append(folder)
+        sql = ('SELECT m.folder, m.uid, m.uidvalidity, m.subject, m.sender, m.receiver, m.attachments '
+               'FROM mails_fts JOIN mails m ON m.id = mails_fts.rowid'
+               + (' WHERE ' + ' AND '.join(where) if where else '') + f' ORDER BY {order} LIMIT ?')
+        params.append(limit)
+        try:
+            with self._lock:
+                rows = self.db.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            raise MailError(f"Invalid index query: {e}")
+        return [{'folder': row[0], 'uid': str(row[1]), 'uidvalidity': row[2], 'subject': row[3],
+                 'sender': row[4], 'receiver': row[5], 'attachments': json.loads(row[6] or '[]')}
+                for row in rows]
+
+    # 索引中的邮件数
+    def count(self, folder=None):
+        """返回索引中的邮件数（可只统计一个文件夹）"""
+        with self._lock:
+            if folder is None:
+                return self.db.execute('SELECT COUNT(*) FROM mails').fetchone()[0]
+            return self.db.execute('SELECT COUNT(*) FROM mails WHERE folder = ?', (folder,)).fetchone()[0]
+
+
+# ========== 延迟加载邮件 ==========
+# 延迟加载的附件：元信息来自 BODYSTRUCTURE，data 在首次访问时获取
+class LazyAttachment:
+
+    def __init__(self, mail, section, content_type, size, name, encoding):
+        self.mail = mail
+        self.section = section
+        self.content_type = content_type
+        self.size = size  # BODYSTRUCTURE 给出的传输编码后大小
+        self.name = name
+        self.encoding = encoding
+        self._data = None
+
+    # 附件数据（首次访问时 FETCH BODY.PEEK[section]）
+    @property
+    def data(self):
+        """解码后的附件数据（bytes）"""
+        if self._data is None:
+            raw = self.mail._fetchSections([self.section])[self.section]
+            self._data = _decode_transfer(raw, self.encoding)
+        return self._data
+
+    def __repr__(self):
+        return f'<LazyAttachment {self.name!r} {self.content_type} section={self.section}>'
+
+
+# 延迟加载的邮件：只获取邮件头和 BODYSTRUCTURE，正文和附件按需获取
+class LazyMail:
+
+    def __init__(self, dealer, num, header, bodystructure, uid=False):
+        """由 ReceiveMailDealer.getLazyMail / getLazyMailBatch 创建
+
+        Args:
+            dealer: ReceiveMailDealer 对象
+            num: 邮件序号（或 UID）
+            header: BODY[HEADER] 原始数据
+            bodystructure: 解析后的 BODYSTRUCTURE 列表
+            uid: num 是否为 UID
+        """
+        self.dealer = dealer
+        self.num = num
+        self.uid = uid
+        self.header = email.message_from_bytes(header)
+        self.parts = list(_walk_bodystructure(bodystructure))
+        self._texts = {}
+
+        self.attachments = []
+        for part in self.parts:
+            if part['disposition'] != 'attachment' or not part['size']:
+                continue
+            filename = part['disposition_params'].get('filename') or part['params'].get('name')
+            if filename:
+                filename = _clean_filename(filename, f'attachment_{num}_{part["section"]}')
+            else:
+                filename = f'attachment_{num}_{part["section"]}.{part["content_type"].split("/")[1]}'
+            self.attachments.append(LazyAttachment(
+                self, part['section'], part['content_type'], part['size'], filename, part['encoding']))
+
+    # 主题
+    @property
+    def subject(self):
+        return self.dealer.getSubjectContent(self.header)
+
+    # 发件人元组（邮件称呼，邮件地址）
+    @property
+    def sender(self):
+        return self.dealer.getSenderInfo(self.header)
+
+    # 收件人元组（邮件称呼，邮件地址）
+    @property
+    def receiver(self):
+        return self.dealer.getReceiverInfo(self.header)
+
+    # 纯文本正文（首次访问时获取对应 part），无则为 None
+    @property
+    def body(self):
+        return self._getText('text/plain')
+
+    # HTML 正文（首次访问时获取对应 part），无则为 None
+    @property
+    def html(self):
+        return self._getText('text/html')
+
+    def _fetchSections(self, sections):
+        return self.dealer._fetchSections(self.num, sections, uid=self.uid)
+
+    def _getText(self, content_type):
+        if content_type in self._texts:
+            return self._texts[content_type]
+        parts = [part for part in self.parts
+                 if part['content_type'] == content_type and part['disposition'] != 'attachment']
+        if not parts:
+            self._texts[content_type] = None
+            return None
+        raws = self._fetchSections([part['section'] for part in parts])
+        text = []
+        for part in parts:
+            payload = _decode_transfer(raws.get(part['section'], b''), part['encoding'])
+            charset = part['params'].get('charset') or 'utf-8'
+            try:
+                text.append(payload.decode(charset, errors='replace'))
+            except LookupError as e:
+                logger.warning("Failed to decode %s with %s, using utf-8: %s", content_type, charset, e)
+                text.append(payload.decode('utf-8', errors='replace'))
+        self._texts[content_type] = ''.join(text)
+        return self._texts[content_type]
+
+    # 转为与 getMailInfo 相同格式的邮件信息（会获取正文和全部附件）
+    def toMailInfo(self):
+        """获取全部内容并返回 getMailInfo 格式的字典（dealer 为 compact 模式时返回 MailInfo）"""
+        info = MailInfo(
+            subject=self.subject,
+            body=self.body,
+            html=self.html,
+            attachments=[Attachment(a.content_type, len(a.data), a.name, a.data) for a in self.attachments],
+            sender=self.sender,
+            receiver=self.receiver,
+        )
+        return info if getattr(self.dealer, 'compact', False) else info.toDict()
+
+    def __repr__(self):
+        return f'<LazyMail {self.num} {self.subject!r}>'
+
+
+# ========== 发送邮件部分(smtp) ==========
+# 收件人参数统一为列表：None、逗号分隔的字符串或字符串列表
+def _address_list(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return [address for address in value if address]
+
+
+# 从邮件头形式的收件人中解析出信封地址（去掉显示名，去重并保持顺序）
+def _envelope_addresses(*values):
+    headers = [address for value in values for address in _address_list(value)]
+    addresses = []
+    for _, address in email_utils.getaddresses(headers):
+        if address and address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+# 确定信封收件人并序列化邮件：未指定 to_addrs 时取 To、Cc、Bcc，Bcc 头不随邮件发出
+def _prepare_message(msg, to_addrs=None):
+    if to_addrs is None and isinstance(msg, Message):
+        to_addrs = _envelope_addresses(msg['To'], msg['Cc'], msg['Bcc'])
+        if msg['Bcc'] is not None:
+            msg = copy.copy(msg)
+            del msg['Bcc']
+    else:
+        to_addrs = _envelope_addresses(to_addrs)
+    data = msg.as_string() if isinstance(msg, Message) else msg
+    return to_addrs, data
+
+
+# 邮件组装方法（不依赖网络连接），由 SendMailDealer 和 AsyncSendMailDealer 继承
+class MailComposer:
+
+    # 重新初始化邮件信息部分 (修复 Issue #9)
+    def reinitMailInfo(self):
+        """重新初始化邮件内容"""
+        self.msg = MIMEMultipart()
+        self.bcc = []
+
+    # 设置邮件的基本信息（收件人，主题，正文，正文类型html或者plain，可变参数附件路径列表，抄送，密送）
+    def setMailInfo(self, receiveUser, subject, text, text_type, *attachmentFilePaths, cc=None, bcc=None):
+        """设置邮件基本信息
+        
+        Args:
+            receiveUser: 收件人邮箱，可以是逗号分隔的字符串或列表
+            subject: 邮件主题
+            text: 邮件正文
+            text_type: 正文类型 ('plain' 或 'html')
+            *attachmentFilePaths: 附件文件路径列表
+            cc: 抄送，格式同 receiveUser
+            bcc: 密送，格式同 receiveUser（只出现在信封中，不写入邮件头）
+        """
+        self.msg['From'] = self.mailUser
+        self.msg['To'] = ', '.join(_address_list(receiveUser))
+        if cc:
+            self.msg['Cc'] = ', '.join(_address_list(cc))
+        self.bcc = _address_list(bcc)
+        self.msg['Subject'] = subject
+        self.msg.attach(MIMEText(text, text_type, 'utf-8'))
+        
+        for attachmentFilePath in attachmentFilePaths:
+            self.msg.attach(self.getAttachmentFromFile(attachmentFilePath))
+
+    # 自定义邮件正文信息（正文内容，正文格式html或者plain）
+    def addTextPart(self, text, text_type):
+        """添加邮件正文部分
+        
+        Args:
+            text: 正文内容
+            text_type: 格式 ('plain' 或 'html')
+        """
+        self.msg.attach(MIMEText(text, text_type, 'utf-8'))
+        
+
+    # 增加附件（以流形式添加，可以添加网络获取等流格式）参数（文件名，文件流）
+    def addAttachment(self, filename, filedata):
+        """添加附件（流形式）
+        
+        Args:
+            filename: 文件名
+            filedata: 文件数据（bytes）
+        """
+        part = MIMEBase('application', "octet-stream")
+        part.set_payload(filedata)
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', 'attachment; filename="%s"' % str(Header(filename, 'utf-8')))
+        self.msg.attach(part)
+
+    # 通用方法添加邮件信息（MIMETEXT，MIMEIMAGE,MIMEBASE...）
+    def addPart(self, part):
+        """添加自定义邮件部分
+        
+        Args:
+            part: MIME part 对象
+        """
+        self.msg.attach(part)
+
+    # 邮件合并：按模板为每个收件人生成邮件，共享附件只编码一次
+    def buildMergeMessages(self, recipients, subject, text, text_type, *attachmentFilePaths):
+        """按模板生成个性化邮件
+
+        主题和正文使用 string.Template 占位符（如 $name、${company}），缺少的占位符原样保留。
+        邮件头中不变的部分和附件只生成、序列化一次；每封邮件只编码 To、Subject 两个邮件头
+        和正文部分，与预先序列化好的前后两段直接拼接。
+
+        Args:
+            recipients: 可迭代对象，元素为收件人地址字符串，或包含 'to' 键和占位符取值的字典
+            subject: 主题模板
+            text: 正文模板
+            text_type: 正文类型 ('plain' 或 'html')
+            *attachmentFilePaths: 所有收件人共享的附件路径
+
+        Yields:
+            (收件人, 邮件字符串) 元组，可直接交给 sendMessage 或 SendMailPool.sendBulk
+        """
+        boundary = f'==============={uuid.uuid4().hex}=='
+        outer = MIMEMultipart(boundary=boundary)
+        outer['From'] = self.mailUser
+        # 与 as_string() 相同：邮件头不折行
+        policy = outer.policy.clone(max_line_length=0)
+        shared_head = ''.join(policy.fold(name, value) for name, value in outer.raw_items())
+        shared_tail = ''.join(f'\n--{boundary}\n' + self.getAttachmentFromFile(path).as_string()
+                              for path in attachmentFilePaths)
+        shared_tail += f'\n--{boundary}--\n'
+        subject_template = Template(subject)
+        text_template = Template(text)
+
+        for recipient in recipients:
+            values = {'to': recipient} if isinstance(recipient, str) else recipient
+            body = MIMEText(text_template.safe_substitute(values), text_type, 'utf-8')
+            yield values['to'], ''.join((
+                shared_head,
+                policy.fold('To', values['to']),
+                policy.fold('Subject', subject_template.safe_substitute(values)),
+                f'\n--{boundary}\n',
+                body.as_string(),
+                shared_tail,
+            ))
+
+    # 通过路径添加附件
+    def getAttachmentFromFile(self, attachmentFilePath):
+        """从文件路径添加附件
+        
+        Args:
+            attachmentFilePath: 附件文件路径
+        
+        Returns:
+            MIMEBase 对象
+        """
+        part = MIMEBase('application', "octet-stream")
+        with open(attachmentFilePath, "rb") as f:
+            part.set_payload(f.read())
+        encoders.encode_base64(part)
+        
+        # 使用 basename 作为附件名，防止路径泄露
+        filename = os.path.basename(attachmentFilePath)
+        part.add_header('Content-Disposition', 'attachment; filename="%s"' % str(Header(filename, 'utf-8')))
+        return part
+
+
+class SendMailDealer(MailComposer):
+
+    # 构造函数（用户名，密码，smtp服务器，端口，是否使用TLS，可选的指标收集器 MailMetrics，保活间隔秒数，断线时是否自动重连）
+    def __init__(self, user, passwd, smtp, port, usettls=False, metrics=None, keepalive=None, auto_reconnect=True):
+        """初始化SMTP连接
+        
+        Args:
+            user: 邮箱用户名
+            passwd: 密码或应用专用密码
+            smtp: SMTP服务器地址
+            port: 端口 (587用于STARTTLS, 465用于SSL)
+            usettls: 是否使用STARTTLS (True for port 587, False for port 465)
+            metrics: MailMetrics（可选），记录 SMTP 命令延迟、流量和重连次数
+            keepalive: 连接空闲超过该秒数时在后台发送 NOOP（可选），避免服务器断开空闲连接
+            auto_reconnect: 发送时连接已断开或服务器返回 421，是否重连后重试一次
+        
+        Raises:
+            MailConnectionError: 连接失败
             MailAuthError: 认证失败
         """
+        self.metrics = metrics
         self.mailUser = user
         self.mailPassword = passwd
         self.smtpServer = smtp
         self.smtpPort = port
+        self.usettls = usettls
+        self.auto_reconnect = auto_reconnect
+        self._lock = threading.RLock()
+        self._last_used = time.monotonic()
+        self._keepalive = None
         
+        self._connect()
+        self.msg = MIMEMultipart()
+        self.bcc = []
+        if keepalive:
+            self._keepalive = _KeepaliveThread(self, keepalive)
+            self._keepalive.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 建立SMTP连接并登录
+    def _connect(self):
+        """建立SMTP连接并登录
+
+        Raises:
+            MailConnectionError: 连接失败
+            MailAuthError: 认证失败
+        """
+        smtp, port = self.smtpServer, self.smtpPort
         try:
             self.mailServer = smtplib.SMTP(self.smtpServer, self.smtpPort)
+            if self.metrics is not None:
+                _instrument_smtp(self.mailServer, self.metrics)
             self.mailServer.ehlo()
-            if usettls:
+            if self.usettls:
                 self.mailServer.starttls()
                 self.mailServer.ehlo()
-            logger.info(f"Connected to SMTP server: {smtp}:{port}")
+            logger.info("Connected to SMTP server: %s:%s", smtp, port)
         except Exception as e:
-            logger.error(f"Failed to connect to SMTP server {smtp}:{port}: {e}")
+            logger.error("Failed to connect to SMTP server %s:%s: %s", smtp, port, e)
             raise MailConnectionError(f"Cannot connect to {smtp}:{port}: {e}")
         
         try:
             self.mailServer.login(self.mailUser, self.mailPassword)
-            logger.info(f"Logged in as: {user}")
+            logger.info("Logged in as: %s", self.mailUser)
         except Exception as e:
-            logger.error(f"Authentication failed for {user}: {e}")
+            logger.error("Authentication failed for %s: %s", self.mailUser, e)
             raise MailAuthError(f"Login failed: {e}")
+
+    # 断开并重新建立连接
+    def reconnect(self):
+        """关闭当前连接（忽略错误）并重新连接、登录"""
+        if self.metrics is not None:
+            self.metrics.addRetry('smtp', 'reconnect')
+        with self._lock:
+            try:
+                self.mailServer.close()
+            except Exception as e:
+                logger.debug("Error closing SMTP connection before reconnect: %s", e)
+            self._connect()
+
+    # 发送 NOOP 保持连接，连接已断开时自动重连
+    def noop(self):
+        """发送 NOOP
+
+        Returns:
+            (code, resp)
+        """
+        return self._transaction(lambda: self.mailServer.noop())
+
+    # 在连接锁内执行一次 SMTP 事务；连接已断开或服务器返回 421 时重连后重试一次
+    def _transaction(self, send):
+        with self._lock:
+            if self.mailServer is None:
+                raise MailConnectionError("SMTP connection is closed")
+            try:
+                return send()
+            except Exception as e:
+                if not self.auto_reconnect or not _is_transient_smtp_error(e):
+                    raise
+                logger.warning("SMTP connection lost, reconnecting: %s", e)
+                self.reconnect()
+                return send()
+            finally:
+                self._last_used = time.monotonic()
+
+    # 显式关闭连接（推荐使用，也可以使用 with 语句）
+    def close(self):
+        """显式关闭SMTP连接（可重复调用）"""
+        if getattr(self, '_keepalive', None) is not None:
+            self._keepalive.cancel()
+            self._keepalive = None
+        try:
+            if getattr(self, 'mailServer', None):
+                self.mailServer.quit()
+                logger.info("SMTP connection closed")
+        except Exception as e:
+            logger.warning("Error closing SMTP connection: %s", e)
+        self.mailServer = None
+
+    # 发送邮件
+    def sendMail(self):
+        """发送邮件
+
+        To、Cc 和密送地址在同一个事务中投递，邮件内容只发送一次。
+        """
+        if not self.msg['To']:
+            logger.error("No recipient specified")
+            raise MailError("没有收件人,请先设置邮件基本信息")
         
-        self.msg = MIMEMultipart()
+        try:
+            to_addrs = _envelope_addresses(self.msg['To'], self.msg['Cc'], self.bcc)
+            data = self.msg.as_string()
+
+            def send():
+                self._sendEnvelope(self.mailUser, to_addrs)
+                self._sendData(data)
+
+            self._transaction(send)
+            logger.info("Sent email to %s", self.msg['To'])
+        except Exception as e:
+            logger.error("Failed to send email: %s", e)
+            raise MailError(f"发送邮件失败: {e}")
+
+    # 发送任意邮件对象（不使用也不修改 self.msg）
+    def sendMessage(self, msg, to_addrs=None):
+        """发送指定的邮件
+
+        Args:
+            msg: email.message.Message 对象，或已序列化的 str/bytes
+            to_addrs: 收件人，字符串（可逗号分隔）或列表；默认取 msg 的 To、Cc 和 Bcc
+                （Bcc 头不会被发送出去）
+
+        Returns:
+            被拒绝的收件人字典 {地址: (code, resp)}，全部成功时为空
+
+        Raises:
+            MailError: 发送失败（原始异常见 __cause__）
+        """
+        to_addrs, data = _prepare_message(msg, to_addrs)
+        if not to_addrs:
+            logger.error("No recipient specified")
+            raise MailError("没有收件人,请先设置邮件基本信息")
+        def send():
+            refused = self._sendEnvelope(self.mailUser, to_addrs)
+            self._sendData(data)
+            return refused
 
-    # 对象销毁时，关闭mailserver
-    def __del__(self):
-        """析构函数，关闭连接"""
         try:
-            if hasattr(self, 'mailServer') and self.mailServer:
-                self.mailServer.quit()
-                logger.debug("SMTP connection closed")
+            refused = self._transaction(send)
+            logger.info("Sent email to %s", to_addrs)
+            return refused
         except Exception as e:
-            logger.warning(f"Error closing SMTP connection: {e}")
-    
-    # 显式关闭连接（推荐使用）
-    def close(self):
-        """显式关闭SMTP连接"""
+            logger.error("Failed to send email to %s: %s", to_addrs, e)
+            raise MailError(f"发送邮件失败: {e}") from e
+
+    # 发送 MAIL FROM / RCPT TO，返回被拒绝的收件人；服务器支持 PIPELINING 时一次写出全部命令
+    def _sendEnvelope(self, from_addr, to_addrs):
+        """发送信封命令（语义同 smtplib.SMTP.sendmail 的前半部分）
+
+        服务器声明 PIPELINING（RFC 2920）时，MAIL FROM 和所有 RCPT TO 一次性写出，
+        再按顺序读取应答，多收件人只需要一次往返。
+
+        Returns:
+            被拒绝的收件人字典 {地址: (code, resp)}
+
+        Raises:
+            smtplib.SMTPSenderRefused / SMTPRecipientsRefused: 发件人或全部收件人被拒绝
+        """
+        server = self.mailServer
+        server.ehlo_or_helo_if_needed()
+        if server.has_extn('pipelining'):
+            commands = [f'MAIL FROM:{smtplib.quoteaddr(from_addr)}\r\n']
+            commands.extend(f'RCPT TO:{smtplib.quoteaddr(addr)}\r\n' for addr in to_addrs)
+            if hasattr(server, '_pymail_expect'):
+                server._pymail_expect(['MAIL'] + ['RCPT'] * len(to_addrs))
+            server.send(''.join(commands))
+            replies = [server.getreply() for _ in commands]
+        else:
+            replies = None
+        code, resp = replies[0] if replies else server.mail(from_addr)
+        if code != 250:
+            if code == 421:
+                server.close()
+            else:
+                server.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+        refused = {}
+        for index, addr in enumerate(to_addrs):
+            code, resp = replies[index + 1] if replies else server.rcpt(addr)
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+            if code == 421:
+                server.close()
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(to_addrs):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        return refused
+
+    # 发送 DATA，邮件内容一次写出
+    def _sendData(self, data):
+        """发送 DATA（信封已由 _sendEnvelope 发送）
+
+        Raises:
+            smtplib.SMTPDataError: 服务器拒绝
+        """
+        server = self.mailServer
+        code, resp = server.data(data)
+        if code != 250:
+            if code == 421:
+                server.close()
+            else:
+                server.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+    # 发送 DATA，邮件内容由 chunks 逐块写入 socket
+    def _sendDataStream(self, chunks):
+        """以流的方式发送 DATA（使用 LF 换行的内容，自动转换为 CRLF 并做点转义）
+
+        Raises:
+            smtplib.SMTPDataError: 服务器拒绝
+        """
+        server = self.mailServer
+        code, resp = server.docmd('DATA')
+        if code != 354:
+            if code == 421:
+                server.close()
+            else:
+                server.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        at_line_start = True
         try:
-            if hasattr(self, 'mailServer') and self.mailServer:
-                self.mailServer.quit()
-                logger.info("SMTP connection closed")
-        except Exception as e:
-            logger.warning(f"Error closing SMTP connection: {e}")
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('ascii')
+                if not chunk:
+                    continue
+                if at_line_start and chunk[:1] == b'.':
+                    chunk = b'.' + chunk
+                chunk = chunk.replace(b'\n.', b'\n..').replace(b'\n', b'\r\n')
+                server.send(chunk)
+                at_line_start = chunk.endswith(b'\n')
+        except BaseException:
+            # DATA 已经开始，无法撤回：不发送结束的点直接关闭连接，服务器丢弃不完整的邮件
+            server.close()
+            raise
+        server.send(b'.\r\n' if at_line_start else b'\r\n.\r\n')
+        code, resp = server.getreply()
+        if code != 250:
+            if code == 421:
+                server.close()
+            raise smtplib.SMTPDataError(code, resp)
 
-    # 重新初始化邮件信息部分 (修复 Issue #9)
-    def reinitMailInfo(self):
-        """重新初始化邮件内容"""
-        self.msg = MIMEMultipart()
+    # 从文件分块读取并产出 base64 编码行（每 57 字节一行 76 字符）
+    def _iterBase64File(self, attachmentFilePath, block_size=57 * 1024):
+        with open(attachmentFilePath, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    return
+                yield b''.join(binascii.b2a_base64(block[i:i + 57]) for i in range(0, len(block), 57))
+
+    # 流式生成邮件内容：邮件头和正文一次生成，附件边读边编码
+    def _iterStreamMessage(self, receiveUser, subject, text, text_type, attachmentFilePaths, cc=None):
+        boundary = f'==============={uuid.uuid4().hex}=='
+        outer = MIMEMultipart(boundary=boundary)
+        outer['From'] = self.mailUser
+        outer['To'] = ', '.join(_address_list(receiveUser))
+        if cc:
+            outer['Cc'] = ', '.join(_address_list(cc))
+        outer['Subject'] = subject
+        outer.attach(MIMEText(text, text_type, 'utf-8'))
+        head = outer.as_string()
+        yield head[:head.rindex(f'\n--{boundary}--')]
+
+        for attachmentFilePath in attachmentFilePaths:
+            part = MIMEBase('application', "octet-stream")
+            part['Content-Transfer-Encoding'] = 'base64'
+            filename = os.path.basename(attachmentFilePath)
+            part.add_header('Content-Disposition', 'attachment; filename="%s"' % str(Header(filename, 'utf-8')))
+            yield f'\n--{boundary}\n' + part.as_string()
+            for encoded in self._iterBase64File(attachmentFilePath):
+                yield encoded
+        yield f'\n--{boundary}--\n'
+
+    # 流式发送大附件邮件：附件分块编码并直接写入 socket，内存占用与附件大小无关
+    def sendMailStream(self, receiveUser, subject, text, text_type, *attachmentFilePaths, cc=None, bcc=None):
+        """发送带大附件的邮件（不使用也不修改 self.msg）
+
+        与 setMailInfo + sendMail 生成的邮件相同，但附件在 DATA 阶段才从磁盘
+        分块读取、base64 编码并写入连接，不会把整封邮件拼成一个字符串。
 
-    # 设置邮件的基本信息（收件人，主题，正文，正文类型html或者plain，可变参数附件路径列表）
-    def setMailInfo(self, receiveUser, subject, text, text_type, *attachmentFilePaths):
-        """设置邮件基本信息
-        
         Args:
             receiveUser: 收件人邮箱
             subject: 邮件主题
             text: 邮件正文
             text_type: 正文类型 ('plain' 或 'html')
             *attachmentFilePaths: 附件文件路径列表
+            cc: 抄送
+            bcc: 密送（不写入邮件头）
+
+        Returns:
+            被拒绝的收件人字典，全部成功时为空
+
+        Raises:
+            MailError: 发送失败（原始异常见 __cause__）
         """
-        self.msg['From'] = self.mailUser
-        self.msg['To'] = receiveUser
-        self.msg['Subject'] = subject
-        self.msg.attach(MIMEText(text, text_type, 'utf-8'))
-        
+        if not receiveUser:
+            logger.error("No recipient specified")
+            raise MailError("没有收件人,请先设置邮件基本信息")
         for attachmentFilePath in attachmentFilePaths:
-            self.msg.attach(self.getAttachmentFromFile(attachmentFilePath))
+            if not os.path.isfile(attachmentFilePath):
+                raise MailError(f"附件不存在: {attachmentFilePath}")
+        def send():
+            refused = self._sendEnvelope(self.mailUser, to_addrs)
+            self._sendDataStream(self._iterStreamMessage(
+                receiveUser, subject, text, text_type, attachmentFilePaths, cc))
+            return refused
+
+        try:
+            to_addrs = _envelope_addresses(receiveUser, cc, bcc)
+            refused = self._transaction(send)
+            logger.info("Sent email to %s", receiveUser)
+            return refused
+        except Exception as e:
+            logger.error("Failed to send email to %s: %s", receiveUser, e)
+            raise MailError(f"发送邮件失败: {e}") from e
+
+    # 邮件合并并逐封发送
+    def sendMerge(self, recipients, subject, text, text_type, *attachmentFilePaths):
+        """按模板为每个收件人生成并发送邮件（参数同 buildMergeMessages）
+
+        大批量发送可改用 SendMailPool.sendBulk(dealer.buildMergeMessages(...))。
+
+        Returns:
+            结果字典列表：{index, to, ok, refused, error}
+        """
+        results = []
+        messages = self.buildMergeMessages(recipients, subject, text, text_type, *attachmentFilePaths)
+        for index, (to_addr, message) in enumerate(messages):
+            result = {'index': index, 'to': to_addr, 'ok': False, 'refused': {}, 'error': None}
+            try:
+                result['refused'] = self.sendMessage(message, to_addr)
+                result['ok'] = True
+            except MailError as e:
+                result['error'] = e
+            results.append(result)
+        return results
+
+
+# ========== SMTP 连接池 ==========
+# 判断发送异常是否为可重连重试的临时错误（连接断开、421、网络错误）
+def _is_transient_smtp_error(error):
+    cause = error.__cause__ if isinstance(error, MailError) and error.__cause__ else error
+    if isinstance(cause, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(cause, smtplib.SMTPResponseException) and cause.smtp_code == 421:
+        return True
+    # RCPT 收到 421 时服务器已关闭连接，以 SMTPRecipientsRefused 的形式抛出
+    if isinstance(cause, smtplib.SMTPRecipientsRefused) and \
+            any(code == 421 for code, _ in cause.recipients.values()):
+        return True
+    return isinstance(cause, (OSError, EOFError)) and not isinstance(cause, smtplib.SMTPException)
+
+
+# 维护多个已登录的 SendMailDealer，用工作线程并行发送一批邮件
+class SendMailPool:
+
+    def __init__(self, user, passwd, smtp, port, usettls=False, size=4, max_retries=2, metrics=None):
+        """并行建立 size 个 SMTP 连接
 
-    # 自定义邮件正文信息（正文内容，正文格式html或者plain）
-    def addTextPart(self, text, text_type):
-        """添加邮件正文部分
-        
         Args:
-            text: 正文内容
-            text_type: 格式 ('plain' 或 'html')
+            user: 邮箱用户名
+            passwd: 密码或应用专用密码
+            smtp: SMTP服务器地址
+            port: 端口
+            usettls: 是否使用STARTTLS
+            size: 连接数（注意服务商的并发连接限制）
+            max_retries: 连接断开或 421 时，重连后重试的次数（连接池负责重试，各连接自身不再重试）
+            metrics: MailMetrics（可选），由所有连接共享
+
+        Raises:
+            MailConnectionError: 连接失败
+            MailAuthError: 认证失败
         """
-        self.msg.attach(MIMEText(text, text_type, 'utf-8'))
-        
+        self.user = user
+        self.size = size
+        self.max_retries = max_retries
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            futures = [executor.submit(SendMailDealer, user, passwd, smtp, port, usettls, metrics,
+                                       auto_reconnect=False)
+                       for _ in range(size)]
+        self.dealers = []
+        error = None
+        for future in futures:
+            try:
+                self.dealers.append(future.result())
+            except MailError as e:
+                error = error or e
+        if error is not None:
+            self.close()
+            raise error
+        logger.info("SMTP pool ready with %s connections", size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 关闭所有连接
+    def close(self):
+        """关闭所有SMTP连接"""
+        for dealer in self.dealers:
+            dealer.close()
+        self.dealers = []
+
+    # 用一个连接发送一封邮件，临时错误时重连重试
+    def _sendOne(self, dealer, index, item):
+        result = {'index': index, 'to': None, 'ok': False, 'refused': {}, 'error': None, 'retries': 0}
+        if isinstance(item, tuple):
+            to_addrs, msg = item
+            result['to'] = to_addrs
+        else:
+            to_addrs, msg = None, item
+            result['to'] = item['To']
+        while True:
+            try:
+                result['refused'] = dealer.sendMessage(msg, to_addrs)
+                result['ok'] = True
+                return result
+            except MailError as e:
+                if result['retries'] >= self.max_retries or not _is_transient_smtp_error(e):
+                    result['error'] = e
+                    return result
+                result['retries'] += 1
+                logger.warning("Transient error sending message %s, reconnecting: %s", index, e)
+                try:
+                    dealer.reconnect()
+                except MailError as reconnect_error:
+                    result['error'] = reconnect_error
+                    return result
+
+    # 并行批量发送
+    def sendBulk(self, messages):
+        """把邮件分配给所有连接并行发送
 
-    # 增加附件（以流形式添加，可以添加网络获取等流格式）参数（文件名，文件流）
-    def addAttachment(self, filename, filedata):
-        """添加附件（流形式）
-        
         Args:
-            filename: 文件名
-            filedata: 文件数据（bytes）
+            messages: 可迭代对象，元素为 email.message.Message（收件人取 To、Cc、Bcc），
+                或 (收件人, 邮件) 元组（邮件可以是 Message 或已序列化的 str/bytes）
+
+        Returns:
+            结果字典列表（按输入顺序）：{index, to, ok, refused, error, retries}
         """
-        part = MIMEBase('application', "octet-stream")
-        part.set_payload(filedata)
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', 'attachment; filename="%s"' % str(Header(filename, 'utf-8')))
-        self.msg.attach(part)
+        work = queue.Queue(maxsize=self.size * 4)
+        results = {}
+        lock = threading.Lock()
 
-    # 通用方法添加邮件信息（MIMETEXT，MIMEIMAGE,MIMEBASE...）
-    def addPart(self, part):
-        """添加自定义邮件部分
-        
+        def worker(dealer):
+            while True:
+                job = work.get()
+                if job is None:
+                    return
+                # 单封邮件的任何异常都只记为这封邮件失败：工作线程退出会使有界队列的 put() 永远阻塞
+                try:
+                    result = self._sendOne(dealer, *job)
+                except Exception as e:
+                    logger.error("Failed to send message %s: %s", job[0], e)
+                    result = {'index': job[0], 'to': None, 'ok': False, 'refused': {}, 'error': e, 'retries': 0}
+                with lock:
+                    results[result['index']] = result
+
+        threads = [threading.Thread(target=worker, args=(dealer,), daemon=True) for dealer in self.dealers]
+        for thread in threads:
+            thread.start()
+        try:
+            for index, item in enumerate(messages):
+                work.put((index, item))
+        finally:
+            for _ in threads:
+                work.put(None)
+            for thread in threads:
+                thread.join()
+
+        ordered = [results[index] for index in sorted(results)]
+        failed = sum(1 for result in ordered if not result['ok'])
+        logger.info("Bulk send finished: %s sent, %s failed", len(ordered) - failed, failed)
+        return ordered
+
+
+# ========== 异步发送邮件（asyncio）==========
+_CRLF_RE = re.compile(rb'\r\n|\r(?!\n)|\n')
+_DOT_LINE_RE = re.compile(rb'(?m)^\.')
+
+
+# 单个 SMTP 连接：EHLO、STARTTLS、AUTH 以及一次邮件事务（支持 PIPELINING）
+class _AsyncSMTPConnection:
+
+    def __init__(self, reader, writer, host):
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+        self.extensions = {}
+
+    # 建立连接，读取问候并 EHLO；starttls 为 True 时升级为 TLS 后重新 EHLO
+    @classmethod
+    async def open(cls, host, port, use_ssl=False, starttls=False):
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=ssl.create_default_context() if use_ssl else None)
+        conn = cls(reader, writer, host)
+        try:
+            code, resp = await conn.readReply()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, resp)
+            await conn.ehlo()
+            if starttls:
+                if 'starttls' not in conn.extensions:
+                    raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+                code, resp = await conn.command('STARTTLS')
+                if code != 220:
+                    raise smtplib.SMTPResponseException(code, resp)
+                await conn._startTls()
+                await conn.ehlo()
+        except BaseException:
+            conn.abort()
+            raise
+        return conn
+
+    # 在现有连接上升级 TLS（Python 3.11+ 用 StreamWriter.start_tls，更早版本用 loop.start_tls）
+    async def _startTls(self):
+        context = ssl.create_default_context()
+        if hasattr(self.writer, 'start_tls'):
+            await self.writer.start_tls(context, server_hostname=self.host)
+            return
+        loop = asyncio.get_event_loop()
+        if not hasattr(loop, 'start_tls'):
+            raise smtplib.SMTPNotSupportedError("STARTTLS requires Python 3.7+ for asyncio connections.")
+        transport = self.writer.transport
+        self.writer._transport = await loop.start_tls(
+            transport, transport.get_protocol(), context, server_hostname=self.host)
+
+    # 读取一条（可能多行的）应答，返回 (code, 文本)
+    async def readReply(self):
+        lines = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                break
+        try:
+            code = int(line[:3])
+        except ValueError:
+            code = -1
+        return code, b'\n'.join(lines)
+
+    # 发送一条命令并读取应答
+    async def command(self, line):
+        self.writer.write(line.encode('ascii') + b'\r\n')
+        await self.writer.drain()
+        return await self.readReply()
+
+    async def ehlo(self):
+        address = self.writer.get_extra_info('sockname')[0]
+        code, resp = await self.command(f'EHLO [IPv6:{address}]' if ':' in address else f'EHLO [{address}]')
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, resp)
+        self.extensions = {}
+        for line in resp.decode('ascii', 'replace').split('\n')[1:]:
+            keyword, _, params = line.partition(' ')
+            self.extensions[keyword.lower()] = params.strip()
+
+    # AUTH PLAIN，服务器只支持 LOGIN 时使用 LOGIN
+    async def login(self, user, password):
+        if 'auth' not in self.extensions:
+            raise smtplib.SMTPNotSupportedError("SMTP AUTH extension not supported by server.")
+        methods = self.extensions['auth'].upper().split()
+        if 'PLAIN' in methods or 'LOGIN' not in methods:
+            token = binascii.b2a_base64(f'\0{user}\0{password}'.encode('utf-8'), newline=False).decode('ascii')
+            code, resp = await self.command(f'AUTH PLAIN {token}')
+        else:
+            code, resp = await self.command('AUTH LOGIN')
+            for value in (user, password):
+                if code != 334:
+                    break
+                code, resp = await self.command(
+                    binascii.b2a_base64(value.encode('utf-8'), newline=False).decode('ascii'))
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, resp)
+
+    # MAIL FROM / RCPT TO，语义同 SendMailDealer._sendEnvelope
+    async def sendEnvelope(self, from_addr, to_addrs):
+        commands = [f'MAIL FROM:{smtplib.quoteaddr(from_addr)}\r\n']
+        commands.extend(f'RCPT TO:{smtplib.quoteaddr(addr)}\r\n' for addr in to_addrs)
+        replies = []
+        if 'pipelining' in self.extensions:
+            self.writer.write(''.join(commands).encode('ascii'))
+            await self.writer.drain()
+            for _ in commands:
+                replies.append(await self.readReply())
+        else:
+            for line in commands:
+                replies.append(await self.command(line[:-2]))
+                if replies[0][0] != 250 or replies[-1][0] == 421:
+                    break
+        code, resp = replies[0]
+        if code != 250:
+            if code != 421:
+                await self.command('RSET')
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+        refused = {}
+        for addr, (code, resp) in zip(to_addrs, replies[1:]):
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+            if code == 421:
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(to_addrs):
+            await self.command('RSET')
+            raise smtplib.SMTPRecipientsRefused(refused)
+        return refused
+
+    # DATA：统一为 CRLF 换行并做点转义后一次写出
+    async def sendData(self, data):
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        data = _DOT_LINE_RE.sub(b'..', _CRLF_RE.sub(b'\r\n', data))
+        if not data.endswith(b'\r\n'):
+            data += b'\r\n'
+        code, resp = await self.command('DATA')
+        if code != 354:
+            # 信封已被接受，RSET 后连接才能用于下一封邮件（421 时服务器已关闭连接）
+            if code != 421:
+                await self.command('RSET')
+            raise smtplib.SMTPDataError(code, resp)
+        self.writer.write(data + b'.\r\n')
+        await self.writer.drain()
+        code, resp = await self.readReply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+
+    # QUIT 并关闭
+    async def quit(self):
+        try:
+            await self.command('QUIT')
+        finally:
+            self.abort()
+
+    # 直接关闭连接（不等待服务器应答）
+    def abort(self):
+        self.writer.close()
+
+
+# asyncio 版本的 SendMailDealer：几个 SMTP 连接在同一事件循环中并发发送，带并发上限和背压
+class AsyncSendMailDealer(MailComposer):
+
+    # 构造函数（用户名，密码，smtp服务器，端口，是否使用TLS）；需要 await open() 或 async with
+    def __init__(self, user, passwd, smtp, port, usettls=False, use_ssl=False, size=2,
+                 max_concurrency=None, max_retries=2):
+        """
         Args:
-            part: MIME part 对象
+            user: 邮箱用户名
+            passwd: 密码或应用专用密码
+            smtp: SMTP服务器地址
+            port: 端口 (587用于STARTTLS, 465用于SSL)
+            usettls: 是否使用STARTTLS
+            use_ssl: 是否直接使用SSL连接（端口 465）
+            size: 连接数（注意服务商的并发连接限制）
+            max_concurrency: 同时进行的发送数上限，默认等于 size；超出的 sendMessage 会等待
+            max_retries: 连接断开或 421 时，重连后重试的次数
         """
-        self.msg.attach(part)
+        self.mailUser = user
+        self.mailPassword = passwd
+        self.smtpServer = smtp
+        self.smtpPort = port
+        self.usettls = usettls
+        self.use_ssl = use_ssl
+        self.size = size
+        self.max_concurrency = max_concurrency or size
+        self.max_retries = max_retries
+        self.msg = MIMEMultipart()
+        self.bcc = []
+        self._idle = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    # 建立一个已登录的连接
+    async def _connect(self):
+        smtp, port = self.smtpServer, self.smtpPort
+        try:
+            conn = await _AsyncSMTPConnection.open(smtp, port, use_ssl=self.use_ssl, starttls=self.usettls)
+            logger.info("Connected to SMTP server: %s:%s", smtp, port)
+        except Exception as e:
+            logger.error("Failed to connect to SMTP server %s:%s: %s", smtp, port, e)
+            raise MailConnectionError(f"Cannot connect to {smtp}:{port}: {e}") from e
+        try:
+            await conn.login(self.mailUser, self.mailPassword)
+            logger.info("Logged in as: %s", self.mailUser)
+        except Exception as e:
+            conn.abort()
+            logger.error("Authentication failed for %s: %s", self.mailUser, e)
+            raise MailAuthError(f"Login failed: {e}") from e
+        return conn
+
+    # 并发建立 size 个连接
+    async def open(self):
+        """连接并登录
+
+        Raises:
+            MailConnectionError: 连接失败
+            MailAuthError: 认证失败
+        """
+        self._idle = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*[self._connect() for _ in range(self.size)], return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for result in results:
+            if not isinstance(result, BaseException):
+                self._idle.put_nowait(result)
+        if errors:
+            await self.close()
+            raise errors[0]
+        return self
+
+    # 关闭所有连接
+    async def close(self):
+        """关闭所有SMTP连接（可重复调用）；之后的发送抛出 MailConnectionError，直到再次 open()"""
+        idle, self._idle, self._semaphore = self._idle, None, None
+        if idle is None:
+            return
+        while not idle.empty():
+            conn = idle.get_nowait()
+            if conn is None:
+                continue
+            try:
+                await conn.quit()
+            except Exception as e:
+                logger.warning("Error closing SMTP connection: %s", e)
+        logger.info("SMTP connections closed")
+
+    # 借用一个连接发送一封邮件，临时错误时重连重试，返回 (被拒绝的收件人, 重试次数)
+    async def _deliver(self, to_addrs, data):
+        """
+        Raises:
+            MailError: 发送失败（原始异常见 __cause__）
+        """
+        retries = 0
+        idle = self._idle
+        if idle is None:
+            raise MailConnectionError("Not connected, call open() first")
+        async with self._semaphore:
+            conn = await idle.get()
+            try:
+                while True:
+                    try:
+                        if conn is None:
+                            conn = await self._connect()
+                        refused = await conn.sendEnvelope(self.mailUser, to_addrs)
+                        await conn.sendData(data)
+                        return refused, retries
+                    except asyncio.CancelledError:
+                        if conn is not None:
+                            conn.abort()
+                            conn = None
+                        raise
+                    except Exception as e:
+                        transient = _is_transient_smtp_error(e)
+                        # 服务器拒绝（已 RSET）时连接可以继续使用，其他异常后连接状态未知
+                        known_state = isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+                        if (transient or not known_state) and conn is not None:
+                            conn.abort()
+                            conn = None
+                        if isinstance(e, MailError) or not transient or retries >= self.max_retries:
+                            logger.error("Failed to send email to %s: %s", to_addrs, e)
+                            if isinstance(e, MailError):
+                                raise
+                            raise MailError(f"发送邮件失败: {e}") from e
+                        retries += 1
+                        logger.warning("Transient error sending to %s, reconnecting: %s", to_addrs, e)
+            finally:
+                if idle is self._idle:
+                    idle.put_nowait(conn)
+                elif conn is not None:
+                    # 发送期间调用了 close()
+                    conn.abort()
+
+    # 发送任意邮件对象（不使用也不修改 self.msg）
+    async def sendMessage(self, msg, to_addrs=None):
+        """发送指定的邮件；多个协程可同时调用，超过 max_concurrency 时等待空闲连接
+
+        Args:
+            msg: email.message.Message 对象，或已序列化的 str/bytes
+            to_addrs: 收件人，字符串（可逗号分隔）或列表；默认取 msg 的 To、Cc 和 Bcc
+
+        Returns:
+            被拒绝的收件人字典 {地址: (code, resp)}，全部成功时为空
+
+        Raises:
+            MailError: 发送失败（原始异常见 __cause__）
+        """
+        to_addrs, data = _prepare_message(msg, to_addrs)
+        if not to_addrs:
+            logger.error("No recipient specified")
+            raise MailError("没有收件人,请先设置邮件基本信息")
+        if self._idle is None:
+            raise MailConnectionError("Not connected, call open() first")
+        refused, _ = await self._deliver(to_addrs, data)
+        logger.info("Sent email to %s", to_addrs)
+        return refused
 
     # 发送邮件
-    def sendMail(self):
-        """发送邮件"""
+    async def sendMail(self):
+        """发送 setMailInfo 设置的邮件（To、Cc 和密送地址）"""
         if not self.msg['To']:
             logger.error("No recipient specified")
             raise MailError("没有收件人,请先设置邮件基本信息")
-        
+        return await self.sendMessage(self.msg, _envelope_addresses(self.msg['To'], self.msg['Cc'], self.bcc))
+
+    # 并发批量发送
+    async def sendBulk(self, messages):
+        """并发发送一批邮件，messages 按需读取，最多 2 * max_concurrency 封在途
+
+        Args:
+            messages: 可迭代对象，元素为 email.message.Message（收件人取 To、Cc、Bcc），
+                或 (收件人, 邮件) 元组（邮件可以是 Message 或已序列化的 str/bytes）
+
+        Returns:
+            结果字典列表（按输入顺序）：{index, to, ok, refused, error, retries}
+        """
+        results = {}
+
+        async def send(index, result, item):
+            if isinstance(item, tuple):
+                to_addrs, msg = item
+                result['to'] = to_addrs
+            else:
+                to_addrs, msg = None, item
+                result['to'] = item['To']
+            to_addrs, data = _prepare_message(msg, to_addrs)
+            if not to_addrs:
+                raise MailError("没有收件人,请先设置邮件基本信息")
+            result['refused'], result['retries'] = await self._deliver(to_addrs, data)
+            result['ok'] = True
+
+        # 任务的异常（包括 item['To']、_prepare_message 的错误）记入对应邮件的结果
+        def collect(tasks):
+            for task in tasks:
+                if not task.cancelled() and task.exception() is not None:
+                    error = task.exception()
+                    logger.error("Failed to send message %s: %s", tasks[task]['index'], error)
+                    tasks[task]['error'] = error
+
+        pending = {}
         try:
-            self.mailServer.sendmail(self.mailUser, self.msg['To'], self.msg.as_string())
-            logger.info(f"Sent email to {self.msg['To']}")
-            print(f'Sent email to {self.msg["To"]}')
-        except Exception as e:
-            logger.error(f"Failed to send email: {e}")
-            raise MailError(f"发送邮件失败: {e}")
+            for index, item in enumerate(messages):
+                if len(pending) >= 2 * self.max_concurrency:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    collect({task: pending.pop(task) for task in done})
+                result = {'index': index, 'to': None, 'ok': False, 'refused': {}, 'error': None, 'retries': 0}
+                results[index] = result
+                pending[asyncio.ensure_future(send(index, result, item))] = result
+            await asyncio.gather(*pending, return_exceptions=True)
+            collect(pending)
+        finally:
+            for task in pending:
+                task.cancel()
+
+        ordered = [results[index] for index in sorted(results)]
+        failed = sum(1 for result in ordered if not result['ok'])
+        logger.info("Bulk send finished: %s sent, %s failed", len(ordered) - failed, failed)
+        return ordered
+
+
+# ========== 持久化发件队列 ==========
+# 令牌桶限速：每秒补充 rate 个令牌，最多积累 burst 个
+class _TokenBucket:
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    # 取一个令牌，返回取得令牌前需要等待的秒数
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    # 归还取得后没有使用的令牌
+    def release(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+# 发送失败的收件人中，应稍后重试的（4xx）
+def _temporary_recipients(refused):
+    return [addr for addr, (code, _) in refused.items() if 400 <= code < 500]
+
+
+# 持久化发件队列：邮件先写入 SQLite，再由 process()/run() 通过 SendMailDealer 发送
+class OutboundQueue:
+
+    def __init__(self, path, rate=None, burst=1, rate_limits=None, max_attempts=8,
+                 base_delay=60, max_delay=3600, keep_sent=False, lease=600):
+        """打开（或新建）队列数据库
+
+        取出的邮件记录取出者和租约到期时间，多个进程可以共用同一个队列；
+        取出者在租约到期前没有记录结果（如进程崩溃）时，邮件由其他进程（或重启后的进程）
+        重新取出（至少投递一次，进程崩溃时可能重复发送）。
 
-    # 通过路径添加附件
-    def getAttachmentFromFile(self, attachmentFilePath):
-        """从文件路径添加附件
-        
         Args:
-            attachmentFilePath: 附件文件路径
-        
+            path: SQLite 数据库文件路径
+            rate: 每个发件账号每秒最多发送的邮件数（None 表示不限速）
+            burst: 令牌桶容量，允许的突发发送数
+            rate_limits: 按账号覆盖限速，{账号: (rate, burst)}
+            max_attempts: 临时错误（4xx、连接断开）最多尝试次数，超过后转入死信
+            base_delay: 第一次重试的等待秒数，之后每次翻倍
+            max_delay: 重试等待的上限秒数
+            keep_sent: 是否保留已发送的记录（默认发送成功后删除）
+            lease: 取出一封邮件后独占的秒数，应大于发送一封邮件的最长耗时
+        """
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.rate_limits = dict(rate_limits or {})
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.keep_sent = keep_sent
+        self.lease = lease
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account TEXT NOT NULL DEFAULT '',
+                to_addrs TEXT NOT NULL,
+                message NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                last_error TEXT,
+                created REAL NOT NULL,
+                owner TEXT,
+                lease_until REAL)''')
+            # 旧版本创建的队列没有租约字段，其中发送中的邮件视为租约已过期
+            columns = {row[1] for row in self.db.execute('PRAGMA table_info(outbox)')}
+            for column, kind in (('owner', 'TEXT'), ('lease_until', 'REAL')):
+                if column not in columns:
+                    self.db.execute(f'ALTER TABLE outbox ADD COLUMN {column} {kind}')
+            self.db.execute('CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)')
+            expired = self.db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status = 'sending' AND (lease_until IS NULL OR lease_until < ?)",
+                (time.time(),)).fetchone()[0]
+        if expired:
+            logger.warning("%s messages interrupted while sending will be sent again", expired)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """关闭数据库"""
+        self.db.close()
+
+    # 邮件入队
+    def enqueue(self, msg, to_addrs=None, account=None):
+        """把邮件写入队列，立即返回
+
+        Args:
+            msg: email.message.Message 对象，或已序列化的 str/bytes
+            to_addrs: 收件人，字符串（可逗号分隔）或列表；默认取 msg 的 To、Cc 和 Bcc
+            account: 指定由哪个发件账号发送（默认任意账号）
+
         Returns:
-            MIMEBase 对象
+            队列中的邮件 id
+
+        Raises:
+            MailError: 没有收件人
         """
-        part = MIMEBase('application', "octet-stream")
-        with open(attachmentFilePath, "rb") as f:
-            part.set_payload(f.read())
-        encoders.encode_base64(part)
-        
-        # 使用 basename 作为附件名，防止路径泄露
-        filename = os.path.basename(attachmentFilePath)
-        part.add_header('Content-Disposition', 'attachment; filename="%s"' % str(Header(filename, 'utf-8')))
-        return part
+        to_addrs, data = _prepare_message(msg, to_addrs)
+        if not to_addrs:
+            logger.error("No recipient specified")
+            raise MailError("没有收件人,请先设置邮件基本信息")
+        now = time.time()
+        with self._lock, self.db:
+            cursor = self.db.execute(
+                'INSERT INTO outbox (account, to_addrs, message, next_attempt, created) VALUES (?, ?, ?, ?, ?)',
+                (account or '', json.dumps(to_addrs), data, now, now))
+        return cursor.lastrowid
+
+    # 取出下一封到期的邮件（或租约已过期的发送中邮件），标记为由本队列对象发送
+    def _claim(self, account):
+        while True:
+            with self._lock, self.db:
+                now = time.time()
+                row = self.db.execute(
+                    "SELECT id, to_addrs, message, attempts FROM outbox WHERE account IN ('', ?) AND "
+                    "((status = 'queued' AND next_attempt <= ?) OR "
+                    "(status = 'sending' AND (lease_until IS NULL OR lease_until < ?))) "
+                    "ORDER BY next_attempt, id LIMIT 1",
+                    (account, now, now)).fetchone()
+                if row is None:
+                    return None
+                # 条件更新：其他进程先取走时 rowcount 为 0，重新查找
+                claimed = self.db.execute(
+                    "UPDATE outbox SET status = 'sending', owner = ?, lease_until = ? WHERE id = ? AND "
+                    "(status = 'queued' OR (status = 'sending' AND (lease_until IS NULL OR lease_until < ?)))",
+                    (self.owner, now + self.lease, row[0], now)).rowcount
+            if claimed:
+                return row
+
+    # 记录发送结果：status 为 sent / queued（稍后重试）/ dead
+    def _finish(self, msg_id, status, attempts, error=None, to_addrs=None):
+        with self._lock, self.db:
+            if status == 'sent' and not self.keep_sent:
+                cursor = self.db.execute('DELETE FROM outbox WHERE id = ? AND owner = ?', (msg_id, self.owner))
+            else:
+                delay = min(self.max_delay, self.base_delay * 2 ** max(0, attempts - 1))
+                cursor = self.db.execute(
+                    'UPDATE outbox SET status = ?, attempts = ?, next_attempt = ?, last_error = ?, '
+                    'to_addrs = COALESCE(?, to_addrs), owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?',
+                    (status, attempts, time.time() + delay, None if error is None else str(error),
+                     None if to_addrs is None else json.dumps(to_addrs), msg_id, self.owner))
+        if not cursor.rowcount:
+            logger.warning("Lease on message %s expired before it was %s", msg_id, status)
+
+    # 放回队列，不计入尝试次数（发件账号本身的问题，如认证失败）
+    def _release(self, msg_id):
+        with self._lock, self.db:
+            self.db.execute(
+                "UPDATE outbox SET status = 'queued', owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?",
+                (msg_id, self.owner))
+
+    # 临时失败：还有重试次数时按指数退避重新排队，否则转入死信
+    def _retryLater(self, msg_id, attempts, error, to_addrs=None):
+        if attempts >= self.max_attempts:
+            logger.error("Message %s dead-lettered after %s attempts: %s", msg_id, attempts, error)
+            self._finish(msg_id, 'dead', attempts, error, to_addrs)
+            return 'dead'
+        logger.warning("Message %s will be retried (attempt %s): %s", msg_id, attempts, error)
+        self._finish(msg_id, 'queued', attempts, error, to_addrs)
+        return 'retry'
+
+    def _bucket(self, account):
+        bucket = self._buckets.get(account)
+        if bucket is None:
+            rate, burst = self.rate_limits.get(account, (self.rate, self.burst))
+            bucket = self._buckets[account] = _TokenBucket(rate, burst) if rate else None
+        return bucket
+
+    # 发送一封已取出的邮件，返回 sent / retry / dead
+    def _sendOne(self, dealer, msg_id, to_addrs, data, attempts):
+        attempts += 1
+        try:
+            refused = dealer.sendMessage(data, to_addrs)
+        except MailError as e:
+            cause = e.__cause__
+            if isinstance(cause, MailAuthError):
+                # 自动重连时认证失败：与邮件无关，放回队列，作为整个队列的错误交给调用方
+                self._release(msg_id)
+                raise cause
+            if isinstance(cause, smtplib.SMTPRecipientsRefused) and len(cause.recipients) == len(to_addrs):
+                refused = cause.recipients
+            elif _is_transient_smtp_error(e) or isinstance(cause, smtplib.SMTPRecipientsRefused):
+                try:
+                    dealer.reconnect()
+                except MailAuthError:
+                    self._release(msg_id)
+                    raise
+                except MailError as reconnect_error:
+                    logger.warning("Reconnect failed: %s", reconnect_error)
+                return self._retryLater(msg_id, attempts, e)
+            elif isinstance(cause, smtplib.SMTPResponseException) and 400 <= cause.smtp_code < 500:
+                return self._retryLater(msg_id, attempts, e)
+            else:
+                logger.error("Message %s dead-lettered: %s", msg_id, e)
+                self._finish(msg_id, 'dead', attempts, e)
+                return 'dead'
+        retry_addrs = _temporary_recipients(refused)
+        if retry_addrs:
+            return self._retryLater(msg_id, attempts, f'Recipients refused: {refused}', retry_addrs)
+        if len(refused) == len(to_addrs):
+            logger.error("Message %s dead-lettered, all recipients refused: %s", msg_id, refused)
+            self._finish(msg_id, 'dead', attempts, f'Recipients refused: {refused}')
+            return 'dead'
+        self._finish(msg_id, 'sent', attempts, f'Recipients refused: {refused}' if refused else None)
+        return 'sent'
+
+    # 发送所有已到期的邮件
+    def process(self, dealer, limit=None):
+        """用 dealer 发送队列中已到期的邮件（按账号限速），没有到期邮件时返回
+
+        Args:
+            dealer: 已连接的 SendMailDealer，发件账号为 dealer.mailUser
+            limit: 本次最多处理的邮件数
+
+        Returns:
+            本次处理结果计数 {'sent': n, 'retry': n, 'dead': n}
+
+        Raises:
+            MailAuthError: 发件账号认证失败（当前邮件放回队列，不计入尝试次数）
+        """
+        account = dealer.mailUser
+        bucket = self._bucket(account)
+        counts = {'sent': 0, 'retry': 0, 'dead': 0}
+        while limit is None or sum(counts.values()) < limit:
+            # 先等令牌再取出邮件，等待时间不占用租约
+            if bucket is not None:
+                time.sleep(bucket.reserve())
+            row = self._claim(account)
+            if row is None:
+                if bucket is not None:
+                    bucket.release()
+                break
+            msg_id, to_addrs, data, attempts = row
+            counts[self._sendOne(dealer, msg_id, json.loads(to_addrs), data, attempts)] += 1
+        if any(counts.values()):
+            logger.info("Outbound queue processed: %s", counts)
+        return counts
+
+    # 持续发送，直到 stop_event 被设置
+    def run(self, dealer, poll_interval=5.0, stop_event=None):
+        """循环调用 process()，队列空闲时每 poll_interval 秒检查一次
+
+        Args:
+            dealer: 已连接的 SendMailDealer
+            poll_interval: 空闲时的检查间隔（秒）
+            stop_event: threading.Event，设置后退出循环
+
+        Raises:
+            MailAuthError: 发件账号认证失败
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            if not any(self.process(dealer).values()):
+                stop_event.wait(poll_interval)
+
+    # 各状态的邮件数
+    def counts(self):
+        """返回 {状态: 邮件数}，状态为 queued / sending / sent / dead"""
+        with self._lock:
+            return dict(self.db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+
+    # 死信列表
+    def deadLetters(self):
+        """返回死信列表 [{id, account, to, attempts, error, created}]"""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT id, account, to_addrs, attempts, last_error, created FROM outbox "
+                "WHERE status = 'dead' ORDER BY id").fetchall()
+        return [{'id': row[0], 'account': row[1], 'to': json.loads(row[2]), 'attempts': row[3],
+                 'error': row[4], 'created': row[5]} for row in rows]
+
+    # 死信重新排队
+    def retryDead(self, ids=None):
+        """把死信（默认全部）重新排队并清零尝试次数，返回重新排队的数量"""
+        with self._lock, self.db:
+            if ids is None:
+                cursor = self.db.execute(
+                    "UPDATE outbox SET status = 'queued', attempts = 0, next_attempt = ? WHERE status = 'dead'",
+                    (time.time(),))
+            else:
+                cursor = self.db.executemany(
+                    "UPDATE outbox SET status = 'queued', attempts = 0, next_attempt = ? "
+                    "WHERE status = 'dead' AND id = ?", [(time.time(), msg_id) for msg_id in ids])
+        return cursor.rowcount
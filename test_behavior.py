@@ -0,0 +1,947 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+行为测试
+
+在本机启动 fake_servers.py 中的模拟 IMAP / SMTP 服务器，验证 IDLE、断线重连、批量标记/移动/删除、流式遍历、增量同步、缓存、连接池、批量发送、邮件合并、流式发送等需要真实连接的功能。
+
+用法:
+    python -m pytest -q test_behavior.py
+    python -m unittest test_behavior
+"""
+
+import asyncio
+import email
+import json
+import mailbox
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from email.encoders import encode_quopri
+from email.mime.application import MIMEApplication
+from email.mime.message import MIMEMessage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pyMail
+from fake_servers import FakeIMAPHandler, FakeMailbox, FakeSMTPHandler, ServerStats, make_small, start_server
+
+
+def _message(subject='hello', to='user@example.com'):
+    msg = MIMEText('body of %s' % subject, 'plain', 'utf-8')
+    msg['From'] = 'sender@example.com'
+    msg['To'] = to
+    msg['Subject'] = subject
+    return msg
+
+
+class IMAPTestCase(unittest.TestCase):
+    """启动模拟 IMAP 服务器：INBOX 中 10 封邮件（主题 Weekly report #1 ~ #10），空的 Archive"""
+
+    capabilities = FakeIMAPHandler.capabilities
+
+    def setUp(self):
+        self.mailbox = FakeMailbox()
+        for i in range(1, 11):
+            self.mailbox.append('INBOX', make_small(i))
+        self.mailbox.create('Archive')
+        self.faults = {}
+        self.stats = ServerStats()
+        self.server, self.port = start_server(FakeIMAPHandler, self.stats, mailbox=self.mailbox,
+                                               faults=self.faults, capabilities=self.capabilities)
+        self.dealer = self.connect()
+
+    def tearDown(self):
+        self.dealer.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def connect(self, **kwargs):
+        return pyMail.ReceiveMailDealer('user', 'password', '127.0.0.1', port=self.port, use_ssl=False, **kwargs)
+
+    # 文件夹中各邮件的序号（按 Weekly report #n 的 n）
+    def numbers(self, folder):
+        with self.mailbox.lock:
+            return [int(m['headers']['SUBJECT'].rsplit('#', 1)[1]) for m in self.mailbox.folders[folder]]
+
+    def flags(self, folder):
+        with self.mailbox.lock:
+            return [set(m['flags']) for m in self.mailbox.folders[folder]]
+
+    # delay 秒后由“另一个客户端”添加一封邮件
+    def appendLater(self, number, delay=0.2):
+        timer = threading.Timer(delay, self.mailbox.append, ('INBOX', make_small(number)))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+
+class IdleTest(IMAPTestCase):
+
+    def test_idle_yields_new_messages(self):
+        self.appendLater(11)
+        for new_ids in self.dealer.idle(timeout=5):
+            break
+        else:
+            self.fail('IDLE timed out without new mail')
+        self.assertEqual(new_ids, ['11'])
+        self.assertEqual(self.dealer.exists, 11)
+        # IDLE 结束后连接仍可正常使用
+        self.assertEqual(self.dealer.getAll()[1], [b' '.join(str(i).encode() for i in range(1, 12))])
+
+    def test_idle_after_callback_moves_messages(self):
+        # 回调移走 2 封后新邮件以 "* 10 EXISTS" 到达，仍应产出
+        self.appendLater(11)
+        batches = []
+        for new_ids in self.dealer.idle(timeout=5):
+            batches.append(new_ids)
+            if len(batches) == 2:
+                break
+            self.dealer.move(['1', '2'], 'Archive')
+            self.appendLater(12)
+        self.assertEqual(batches, [['11'], ['10']])
+        self.assertEqual(self.dealer.getMailInfo('10', want=('subject',))['subject'], 'Weekly report #12')
+
+    def test_idle_starts_from_current_count(self):
+        # 直接 EXPUNGE 使 SELECT 时记录的邮件数过期
+        self.dealer.mail.store('1:2', '+FLAGS.SILENT', '(\\Deleted)')
+        self.dealer.mail.expunge()
+        self.appendLater(11)
+        for new_ids in self.dealer.idle(timeout=5):
+            break
+        else:
+            self.fail('IDLE timed out without new mail')
+        self.assertEqual(new_ids, ['9'])
+
+    def test_idle_connection_lost(self):
+        timer = threading.Timer(0.2, self.dealer.mail.sock.shutdown, (socket.SHUT_RDWR,))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with self.assertRaises(pyMail.MailConnectionError):
+            list(self.dealer.idle(timeout=5))
+
+    def test_idle_times_out_without_mail(self):
+        start = time.monotonic()
+        self.assertEqual(list(self.dealer.idle(timeout=0.3)), [])
+        self.assertLess(time.monotonic() - start, 3)
+
+
+class SearchQueryTest(IMAPTestCase):
+
+    def test_query_is_one_search(self):
+        with self.mailbox.lock:
+            self.mailbox.folders['INBOX'][2]['flags'].add('\\Seen')
+        query = (pyMail.SearchQuery().subject('#3') | pyMail.SearchQuery().subject('#4')) & ~pyMail.SearchQuery().seen()
+        before = self.stats.snapshot()['commands']
+        self.assertEqual(self.dealer.searchQuery(query), ('OK', [b'4']))
+        self.assertEqual(self.stats.snapshot()['commands'] - before, 1)
+
+    def test_searchStats_uses_esearch(self):
+        with self.mailbox.lock:
+            self.mailbox.folders['INBOX'][0]['flags'].add('\\Seen')
+        stats = self.dealer.searchStats(pyMail.SearchQuery().unseen())
+        self.assertEqual(stats, {'count': 9, 'min': 2, 'max': 10})
+
+    def test_search_no_is_not_retried(self):
+        self.faults['SEARCH'] = 'NO [BADCHARSET (US-ASCII)] unsupported charset'
+        before = self.stats.snapshot()['commands']
+        with self.assertRaises(pyMail.MailFetchError):
+            self.dealer.searchQuery(pyMail.SearchQuery().subject('报告'))
+        self.assertEqual(self.stats.snapshot()['commands'] - before, 1)
+
+    def test_searchStats_ignores_esearch_all(self):
+        # 服务器在 COUNT / MIN / MAX 之外还返回 ALL 1:5,9 之类的 sequence-set
+        search = self.dealer._searchCompiled
+        self.dealer._searchCompiled = lambda *args, **kwargs: search(*args, **dict(kwargs, returns='COUNT MIN MAX ALL'))
+        self.mailbox.folders['INBOX'][5]['flags'].add('\\Seen')
+        stats = self.dealer.searchStats(pyMail.SearchQuery().unseen())
+        self.assertEqual(stats, {'count': 9, 'min': 1, 'max': 10})
+
+
+class ReconnectTest(IMAPTestCase):
+
+    def test_search_reconnects_and_restores_folder(self):
+        self.mailbox.append('Archive', make_small(42))
+        self.dealer.select('Archive')
+        self.faults['SEARCH'] = 'drop'
+        typ, data = self.dealer.searchQuery(pyMail.SearchQuery().all(), uid=True)
+        self.assertEqual((typ, data), ('OK', [b'1']))
+        self.assertEqual(self.dealer.folder, 'Archive')
+        self.assertEqual(self.dealer.getMailInfo('1', want=('subject',))['subject'], 'Weekly report #42')
+
+    def test_sequence_search_is_not_replayed(self):
+        self.dealer.select('Archive')
+        self.faults['SEARCH'] = 'drop'
+        with self.assertRaises(pyMail.MailConnectionError):
+            self.dealer.searchQuery(pyMail.SearchQuery().all())
+        self.assertEqual(self.dealer.folder, 'Archive')
+        self.assertEqual(self.dealer.search(None, 'ALL'), ('OK', [b'']))
+
+    def test_fetch_retried_after_drop(self):
+        self.faults['FETCH'] = 'drop'
+        info = self.dealer.getMailInfo('3', want=('subject',), uid=True)
+        self.assertEqual(info['subject'], 'Weekly report #3')
+
+    def test_sequence_fetch_is_not_replayed(self):
+        before = self.stats.snapshot()['commands']
+        self.dealer.reconnect()
+        reconnect = self.stats.snapshot()['commands'] - before
+        self.faults['FETCH'] = 'drop'
+        before = self.stats.snapshot()['commands']
+        with self.assertRaises(pyMail.MailConnectionError):
+            self.dealer.getMailInfo('3', want=('subject',))
+        # 断开的 FETCH 加上重连，重连后没有再发 FETCH
+        self.assertEqual(self.stats.snapshot()['commands'] - before, reconnect + 1)
+        self.assertEqual(self.dealer.getMailInfo('3', want=('subject',))['subject'], 'Weekly report #3')
+
+    def test_move_is_not_retried(self):
+        self.faults['MOVE'] = 'drop'
+        with self.assertRaises(pyMail.MailError):
+            self.dealer.move('1', 'Archive')
+        self.assertEqual(self.numbers('Archive'), [])
+
+    def test_search_error_reselects_current_folder(self):
+        self.mailbox.append('Archive', make_small(42))
+        self.dealer.select('Archive')
+        self.faults['SEARCH'] = 'BAD try again'
+        self.assertEqual(self.dealer.search(None, 'ALL'), ('OK', [b'1']))
+        self.assertEqual(self.dealer.folder, 'Archive')
+
+    def test_reconnect_creates_new_connection(self):
+        old = self.dealer.mail
+        self.dealer.reconnect()
+        self.assertIsNot(self.dealer.mail, old)
+        self.assertEqual(self.dealer.exists, 10)
+        self.faults['FETCH'] = 'drop'
+        self.assertEqual(self.dealer.getMailInfo('2', want=('subject',), uid=True)['subject'], 'Weekly report #2')
+
+    def test_store_is_not_retried(self):
+        self.faults['STORE'] = 'drop'
+        with self.assertRaises(pyMail.MailError):
+            self.dealer.markSeen('1')
+        self.assertEqual(self.flags('INBOX')[0], set())
+
+    def test_no_reconnect_when_disabled(self):
+        dealer = self.connect(auto_reconnect=False)
+        self.addCleanup(dealer.close)
+        self.faults['FETCH'] = 'drop'
+        with self.assertRaises(Exception):
+            dealer.getMailInfo('1')
+
+
+class BulkOperationTest(IMAPTestCase):
+
+    def test_markSeen_and_setFlags(self):
+        self.assertEqual(self.dealer.markSeen(['1', '2', '3', '7']), 1)
+        self.assertEqual([('\\Seen' in flags) for flags in self.flags('INBOX')],
+                         [True, True, True, False, False, False, True, False, False, False])
+        self.dealer.markSeen('2 3', seen=False)
+        self.dealer.setFlags([4, 5], ['\\Flagged', 'Processed'])
+        flags = self.flags('INBOX')
+        self.assertEqual(flags[1], set())
+        self.assertEqual(flags[4], {'\\Flagged', 'Processed'})
+
+    def test_move_by_sequence_number(self):
+        moved = self.dealer.move(['2', '4', '6'], 'Archive')
+        self.assertEqual(moved, 3)
+        self.assertEqual(self.numbers('Archive'), [2, 4, 6])
+        self.assertEqual(self.numbers('INBOX'), [1, 3, 5, 7, 8, 9, 10])
+        self.assertEqual(self.dealer.exists, 7)
+
+    def test_move_split_into_several_sets(self):
+        original = pyMail._chunk_id_set.__defaults__
+        pyMail._chunk_id_set.__defaults__ = (4,)
+        try:
+            self.assertEqual(self.dealer.move(['1', '3', '5', '7', '9'], 'Archive'), 5)
+        finally:
+            pyMail._chunk_id_set.__defaults__ = original
+        self.assertEqual(sorted(self.numbers('Archive')), [1, 3, 5, 7, 9])
+        self.assertEqual(self.numbers('INBOX'), [2, 4, 6, 8, 10])
+
+    def test_delete_by_uid(self):
+        self.assertEqual(self.dealer.delete(['8', '9'], uid=True), 2)
+        self.assertEqual(self.numbers('INBOX'), [1, 2, 3, 4, 5, 6, 7, 10])
+
+    def test_move_to_missing_folder(self):
+        with self.assertRaises(pyMail.MailError):
+            self.dealer.move('1', 'Nope')
+        self.assertEqual(len(self.numbers('INBOX')), 10)
+
+
+class BulkFallbackTest(IMAPTestCase):
+    """服务器不支持 MOVE：COPY + STORE \\Deleted + UID EXPUNGE"""
+
+    capabilities = 'IMAP4rev1 UIDPLUS'
+
+    def test_move_leaves_other_deleted_messages(self):
+        with self.mailbox.lock:
+            self.mailbox.folders['INBOX'][9]['flags'].add('\\Deleted')
+        self.assertEqual(self.dealer.move(['1', '2'], 'Archive', uid=True), 2)
+        self.assertEqual(self.numbers('Archive'), [1, 2])
+        self.assertEqual(self.numbers('INBOX'), [3, 4, 5, 6, 7, 8, 9, 10])
+
+
+class IterMailTest(IMAPTestCase):
+    """INBOX 中再加 #11（约 30 KB 附件）和 #12（约 200 KB 附件）"""
+
+    def setUp(self):
+        super().setUp()
+        self.payloads = {}
+        for number, size in ((11, 30000), (12, 200000)):
+            msg = MIMEMultipart()
+            msg['Subject'] = 'Weekly report #%d' % number
+            msg.attach(MIMEText('see attached', 'plain', 'utf-8'))
+            self.payloads[number] = os.urandom(size)
+            attachment = MIMEApplication(self.payloads[number])
+            attachment.add_header('Content-Disposition', 'attachment', filename='dump%d.bin' % number)
+            msg.attach(attachment)
+            self.mailbox.append('INBOX', msg.as_bytes().replace(b'\n', b'\r\n'))
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+
+    def commands(self):
+        return self.stats.snapshot()['commands']
+
+    def test_want_headers_only_fetches_header(self):
+        infos = list(self.dealer.getMailInfoBatch(['2', '12'], want=('subject',)))
+        self.assertEqual(infos, [('2', {'subject': 'Weekly report #2'}), ('12', {'subject': 'Weekly report #12'})])
+        # 只获取 BODY.PEEK[HEADER]：不传输附件，也不标记已读
+        self.assertLess(self.stats.snapshot()['bytes_out'], 10000)
+        self.assertEqual(self.flags('INBOX')[1], set())
+
+    def test_byte_cap_streams_every_message(self):
+        expected = list(self.dealer.iterMail(max_inflight_bytes=None))
+        # 上限 150 KB：每组 3 封、每封先取约 16 KB，#11 补取一次，#12 分段写入临时文件
+        capped = list(self.dealer.iterMail(max_inflight_bytes=150000))
+        self.assertEqual([num for num, _ in capped], [str(i) for i in range(1, 13)])
+        self.assertEqual(capped, expected)
+        self.assertEqual([a['data'] for a in capped[-1][1]['attachments']], [self.payloads[12]])
+        for num, info in self.dealer.iterMail(max_inflight_bytes=150000, save_dir=self.tmp):
+            self.assertEqual(info['subject'], 'Weekly report #%s' % num)
+        for number, payload in self.payloads.items():
+            with open(os.path.join(self.tmp, 'dump%d.bin' % number), 'rb') as f:
+                self.assertEqual(f.read(), payload)
+
+    def test_byte_cap_with_workers(self):
+        # 超过上限的 #12 以 mmap 产出，交给进程池前复制为 bytes
+        mails = self.dealer.iterMail(max_inflight_bytes=150000, workers=2, want=('subject', 'attachments'))
+        sizes = {num: [a['size'] for a in info['attachments']] for num, info in mails}
+        self.assertEqual(sizes['12'], [len(self.payloads[12])])
+        self.assertEqual(len(sizes), 12)
+
+    def test_sizes_come_with_the_body(self):
+        before = self.commands()
+        self.assertEqual(len(list(self.dealer.iterMail(chunk_size=20))), 12)
+        self.assertEqual(self.commands() - before, 2)  # SEARCH + 一条 FETCH
+
+    def test_next_fetch_is_pipelined(self):
+        before = self.commands()
+        mails = self.dealer.iterMail(chunk_size=4, max_inflight_bytes=None)
+        self.assertEqual(next(mails)[0], '1')
+        deadline = time.monotonic() + 2
+        while self.commands() - before < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.commands() - before, 3)  # SEARCH + 当前组和下一组的 FETCH
+        # 遍历中执行其他命令不会取走预取的 FETCH 应答
+        self.assertEqual(self.dealer.search(None, 'ALL')[1][0].split()[-1], b'12')
+        rest = [(num, info['subject']) for num, info in mails]
+        self.assertEqual(rest, [(str(i), 'Weekly report #%d' % i) for i in range(2, 13)])
+
+    def test_connection_lost_during_pipelined_fetch(self):
+        mails = self.dealer.iterMail(chunk_size=4, max_inflight_bytes=None)
+        self.assertEqual(next(mails)[0], '1')
+        self.faults['FETCH'] = 'drop'
+        # 按序号遍历不会在新连接上重新获取，由调用方重新搜索
+        with self.assertRaises(pyMail.MailConnectionError):
+            list(mails)
+        self.assertEqual([num for num, _ in self.dealer.iterMail(chunk_size=4)], [str(i) for i in range(1, 13)])
+
+
+class AsyncReceiveMailDealerTest(IMAPTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 10))
+
+    def test_getMailInfoBatch_pipelines_in_order(self):
+        nums = ['7', '8', '9', '10', '1', '2', '3', '4', '5', '6']
+
+        async def fetch():
+            async with pyMail.AsyncReceiveMailDealer('user', 'password', '127.0.0.1', port=self.port,
+                                                     use_ssl=False) as dealer:
+                command = dealer.conn.command
+                events = []
+
+                async def recording(*args):
+                    events.append('send')
+                    try:
+                        return await command(*args)
+                    finally:
+                        events.append('done')
+
+                dealer.conn.command = recording
+                before = self.stats.snapshot()['commands']
+                result = [(num, info['subject']) async for num, info in dealer.getMailInfoBatch(nums, chunk_size=3)]
+                return result, self.stats.snapshot()['commands'] - before, list(events)
+
+        result, commands, events = self.wait(fetch())
+        self.assertEqual(result, [(num, 'Weekly report #%s' % num) for num in nums])
+        # 4 条 FETCH 在第一条完成前全部发出，只等待一次往返
+        self.assertEqual(commands, 4)
+        self.assertEqual(events, ['send'] * 4 + ['done'] * 4)
+
+
+class SyncFolderTest(IMAPTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.path = os.path.join(self.tmp, 'checkpoint.json')
+
+    def test_incremental_sync(self):
+        synced = [uid for uid, _ in self.dealer.syncFolder('INBOX', pyMail.SyncCheckpoint(self.path), chunk_size=4)]
+        self.assertEqual(synced, [str(i) for i in range(1, 11)])
+        self.mailbox.append('INBOX', make_small(11))
+        self.mailbox.append('INBOX', make_small(12))
+        checkpoint = pyMail.SyncCheckpoint(self.path)
+        self.assertEqual(checkpoint.get('INBOX')['last_uid'], 10)
+        synced = [(uid, info['subject']) for uid, info in self.dealer.syncFolder('INBOX', checkpoint)]
+        self.assertEqual(synced, [('11', 'Weekly report #11'), ('12', 'Weekly report #12')])
+        self.assertEqual(list(self.dealer.syncFolder('INBOX', checkpoint)), [])
+        self.assertEqual(pyMail.SyncCheckpoint(self.path).get('INBOX')['last_uid'], 12)
+
+    def test_sync_does_not_mark_seen(self):
+        self.assertEqual(len(list(self.dealer.syncFolder('INBOX', pyMail.SyncCheckpoint(self.path)))), 10)
+        self.assertEqual(self.flags('INBOX'), [set()] * 10)
+
+    def test_break_keeps_progress(self):
+        for uid, _ in self.dealer.syncFolder('INBOX', pyMail.SyncCheckpoint(self.path), chunk_size=4):
+            if uid == '6':
+                break
+        # #6 已产出但调用方没有请求下一封，不计入进度
+        self.assertEqual(pyMail.SyncCheckpoint(self.path).get('INBOX')['last_uid'], 5)
+        synced = [uid for uid, _ in self.dealer.syncFolder('INBOX', pyMail.SyncCheckpoint(self.path))]
+        self.assertEqual(synced, [str(i) for i in range(6, 11)])
+
+
+class MailIndexTest(IMAPTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.index = pyMail.MailIndex(':memory:')
+        self.addCleanup(self.index.close)
+
+    def test_update_purges_only_when_uidvalidity_changes(self):
+        purges = []
+        delete = self.index._delete
+
+        def _delete(folder, uids=None, keep_uidvalidity=None):
+            if uids is None:
+                purges.append(keep_uidvalidity)
+            return delete(folder, uids, keep_uidvalidity)
+
+        self.index._delete = _delete
+        self.assertEqual(self.index.update(self.dealer, 'INBOX', chunk_size=3), 10)
+        self.assertEqual(purges, [1])  # 只在首次保存同步状态时清理一次
+        self.assertEqual(self.index.count('INBOX'), 10)
+        self.index.set('INBOX', dict(self.index.get('INBOX'), uidvalidity=2))
+        self.assertEqual(purges, [1, 2])
+        self.assertEqual(self.index.count('INBOX'), 0)
+
+
+    def test_search_finds_synced_mail(self):
+        self.index.update(self.dealer, 'INBOX')
+        hits = self.index.search('report #7', folder='INBOX')
+        self.assertEqual([(hit['uid'], hit['subject']) for hit in hits], [('7', 'Weekly report #7')])
+
+
+class MailCacheTest(IMAPTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+
+    def subjects(self, dealer):
+        return [info['subject'] for _, info in dealer.iterMail()]
+
+    def test_second_pass_served_from_memory(self):
+        cache = pyMail.MailCache()
+        dealer = self.connect(cache=cache)
+        self.addCleanup(dealer.close)
+        expected = ['Weekly report #%d' % i for i in range(1, 11)]
+        self.assertEqual(self.subjects(dealer), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 10))
+        self.assertEqual(self.subjects(dealer), expected)
+        self.assertEqual((cache.hits, cache.misses), (10, 10))
+        self.assertEqual(dealer.getMailInfo('3')['subject'], 'Weekly report #3')
+        self.assertEqual(cache.hits, 11)
+
+    def test_disk_cache_survives_new_dealer(self):
+        first = self.connect(cache=pyMail.MailCache(directory=self.tmp))
+        self.addCleanup(first.close)
+        self.subjects(first)
+        cache = pyMail.MailCache(directory=self.tmp)
+        second = self.connect(cache=cache)
+        self.addCleanup(second.close)
+        self.assertEqual(len(self.subjects(second)), 10)
+        self.assertEqual((cache.hits, cache.misses), (10, 0))
+
+    def test_uidvalidity_change_misses(self):
+        cache = pyMail.MailCache()
+        dealer = self.connect(cache=cache)
+        self.addCleanup(dealer.close)
+        self.subjects(dealer)
+        dealer.uidvalidity += 1
+        self.subjects(dealer)
+        self.assertEqual((cache.hits, cache.misses), (0, 20))
+
+
+class ReceiveMailPoolTest(IMAPTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(11, 14):
+            self.mailbox.append('Archive', make_small(i))
+        self.pool = pyMail.ReceiveMailPool('user', 'password', '127.0.0.1', size=2, port=self.port, use_ssl=False)
+        self.addCleanup(self.pool.close)
+
+    def test_batch_keeps_order(self):
+        infos = list(self.pool.getMailInfoBatch(['7', '2', '9', '1', '5'], chunk_size=2))
+        self.assertEqual([(num, info['subject']) for num, info in infos],
+                         [(str(i), 'Weekly report #%d' % i) for i in (7, 2, 9, 1, 5)])
+
+    def test_iter_folders(self):
+        items = [(folder, info['subject']) for folder, _, info in
+                 self.pool.iterFolders(['Archive', 'INBOX'], chunk_size=3)]
+        self.assertEqual(items, [('Archive', 'Weekly report #%d' % i) for i in range(11, 14)]
+                         + [('INBOX', 'Weekly report #%d' % i) for i in range(1, 11)])
+
+
+class MailMetricsTest(unittest.TestCase):
+
+    def test_failing_span_exporter_does_not_escape(self):
+        def exporter(span):
+            raise RuntimeError('collector down')
+
+        metrics = pyMail.MailMetrics(on_span=exporter)
+        with metrics.span('sync INBOX'):
+            pass
+        # with 块自己的异常不被导出失败掩盖
+        with self.assertRaises(KeyError):
+            with metrics.span('sync INBOX'):
+                raise KeyError('boom')
+
+
+class MailInfoTest(unittest.TestCase):
+
+    def setUp(self):
+        msg = MIMEMultipart()
+        msg['Subject'] = '=?utf-8?b?5pyI5bqm5oql5ZGK?='
+        msg['From'] = 'Boss <boss@example.com>'
+        msg['To'] = 'team@example.com'
+        msg.attach(MIMEText('see attachment', 'plain', 'utf-8'))
+        attachment = MIMEApplication(b'%PDF-1.4', 'pdf')
+        attachment.add_header('Content-Disposition', 'attachment', filename='report.pdf')
+        msg.attach(attachment)
+        self.raw = msg.as_bytes()
+
+    def test_default_is_plain_dict(self):
+        info = pyMail.MailParser().parseMailBytes(self.raw, want=('subject', 'from', 'to', 'body'))
+        self.assertIs(type(info), dict)
+        info['label'] = 'inbox'
+        self.assertEqual(json.loads(json.dumps(info))['subject'], '月度报告')
+
+    def test_compact_is_mutable_and_exports_dict(self):
+        parser = pyMail.MailParser()
+        parser.compact = True
+        info = parser.parseMailBytes(self.raw)
+        self.assertIsInstance(info, pyMail.MailInfo)
+        self.assertIsInstance(info['attachments'][0], pyMail.Attachment)
+        self.assertEqual(info.toDict(), pyMail.MailParser().parseMailBytes(self.raw))
+        info['subject'] = 'renamed'
+        info['attachments'][0]['data'] = None
+        del info['html']
+        self.assertEqual(info.subject, 'renamed')
+        self.assertNotIn('html', info)
+        with self.assertRaises(KeyError):
+            info['label'] = 'inbox'
+        exported = info.toDict()
+        self.assertIs(type(exported['attachments'][0]), dict)
+        self.assertEqual(json.loads(json.dumps(exported))['from'], ['Boss', 'boss@example.com'])
+
+
+class RawAttachmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        msg = MIMEMultipart()
+        msg['Subject'] = 'files'
+        msg.attach(MIMEText('see attachments', 'plain', 'utf-8'))
+        for name, data, encoder in (('a.bin', os.urandom(300000), None), ('q.bin', bytes(range(256)) * 300, encode_quopri)):
+            part = MIMEApplication(data, 'octet-stream', **({'_encoder': encoder} if encoder else {}))
+            part.add_header('Content-Disposition', 'attachment', filename=name)
+            msg.attach(part)
+        inner = MIMEMultipart()
+        inner.attach(MIMEText('<p>inner</p>', 'html'))
+        msg.attach(MIMEMessage(inner))
+        self.msg = msg
+        self.raw = msg.as_bytes()
+
+    def saved(self, info):
+        result = []
+        for attachment in info['attachments']:
+            with open(attachment.pop('path'), 'rb') as f:
+                result.append(f.read())
+        return result
+
+    def test_raw_path_matches_message_path(self):
+        parser = pyMail.MailParser()
+        for raw in (self.raw, self.raw.replace(b'\n', b'\r\n')):
+            expected = parser.parseMailInfo(email.message_from_bytes(raw), save_dir=os.path.join(self.tmp, 'msg'))
+            info = parser.parseMailBytes(raw, save_dir=os.path.join(self.tmp, 'raw'))
+            self.assertEqual(self.saved(info), self.saved(expected))
+            self.assertEqual(info, expected)
+            self.assertEqual(info['html'], '<p>inner</p>')
+
+    def test_want_returns_subset_of_full_parse(self):
+        parser = pyMail.MailParser()
+        full = parser.parseMailBytes(self.raw)
+        for want in (('subject',), ('subject', 'from', 'to'), ('body', 'html'), ('attachments',)):
+            self.assertEqual(parser.parseMailBytes(self.raw, want=want), {name: full[name] for name in want})
+        info = parser.parseMailBytes(self.raw, save_dir=self.tmp, want=('subject', 'body'))
+        self.assertEqual(info, {'subject': 'files', 'body': 'see attachments'})
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_raw_path_memory_does_not_grow_with_attachment(self):
+        part = MIMEApplication(os.urandom(4 * 1024 * 1024), 'octet-stream')
+        part.add_header('Content-Disposition', 'attachment', filename='big.bin')
+        self.msg.attach(part)
+        raw = self.msg.as_bytes()
+        tracemalloc.start()
+        try:
+            pyMail.MailParser().parseMailBytes(raw, save_dir=self.tmp)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 1024 * 1024)
+
+    def test_parallel_parse_from_shared_memory(self):
+        part = MIMEApplication(os.urandom(2 * 1024 * 1024), 'octet-stream')
+        part.add_header('Content-Disposition', 'attachment', filename='big.bin')
+        self.msg.attach(part)
+        items = [('1', self.msg.as_bytes()), ('2', self.raw)]
+        parser = pyMail.MailParser()
+        for want in (None, ('subject',), ('subject', 'attachments')):
+            expected = [(num, parser.parseMailBytes(raw, want=want)) for num, raw in items]
+            self.assertEqual(list(parser.parseMailParallel(iter(items), workers=1, want=want)), expected)
+            self.assertEqual(parser.parseMailBytes(memoryview(items[0][1]), want=want), expected[0][1])
+        results = list(parser.parseMailParallel(iter(items), workers=1, save_dir=self.tmp))
+        self.assertEqual([len(info['attachments']) for _, info in results], [3, 2])
+
+
+class LocalMailReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.raws = [make_small(i) for i in range(1, 4)]
+
+    def subjects(self, reader):
+        with reader:
+            return [info['subject'] for _, info in reader.getMailInfoBatch(want=('subject',))]
+
+    def test_mbox(self):
+        path = os.path.join(self.tmp, 'archive.mbox')
+        box = mailbox.mbox(path)
+        for raw in self.raws:
+            box.add(raw)
+        box.close()
+        reader = pyMail.LocalMailReader(path)
+        self.assertEqual(reader.keys(), ['1', '2', '3'])
+        self.assertEqual(self.subjects(reader), ['Weekly report #1', 'Weekly report #2', 'Weekly report #3'])
+
+    def test_maildir_matches_message_parse(self):
+        box = mailbox.Maildir(os.path.join(self.tmp, 'Maildir'))
+        for raw in self.raws:
+            box.add(raw)
+        with pyMail.LocalMailReader(box._path) as reader:
+            self.assertEqual(reader.format, 'maildir')
+            infos = sorted(info['subject'] for _, info in reader.getMailInfoBatch())
+            self.assertEqual(infos, ['Weekly report #1', 'Weekly report #2', 'Weekly report #3'])
+            num = reader.keys()[0]
+            self.assertEqual(reader.getMailInfo(num), reader.parseMailBytes(reader.getRaw(num)))
+
+
+class SMTPTestCase(unittest.TestCase):
+    """启动模拟 SMTP 服务器，收到的邮件记录在 self.received"""
+
+    def setUp(self):
+        self.received = []
+        self.faults = {}
+        self.server, self.port = start_server(FakeSMTPHandler, ServerStats(), received=self.received,
+                                               faults=self.faults)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def dealer(self, **kwargs):
+        dealer = pyMail.SendMailDealer('sender@example.com', 'password', '127.0.0.1', self.port, **kwargs)
+        self.addCleanup(dealer.close)
+        return dealer
+
+    def recipients(self):
+        return sorted(address for _, rcpts, _ in self.received for address in rcpts)
+
+
+class MailMergeTest(SMTPTestCase):
+
+    def test_sendMerge_personalises_around_shared_attachment(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        path = os.path.join(tmp, 'report.bin')
+        data = os.urandom(50000)
+        with open(path, 'wb') as f:
+            f.write(data)
+        recipients = ['a@example.com', {'to': 'b@example.com', 'name': '张三'}]
+        results = self.dealer().sendMerge(recipients, 'Hello $name', 'Dear $name,', 'plain', path)
+        self.assertEqual([(r['to'], r['ok']) for r in results], [('a@example.com', True), ('b@example.com', True)])
+        parser = pyMail.MailParser()
+        infos = [parser.parseMailBytes(raw) for _, _, raw in self.received]
+        self.assertEqual([(info['to'][1], info['subject'], info['body']) for info in infos],
+                         [('a@example.com', 'Hello $name', 'Dear $name,'),
+                          ('b@example.com', 'Hello 张三', 'Dear 张三,')])
+        self.assertEqual([info['attachments'][0]['data'] for info in infos], [data, data])
+
+
+class SendMailDealerTest(SMTPTestCase):
+
+    def test_reconnects_after_421(self):
+        dealer = self.dealer()
+        self.faults['MAIL'] = '421 service shutting down'
+        self.assertEqual(dealer.sendMessage(_message()), {})
+        self.assertEqual(self.recipients(), ['user@example.com'])
+
+    def test_partial_refusal(self):
+        refused = self.dealer().sendMessage(_message(), ['a@example.com', 'reject@example.com'])
+        self.assertEqual(list(refused), ['reject@example.com'])
+        self.assertEqual(self.recipients(), ['a@example.com'])
+
+    def attachment(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        path = os.path.join(tmp, 'report.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(200000))
+        return path
+
+    def test_stream_rejected_data_resets_transaction(self):
+        dealer = self.dealer()
+        self.faults['DATA'] = '554 rejected'
+        with self.assertRaises(pyMail.MailError):
+            dealer.sendMailStream('user@example.com', 'big', 'see attachment', 'plain', self.attachment())
+        self.assertEqual(dealer.sendMessage(_message()), {})
+        self.assertEqual(self.recipients(), ['user@example.com'])
+
+    def test_stream_error_mid_data_discards_message(self):
+        dealer = self.dealer()
+
+        def broken(path, block_size=57 * 1024):
+            yield b'QUJD\n'
+            raise OSError('disk error')
+
+        dealer._iterBase64File = broken
+        with self.assertRaises(pyMail.MailError):
+            dealer.sendMailStream('user@example.com', 'big', 'see attachment', 'plain', self.attachment())
+        self.assertEqual(self.received, [])
+        self.assertEqual(dealer.sendMessage(_message()), {})
+        self.assertEqual(self.recipients(), ['user@example.com'])
+
+
+class SendMailPoolTest(SMTPTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pool = pyMail.SendMailPool('sender@example.com', 'password', '127.0.0.1', self.port, size=2)
+        self.addCleanup(self.pool.close)
+
+    def test_sendBulk_results_in_order(self):
+        messages = [('user%d@example.com' % i, _message('#%d' % i)) for i in range(20)]
+        messages[5] = ('reject@example.com', _message('#5'))
+        results = self.pool.sendBulk(messages)
+        self.assertEqual([r['index'] for r in results], list(range(20)))
+        self.assertEqual([r['ok'] for r in results], [i != 5 for i in range(20)])
+        self.assertIsInstance(results[5]['error'], pyMail.MailError)
+        self.assertEqual(len(self.received), 19)
+
+    def test_sendBulk_survives_dropped_connection(self):
+        self.faults['DATA'] = 'drop'
+        results = self.pool.sendBulk([_message('#%d' % i, 'user%d@example.com' % i) for i in range(6)])
+        self.assertTrue(all(r['ok'] for r in results), results)
+        self.assertEqual(len(self.received), 6)
+
+    def test_sendBulk_records_broken_items(self):
+        messages = [_message('#%d' % i, 'user%d@example.com' % i) for i in range(20)]
+        messages[3] = messages[4] = messages[11] = 42
+        results = self.pool.sendBulk(messages)
+        self.assertEqual([r['ok'] for r in results], [i not in (3, 4, 11) for i in range(20)])
+        self.assertIsInstance(results[3]['error'], TypeError)
+        self.assertEqual(len(self.received), 17)
+
+    def test_single_retry_layer(self):
+        self.faults['MAIL'] = '421 closing'
+        results = self.pool.sendBulk([_message('#1', 'user1@example.com')])
+        self.assertTrue(results[0]['ok'], results)
+        self.assertEqual(results[0]['retries'], 1)
+        self.assertEqual(len(self.received), 1)
+
+
+class AsyncSendMailDealerTest(SMTPTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.dealer = pyMail.AsyncSendMailDealer('sender@example.com', 'password', '127.0.0.1', self.port, size=1)
+        self.wait(self.dealer.open())
+        self.addCleanup(self.wait, self.dealer.close())
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 10))
+
+    def test_rejected_data_resets_connection(self):
+        self.faults['DATA'] = '554 rejected'
+        results = self.wait(self.dealer.sendBulk([_message('#%d' % i, 'user%d@example.com' % i) for i in range(3)]))
+        self.assertEqual([r['ok'] for r in results], [False, True, True])
+        self.assertEqual(self.recipients(), ['user1@example.com', 'user2@example.com'])
+
+    def test_421_on_rcpt_reconnects(self):
+        self.faults['RCPT'] = '421 closing'
+        results = self.wait(self.dealer.sendBulk([_message('#1', 'user1@example.com')]))
+        self.assertTrue(results[0]['ok'], results)
+        self.assertEqual(results[0]['retries'], 1)
+        self.assertEqual(self.recipients(), ['user1@example.com'])
+
+    def test_sendBulk_records_broken_items(self):
+        messages = [_message('#%d' % i, 'user%d@example.com' % i) for i in range(6)]
+        messages[2] = 42
+        messages[4] = ('user4@example.com', object())
+        results = self.wait(self.dealer.sendBulk(messages))
+        self.assertEqual([r['ok'] for r in results], [True, True, False, True, False, True])
+        self.assertIsInstance(results[2]['error'], TypeError)
+        self.assertEqual(len(self.received), 4)
+
+    def test_send_after_close_raises(self):
+        self.wait(self.dealer.close())
+        with self.assertRaises(pyMail.MailConnectionError):
+            self.wait(self.dealer.sendMessage(_message()))
+
+
+class OutboundQueueTest(SMTPTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.path = os.path.join(self.tmp, 'outbox.db')
+
+    def queue(self, **kwargs):
+        outbox = pyMail.OutboundQueue(self.path, base_delay=0, **kwargs)
+        self.addCleanup(outbox.close)
+        return outbox
+
+    def test_process_sends_and_dead_letters(self):
+        outbox = self.queue()
+        outbox.enqueue(_message('a'), 'a@example.com')
+        outbox.enqueue(_message('b'), ['b@example.com', 'reject@example.com'])
+        outbox.enqueue(_message('c'), 'reject@example.com')
+        self.assertEqual(outbox.process(self.dealer()), {'sent': 2, 'retry': 0, 'dead': 1})
+        self.assertEqual(self.recipients(), ['a@example.com', 'b@example.com'])
+        self.assertEqual([d['to'] for d in outbox.deadLetters()], [['reject@example.com']])
+        self.assertEqual(outbox.counts(), {'dead': 1})
+
+    def test_temporary_failure_retried(self):
+        outbox = self.queue()
+        outbox.enqueue(_message(), 'a@example.com')
+        self.faults['RCPT'] = '450 mailbox busy'
+        dealer = self.dealer()
+        self.assertEqual(outbox.process(dealer, limit=1), {'sent': 0, 'retry': 1, 'dead': 0})
+        self.assertEqual(outbox.process(dealer), {'sent': 1, 'retry': 0, 'dead': 0})
+        self.assertEqual(self.recipients(), ['a@example.com'])
+
+    def test_queue_survives_reopen(self):
+        self.queue().enqueue(_message(), 'a@example.com')
+        outbox = self.queue()
+        self.assertEqual(outbox.counts(), {'queued': 1})
+        self.assertEqual(outbox.process(self.dealer())['sent'], 1)
+
+    def test_sending_message_is_not_taken_by_another_queue(self):
+        first = self.queue()
+        first.enqueue(_message(), 'a@example.com')
+        self.assertIsNotNone(first._claim('sender@example.com'))
+        # 另一个进程打开同一个队列：租约未过期，不会重复发送
+        second = self.queue()
+        self.assertEqual(second.counts(), {'sending': 1})
+        self.assertEqual(second.process(self.dealer())['sent'], 0)
+        self.assertEqual(self.recipients(), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        first = self.queue(lease=0.05)
+        first.enqueue(_message(), 'a@example.com')
+        msg_id = first._claim('sender@example.com')[0]
+        time.sleep(0.1)
+        self.assertEqual(self.queue().process(self.dealer())['sent'], 1)
+        # 原取出者的租约已被接管，它记录的结果不覆盖接管者的
+        first._finish(msg_id, 'queued', 1, 'late')
+        self.assertEqual(self.queue().counts(), {})
+
+    def test_rate_limit_wait_is_not_under_lease(self):
+        outbox = self.queue(rate=20)
+        outbox.enqueue(_message('a'), 'a@example.com')
+        outbox.enqueue(_message('b'), 'b@example.com')
+        waits = []
+        sleep = pyMail.time.sleep
+
+        def record(seconds):
+            # 等待令牌期间没有已取出的邮件，等待时间不计入租约
+            waits.append((seconds, outbox.counts().get('sending', 0)))
+            sleep(seconds)
+
+        pyMail.time.sleep = record
+        try:
+            self.assertEqual(outbox.process(self.dealer()), {'sent': 2, 'retry': 0, 'dead': 0})
+        finally:
+            pyMail.time.sleep = sleep
+        self.assertTrue(any(seconds > 0 for seconds, _ in waits))
+        self.assertEqual([sending for _, sending in waits], [0] * len(waits))
+        self.assertEqual(self.recipients(), ['a@example.com', 'b@example.com'])
+
+    def test_auth_failure_is_not_dead_lettered(self):
+        outbox = self.queue(max_attempts=1)
+        outbox.enqueue(_message(), 'a@example.com')
+        dealer = self.dealer()
+        # 连接断开后密码已被修改：重连认证失败
+        self.faults['MAIL'] = '421 closing'
+        self.server.RequestHandlerClass.password = 'changed'
+        with self.assertRaises(pyMail.MailAuthError):
+            outbox.process(dealer)
+        self.assertEqual(outbox.counts(), {'queued': 1})
+        self.assertEqual(outbox.deadLetters(), [])
+        self.server.RequestHandlerClass.password = None
+        dealer.reconnect()
+        self.assertEqual(outbox.process(dealer)['sent'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
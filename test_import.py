@@ -25,7 +25,12 @@ print("\n2. Testing classes...")
 try:
     assert hasattr(pyMail, 'ReceiveMailDealer'), "ReceiveMailDealer not found"
     assert hasattr(pyMail, 'SendMailDealer'), "SendMailDealer not found"
-    print("✅ Both classes found")
+    for name in ['MailParser', 'LazyMail', 'SyncCheckpoint', 'MailCache', 'ReceiveMailPool',
+                 'AsyncReceiveMailDealer', 'SendMailPool', 'MailComposer', 'AsyncSendMailDealer',
+                 'OutboundQueue', 'SearchQuery', 'MailIndex', 'LocalMailReader', 'MailMetrics',
+                 'MailInfo', 'Attachment']:
+        assert hasattr(pyMail, name), f"{name} not found"
+    print("✅ All classes found")
 except AssertionError as e:
     print(f"❌ Class check failed: {e}")
     sys.exit(1)
@@ -45,7 +50,12 @@ except AssertionError as e:
 # 测试 ReceiveMailDealer 的新方法
 print("\n4. Testing ReceiveMailDealer methods...")
 try:
-    methods = ['getUnread', 'getAll', 'searchBySubject', 'searchBySender', 'searchByDateRange']
+    methods = ['getUnread', 'getAll', 'searchBySubject', 'searchBySender', 'searchByDateRange',
+               'getMailInfoBatch', 'parseMailInfo', 'parseMailBytes', 'parseMailParallel', 'iterMail',
+               'getLazyMail', 'getLazyMailBatch',
+               'folderStatus', 'syncFolder', 'close', 'idle', 'idleLoop',
+               'searchQuery', 'searchStats', 'reconnect', 'noop', '__enter__', '__exit__',
+               'setFlags', 'markSeen', 'move', 'delete']
     for method in methods:
         assert hasattr(pyMail.ReceiveMailDealer, method), f"{method} not found"
     print(f"✅ All {len(methods)} methods found")
@@ -56,7 +66,9 @@ except AssertionError as e:
 # 测试 SendMailDealer 的方法
 print("\n5. Testing SendMailDealer methods...")
 try:
-    methods = ['setMailInfo', 'sendMail', 'addTextPart', 'addAttachment', 'reinitMailInfo', 'close']
+    methods = ['setMailInfo', 'sendMail', 'addTextPart', 'addAttachment', 'reinitMailInfo', 'close',
+               'sendMessage', 'reconnect', 'buildMergeMessages', 'sendMerge',
+               'sendMailStream', 'noop', '__enter__', '__exit__']
     for method in methods:
         assert hasattr(pyMail.SendMailDealer, method), f"{method} not found"
     print(f"✅ All {len(methods)} methods found")